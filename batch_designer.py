@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import seq_designer
+from topology_cache import TopologyCache
+
+
+# Scaffold sequences of the current worker process, keyed by scaffold name
+worker_scaffolds = {}
+
+
+def find_files(paths, extension=None):
+    """
+    Returns the sorted files in the given paths, directories are expanded
+    to the files they contain, optionally only those with given extension.
+    """
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                file = os.path.join(path, name)
+                if os.path.isfile(file) and (extension is None or name.endswith(extension)):
+                    files.append(file)
+        else:
+            files.append(path)
+
+    return files
+
+
+def design_names(json_files):
+    """
+    Returns the name of every design, its path relative to the directory
+    all designs are in, without extension. Raises an InputError if two
+    designs get the same name.
+    """
+
+    paths = [os.path.abspath(json_file) for json_file in json_files]
+    if len(paths) == 0:
+        return []
+    root = os.path.commonpath([os.path.dirname(path) for path in paths])
+
+    names = [os.path.splitext(os.path.relpath(path, root))[0] for path in paths]
+
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if len(duplicates) != 0:
+        raise seq_designer.InputError("Designs given more than once: " + ", ".join(duplicates))
+
+    return names
+
+
+def init_worker(scaffolds):
+    """
+    Stores the parsed scaffold sequences once per worker process.
+    """
+
+    worker_scaffolds.update(scaffolds)
+
+
+def run_job(json_file, scaffold_name, output_directory, seed, compress, cache_directory=None,
+            break_circular=None, design_name=None):
+    """
+    Sequences a single design against a single scaffold and writes its
+    output files to a folder named after design_name, the name of the json
+    file by default, and the scaffold. Never raises, failures are returned
+    in the job summary. Parsed designs are shared through the topology
+    cache in cache_directory, if given. Circular strands fail the job
+    unless break_circular gives the position to break them at.
+    """
+
+    if design_name is None:
+        design_name = os.path.splitext(os.path.basename(json_file))[0]
+    job = {
+        'json': json_file,
+        'scaffold': scaffold_name,
+        'output': os.path.join(output_directory, design_name + "_" + scaffold_name),
+        'status': 'ok',
+    }
+
+    time_start = time.perf_counter()
+
+    try:
+        cache = None
+        if cache_directory is not None:
+            cache = TopologyCache(cache_directory)
+
+        result = seq_designer.design(
+            json_file, worker_scaffolds[scaffold_name], rng=seed, cache=cache,
+            breakCircular=break_circular)
+        time_design = time.perf_counter()
+
+        result.WriteFiles(compress=compress, directoryName=job['output'])
+        time_write = time.perf_counter()
+
+        job['scaffolds'] = len(result.scaffolds)
+        job['staples'] = len(result.staples)
+        job['warnings'] = len(result.warnings)
+        job['design_seconds'] = time_design - time_start
+        job['write_seconds'] = time_write - time_design
+        job['profile'] = result.Profile()
+
+    except seq_designer.SequenceDesignerError as error:
+        job['status'] = 'failed'
+        job['error'] = type(error).__name__ + ": " + str(error)
+
+    except Exception as error:
+        job['status'] = 'error'
+        job['error'] = type(error).__name__ + ": " + str(error)
+        job['traceback'] = traceback.format_exc()
+
+    job['seconds'] = time.perf_counter() - time_start
+
+    return job
+
+
+def run_batch(json_files, scaffold_files, output_directory, workers=None, seed=0, compress=False,
+              cache_directory=None, break_circular=None):
+    """
+    Sequences every design against every scaffold in a process pool.
+    Scaffold files are parsed once and shared with the workers. Output
+    folders are named after the path of a design relative to the directory
+    all designs are in and the scaffold. Writes a manifest.json with a
+    summary and timings of every job to the output directory and returns
+    it. Parsed designs are reused across scaffolds through the topology
+    cache in cache_directory, across batches as well, or in a temporary
+    directory if not given. The first job of a design parses it, the jobs
+    of its other scaffolds start once it is done.
+    """
+
+    time_start = time.perf_counter()
+
+    names = design_names(json_files)
+
+    scaffolds = {}
+    for scaffold_file in scaffold_files:
+        scaffolds[os.path.basename(scaffold_file)] = seq_designer.RawScaffoldSequence(
+            scaffold_file)
+    scaffold_names = list(scaffolds)
+
+    os.makedirs(output_directory, exist_ok=True)
+
+    with tempfile.TemporaryDirectory() as temporary_directory, \
+            ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                initargs=(scaffolds,)) as executor:
+        if cache_directory is None:
+            cache_directory = temporary_directory
+
+        def submit(design, scaffold):
+            future = executor.submit(run_job, json_files[design], scaffold_names[scaffold], output_directory,
+                                     seed, compress, cache_directory, break_circular, names[design])
+            futures[future] = (design, scaffold)
+            return future
+
+        futures = {}
+        pending = set()
+        if len(scaffold_names) != 0:
+            pending = set(submit(design, 0) for design in range(len(json_files)))
+
+        jobs = {}
+        while len(pending) != 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                design, scaffold = futures[future]
+
+                # A worker that died takes its job down, but not the batch
+                try:
+                    jobs[design, scaffold] = future.result()
+                except Exception as error:
+                    jobs[design, scaffold] = {
+                        'json': json_files[design],
+                        'scaffold': scaffold_names[scaffold],
+                        'status': 'error',
+                        'error': type(error).__name__ + ": " + str(error),
+                    }
+
+                # The design is cached now
+                if scaffold == 0:
+                    for other in range(1, len(scaffold_names)):
+                        pending.add(submit(design, other))
+
+        jobs = [jobs[key] for key in sorted(jobs)]
+
+    manifest = {
+        'jobs': jobs,
+        'succeeded': sum(job['status'] == 'ok' for job in jobs),
+        'failed': sum(job['status'] != 'ok' for job in jobs),
+        'seconds': time.perf_counter() - time_start,
+    }
+
+    with open(os.path.join(output_directory, "manifest.json"), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+    return manifest
+
+
+def main(argv=None):
+    """
+    Command line interface of the batch mode
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Sequence many cadnano designs against many scaffolds in parallel.")
+    parser.add_argument("json", nargs="+",
+                        help="cadnano .json files or directories containing them")
+    parser.add_argument("--scaffolds", nargs="+", required=True,
+                        help="scaffold sequence files or directories containing them")
+    parser.add_argument("--output", default="batch_output",
+                        help="output directory (default: batch_output)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed for secondary scaffolds (default: 0)")
+    parser.add_argument("--compress", action="store_true",
+                        help="write gzip compressed output files")
+    parser.add_argument("--cache", metavar="DIRECTORY",
+                        help="cache parsed designs in this directory")
+    parser.add_argument("--break-circular", type=int, metavar="POSITION",
+                        help="break circular strands POSITION bases after their first base instead of failing")
+    args = parser.parse_args(argv)
+
+    json_files = find_files(args.json, ".json")
+    scaffold_files = find_files(args.scaffolds)
+
+    try:
+        manifest = run_batch(json_files, scaffold_files, args.output,
+                             args.workers, args.seed, args.compress, args.cache,
+                             args.break_circular)
+    except seq_designer.SequenceDesignerError as error:
+        sys.exit(str(error))
+
+    print(str(manifest['succeeded']) + " succeeded, " + str(manifest['failed']) +
+          " failed in " + "{:.2f}".format(manifest['seconds']) + " seconds")
+    print("Manifest written to " +
+          os.path.join(args.output, "manifest.json"))
+
+
+if __name__ == "__main__":
+    main()
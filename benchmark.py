@@ -0,0 +1,340 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import seq_designer
+from instrumentation import Profiler
+from scaffold_generator import random_seq_creator
+
+
+PACKAGE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Large designs shipped in json_files
+LARGE_DESIGNS = [
+    "Cuboctahedron_1.5.json",
+    "Triangular_BH_4_shorter_ply_6_1.json",
+    "squared_rod_4_1.json",
+    "octa_long_5_4_28_5.json",
+]
+
+# Results file, the directory is ignored by git
+DEFAULT_OUTPUT = os.path.join("benchmark_results", "benchmark.json")
+
+# Helices x length of the default synthetic designs
+SYNTHETIC_SIZES = [(16, 1024), (64, 4096)]
+
+# Profiler stages of design and WriteFiles that are reported
+STAGES = [
+    "ParseJson",
+    "FindStartStaples",
+    "FindStartScaffolds",
+    "FindScaffoldSequences",
+    "FindStapleSequences",
+    "VerifyStaples",
+    "FindStapleTm",
+    "OutputFiles",
+]
+
+
+def synthetic_design(helices, length, break_density=0.05, skip_density=0.0, loop_density=0.0,
+                     tile=16, seed=0):
+    """
+    Returns cadnano json data of a synthetic design with given number of
+    helices of given length. A single scaffold runs through all helices,
+    back and forth. Staples are tiled over pairs of helices, every tile
+    runs tile bases along one helix, crosses over and runs back along the
+    other. Staple links are broken, scaffold bases skipped and loops
+    inserted at random with the given densities.
+    """
+
+    rng = np.random.default_rng(seed)
+    nums = np.arange(helices)
+    indices = np.arange(length)
+
+    scaffolds = np.full((helices, length, 4), -1, dtype=np.int64)
+    staples = np.full((helices, length, 4), -1, dtype=np.int64)
+
+    # Scaffold runs forward on even helices and backward on odd helices
+    for h in range(helices):
+        forward = h % 2 == 0
+        step = 1 if forward else -1
+        scaffolds[h, :, 0] = h
+        scaffolds[h, :, 1] = indices - step
+        scaffolds[h, :, 2] = h
+        scaffolds[h, :, 3] = indices + step
+
+        first, last = (0, length - 1) if forward else (length - 1, 0)
+        scaffolds[h, first, 0:2] = [h - 1, first] if h > 0 else [-1, -1]
+        scaffolds[h, last, 2:4] = [h + 1, last] if h < helices - 1 else [-1, -1]
+
+    # Staple tiles over pairs of helices, running opposite to the scaffold
+    tiled = length // tile * tile
+    position = indices[:tiled] % tile
+    for h in range(0, helices, 2):
+        if h + 1 < helices:
+            down, up = (h, h + 1)
+            staples[up, :tiled] = np.stack(
+                [np.full(tiled, up), indices[:tiled] - 1, np.full(tiled, up), indices[:tiled] + 1], axis=1)
+            staples[up, :tiled][position == 0, 0:2] = -1
+            staples[up, :tiled][position == tile - 1, 2] = down
+            staples[up, :tiled][position == tile - 1, 3] = indices[:tiled][position == tile - 1]
+            staples[down, :tiled] = np.stack(
+                [np.full(tiled, down), indices[:tiled] + 1, np.full(tiled, down), indices[:tiled] - 1], axis=1)
+            staples[down, :tiled][position == tile - 1, 0] = up
+            staples[down, :tiled][position == tile - 1, 1] = indices[:tiled][position == tile - 1]
+            staples[down, :tiled][position == 0, 2:4] = -1
+        else:
+            # Last helix without a partner gets straight staples
+            step = -1 if h % 2 == 0 else 1
+            staples[h, :tiled] = np.stack(
+                [np.full(tiled, h), indices[:tiled] - step, np.full(tiled, h), indices[:tiled] + step], axis=1)
+            staples[h, :tiled][position == (0 if step == 1 else tile - 1), 0:2] = -1
+            staples[h, :tiled][position == (tile - 1 if step == 1 else 0), 2:4] = -1
+
+    # Break staple links at random, both sides of a link are cleared
+    flat = staples.reshape(-1, 4)
+    links = np.flatnonzero(flat[:, 2] != -1)
+    broken = links[rng.random(len(links)) < break_density]
+    targets = flat[broken, 2] * length + flat[broken, 3]
+    flat[broken, 2:4] = -1
+    flat[targets, 0:2] = -1
+
+    # Skips and loops on scaffold bases, never both at the same base
+    draw = rng.random((helices, length))
+    skip = np.where(draw < skip_density, -1, 0)
+    loop = np.where((draw >= skip_density) & (draw < skip_density + loop_density),
+                    rng.integers(1, 3, (helices, length)), 0)
+
+    vstrands = []
+    for h in range(helices):
+        vstrands.append({
+            'num': int(nums[h]),
+            'row': 0,
+            'col': int(nums[h]),
+            'scaf': scaffolds[h].tolist(),
+            'stap': staples[h].tolist(),
+            'skip': skip[h].tolist(),
+            'loop': loop[h].tolist(),
+            'scafLoop': [],
+            'stapLoop': [],
+            'stap_colors': [],
+        })
+
+    return {'name': "synthetic_" + str(helices) + "x" + str(length) + ".json", 'vstrands': vstrands}
+
+
+def design_counts(json_file, scaffold_seq, seed=0):
+    """
+    Returns counts of a design and the scaffold sequence to benchmark it
+    with, a random one if the design is longer than scaffold_seq.
+    """
+
+    topology = seq_designer.FindTopology(json_file)
+
+    scaffoldLength = max(seq_designer.FindLength(topology.scaffoldOffsets), default=0)
+    randomScaffold = scaffoldLength > len(scaffold_seq)
+    if randomScaffold:
+        scaffold_seq = random_seq_creator(scaffoldLength, rng=random.Random(seed))
+
+    counts = {
+        'helices': topology.numStrands,
+        'length': topology.lengthStrands,
+        'bases': int((topology.scaffolds != -1).any(axis=2).sum() + (topology.staples != -1).any(axis=2).sum()),
+        'scaffolds': len(topology.scaffoldBases),
+        'staples': len(topology.stapleBases),
+        'scaffold_length': scaffoldLength,
+        'random_scaffold': randomScaffold,
+    }
+
+    return counts, scaffold_seq
+
+
+def run_pipeline(json_file, scaffold_seq, output_directory, seed=0):
+    """
+    Sequences a json file with design and writes its files, as the command
+    line interface does, timing every stage with a Profiler. Returns the
+    Profiler and the wall time of the whole run.
+    """
+
+    profiler = Profiler()
+
+    time_start = time.perf_counter()
+    result = seq_designer.design(json_file, scaffold_seq, seed, profiler=profiler)
+    result.WriteFiles(directoryName=output_directory)
+
+    return profiler, time.perf_counter() - time_start
+
+
+def benchmark(json_file, scaffold_seq, repeat=3, seed=0):
+    """
+    Runs the pipeline repeat times on a json file. Returns the counts of
+    the design and the minimum, median and all wall times of every stage
+    and of the whole pipeline.
+    """
+
+    counts, scaffold_seq = design_counts(json_file, scaffold_seq, seed)
+
+    timings = {stage: [] for stage in STAGES + ["total"]}
+
+    with tempfile.TemporaryDirectory() as output_directory:
+        for i in range(repeat):
+            profiler, total = run_pipeline(json_file, scaffold_seq, output_directory, seed)
+            for stage in STAGES:
+                timings[stage].append(profiler.stages[stage]['wall_time'])
+            timings["total"].append(total)
+
+    stages = {}
+    for stage, runs in timings.items():
+        stages[stage] = {
+            'min': min(runs),
+            'median': float(np.median(runs)),
+            'runs': runs,
+        }
+
+    return {'counts': counts, 'stages': stages, 'counters': profiler.counters}
+
+
+def code_version():
+    """
+    Returns the git commit of the designer, or None outside a git checkout.
+    """
+
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=PACKAGE_DIRECTORY, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_size(size):
+    """
+    Returns helices and length of a synthetic size given as HELICESxLENGTH.
+    """
+
+    try:
+        helices, length = size.lower().split("x")
+        return int(helices), int(length)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "size should be HELICESxLENGTH, not " + size)
+
+
+def main(argv=None):
+    """
+    Command line interface of the benchmark
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Time every stage of the designer on real and synthetic cadnano designs.")
+    parser.add_argument("json", nargs="*",
+                        help="cadnano .json files (default: the large designs in json_files)")
+    parser.add_argument("--scaffold", default=os.path.join(PACKAGE_DIRECTORY, "scaffold_files", "P8634"),
+                        help="scaffold sequence file (default: scaffold_files/P8634)")
+    parser.add_argument("--synthetic", nargs="*", type=parse_size, default=SYNTHETIC_SIZES,
+                        metavar="HELICESxLENGTH",
+                        help="sizes of synthetic designs (default: 16x1024 64x4096)")
+    parser.add_argument("--break-density", type=float, default=0.05,
+                        help="fraction of staple links broken in synthetic designs (default: 0.05)")
+    parser.add_argument("--skip-density", type=float, default=0.01,
+                        help="fraction of skipped scaffold bases in synthetic designs (default: 0.01)")
+    parser.add_argument("--loop-density", type=float, default=0.01,
+                        help="fraction of scaffold bases with a loop in synthetic designs (default: 0.01)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of runs of every design (default: 3)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed (default: 0)")
+    parser.add_argument("--label",
+                        help="label of this version in the results (default: git commit)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT,
+                        help="results file (default: " + DEFAULT_OUTPUT + ")")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    json_files = args.json or [os.path.join(PACKAGE_DIRECTORY, "json_files", name)
+                               for name in LARGE_DESIGNS]
+
+    try:
+        scaffold_seq = seq_designer.RawScaffoldSequence(args.scaffold)
+    except seq_designer.SequenceDesignerError as error:
+        sys.exit(str(error))
+
+    results = {
+        'label': args.label or code_version(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'repeat': args.repeat,
+        'designs': [],
+    }
+
+    for json_file in json_files:
+        entry = {'design': os.path.basename(json_file), 'source': json_file}
+        try:
+            entry.update(benchmark(json_file, scaffold_seq,
+                                   args.repeat, args.seed))
+        except seq_designer.SequenceDesignerError as error:
+            entry['error'] = str(error)
+        results['designs'].append(entry)
+        print_entry(entry)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for helices, length in args.synthetic:
+            cadnano = synthetic_design(helices, length, args.break_density, args.skip_density,
+                                       args.loop_density, seed=args.seed)
+            json_file = os.path.join(directory, cadnano['name'])
+            with open(json_file, 'w') as file:
+                json.dump(cadnano, file)
+            del cadnano
+
+            entry = {
+                'design': os.path.basename(json_file),
+                'source': "synthetic",
+                'parameters': {
+                    'helices': helices,
+                    'length': length,
+                    'break_density': args.break_density,
+                    'skip_density': args.skip_density,
+                    'loop_density': args.loop_density,
+                    'seed': args.seed,
+                },
+                'file_bytes': os.path.getsize(json_file),
+            }
+            try:
+                entry.update(benchmark(json_file, scaffold_seq,
+                                       args.repeat, args.seed))
+            except seq_designer.SequenceDesignerError as error:
+                entry['error'] = str(error)
+            results['designs'].append(entry)
+            print_entry(entry)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    print("Results written to " + args.output)
+
+
+def print_entry(entry):
+    """
+    Prints a one line summary of the benchmark of a design.
+    """
+
+    if 'error' in entry:
+        print(entry['design'] + ": " + entry['error'].splitlines()[0])
+        return
+
+    print(entry['design'] + ": " + str(entry['counts']['bases']) + " bases, " +
+          "{:.3f}".format(entry['stages']['total']['min']) + " seconds (" +
+          ", ".join(stage + " " + "{:.3f}".format(entry['stages'][stage]['min']) for stage in STAGES) + ")")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from sequence_metrics import pack_sequences, kmer_hashes, COMPLEMENT_CODES
+from kmer_index import KmerIndex
+
+
+# Settings of the screen: length of the seed k-mers, diagonals scored on
+# either side of a seed, alignment scores and the score of a reported pair
+DEFAULT_SETTINGS = {
+    'k': 8,
+    'band': 3,
+    'match': 1,
+    'mismatch': -2,
+    'gap': -3,
+    'min_score': 12,
+}
+
+# Candidate pairs scored per task of the process pool
+CHUNK_PAIRS = 50000
+
+# Packed staple codes of a worker process
+worker_staples = {}
+
+
+def screen_settings(settings=None):
+    """
+    Returns the settings of the screen, settings overrides the defaults.
+    """
+
+    settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+
+    unknown = set(settings) - set(DEFAULT_SETTINGS)
+    if len(unknown) != 0:
+        raise ValueError("Unknown screen settings: " + ", ".join(sorted(unknown)))
+    if not 0 < settings['k'] <= 31:
+        raise ValueError("k has to be between 1 and 31")
+    if settings['band'] < 0:
+        raise ValueError("band can't be negative")
+
+    return settings
+
+
+def candidate_pairs(sequences, k):
+    """
+    Finds the pairs of different sequences sharing a k-mer with the
+    reverse complement of each other, the seeds of a duplex. Letter i of
+    the first sequence pairs with letter diagonal - i of the second along
+    a seed. Returns the first and second sequence, first < second, and the
+    diagonal of every distinct seed, ordered by pair and diagonal.
+    """
+
+    index = KmerIndex.build(sequences, k)
+    codes, starts, lengths = pack_sequences(sequences)
+    positions, first, _, complement_hashes = kmer_hashes(codes, starts, lengths, k)
+
+    queries, second, second_positions = index.matches(complement_hashes)
+    first = first[queries]
+    first_positions = positions[queries] - starts[first]
+
+    # Every pair is found from both sides
+    keep = first < second
+    first = first[keep]
+    second = second[keep]
+    diagonals = first_positions[keep] + second_positions[keep] + k - 1
+
+    # Seeds along the same diagonal belong to the same duplex
+    order = np.lexsort((diagonals, second, first))
+    first = first[order]
+    second = second[order]
+    diagonals = diagonals[order]
+    distinct = np.ones(len(first), dtype=bool)
+    distinct[1:] = (first[1:] != first[:-1]) | (second[1:] != second[:-1]) | \
+        (diagonals[1:] != diagonals[:-1])
+
+    return first[distinct], second[distinct], diagonals[distinct]
+
+
+def score_pairs(codes, starts, lengths, first, second, diagonals, settings, locate=False):
+    """
+    Local alignment (Smith-Waterman) of the first sequence of every pair
+    with the reverse of the second, restricted to a band of diagonals
+    around its seed, all pairs at once. Complementary letters score match,
+    other letters mismatch, a letter of either sequence left unpaired gap.
+    Returns the best score of every pair and, if locate is set, the first
+    and last letter of the duplex in the first sequence and the letters of
+    the second sequence they pair with.
+    """
+
+    band = settings['band']
+    width = 2 * band + 1
+    num_pairs = len(first)
+
+    first_starts = starts[first]
+    first_lengths = lengths[first]
+    second_starts = starts[second]
+    second_lengths = lengths[second]
+    codes = np.append(codes, 4)
+    padding = len(codes) - 1
+    no_gap = np.full(num_pairs, -1, dtype=np.int32)
+
+    # Scores of the previous row, one column per diagonal plus an empty
+    # one, and the cell every alignment starts at
+    previous = np.zeros((num_pairs, width + 1), dtype=np.int32)
+    if locate:
+        previous_start_i = np.zeros((num_pairs, width + 1), dtype=np.int64)
+        previous_start_j = np.zeros((num_pairs, width + 1), dtype=np.int64)
+        best_cells = np.zeros((4, num_pairs), dtype=np.int64)
+
+    best = np.zeros(num_pairs, dtype=np.int32)
+
+    max_length = int(first_lengths.max()) if num_pairs != 0 else 0
+    for i in range(max_length):
+        row = i < first_lengths
+        first_codes = codes[np.where(row, first_starts + i, padding)]
+        complement_codes = COMPLEMENT_CODES[first_codes]
+
+        current = np.zeros((num_pairs, width + 1), dtype=np.int32)
+        if locate:
+            start_i = np.zeros((num_pairs, width + 1), dtype=np.int64)
+            start_j = np.zeros((num_pairs, width + 1), dtype=np.int64)
+
+        # Column w holds letter j of the second sequence, j runs backwards
+        # along an alignment so column w + 1 comes first
+        for w in range(width - 1, -1, -1):
+            j = diagonals - i + w - band
+            valid = row & (j >= 0) & (j < second_lengths)
+            second_codes = codes[np.where(valid, second_starts + j, padding)]
+            paired = (complement_codes == second_codes) & (second_codes < 4)
+            score = np.where(paired, settings['match'], settings['mismatch'])
+
+            # Pair both letters, leave the letter of the first or of the
+            # second sequence unpaired, or start a new alignment
+            diagonal = previous[:, w] + score
+            skip_first = previous[:, w - 1] + settings['gap'] if w > 0 else no_gap
+            skip_second = current[:, w + 1] + settings['gap']
+
+            value = np.maximum(np.maximum(diagonal, skip_first), np.maximum(skip_second, 0))
+            value[~valid] = 0
+            current[:, w] = value
+
+            if locate:
+                fresh = previous[:, w] == 0
+                start_i[:, w] = np.where(fresh, i, previous_start_i[:, w])
+                start_j[:, w] = np.where(fresh, j, previous_start_j[:, w])
+                if w > 0:
+                    from_first = (value != diagonal) & (value == skip_first)
+                    start_i[:, w] = np.where(from_first, previous_start_i[:, w - 1], start_i[:, w])
+                    start_j[:, w] = np.where(from_first, previous_start_j[:, w - 1], start_j[:, w])
+                from_second = (value != diagonal) & (value == skip_second)
+                start_i[:, w] = np.where(from_second, start_i[:, w + 1], start_i[:, w])
+                start_j[:, w] = np.where(from_second, start_j[:, w + 1], start_j[:, w])
+
+                # First cell reaching the best score is the end of the duplex
+                better = value > best
+                best_cells[:, better] = [start_i[better, w], np.full(better.sum(), i),
+                                         start_j[better, w], j[better]]
+
+            np.maximum(best, value, out=best)
+
+        previous = current
+        if locate:
+            previous_start_i, previous_start_j = start_i, start_j
+
+    if not locate:
+        return best
+
+    return best, best_cells[0], best_cells[1], best_cells[2], best_cells[3]
+
+
+def init_worker(codes, starts, lengths):
+    """
+    Stores the packed staple codes once per worker process.
+    """
+
+    worker_staples.update(codes=codes, starts=starts, lengths=lengths)
+
+
+def score_chunk(first, second, diagonals, settings):
+    """
+    Scores a chunk of candidate pairs with the staples of the worker.
+    """
+
+    return score_pairs(worker_staples['codes'], worker_staples['starts'], worker_staples['lengths'],
+                       first, second, diagonals, settings)
+
+
+class DimerReport:
+    """
+    Pairs of staples found by screen_staples that can bind each other,
+    ranked by score, highest first. first and second are the staples,
+    score the alignment score of their best duplex. first_start and
+    first_end are the first and last letter of the duplex in the first
+    staple, second_start and second_end the letters of the second staple
+    they pair with. candidates is the number of seeds that were scored.
+    """
+
+    def __init__(self, num_staples, settings, first, second, score, first_start, first_end,
+                 second_start, second_end, candidates=0):
+        self.num_staples = num_staples
+        self.settings = settings
+        self.first = first
+        self.second = second
+        self.score = score
+        self.first_start = first_start
+        self.first_end = first_end
+        self.second_start = second_start
+        self.second_end = second_end
+        self.candidates = candidates
+
+    def __len__(self):
+        """
+        Returns the number of pairs.
+        """
+        return len(self.first)
+
+    def flagged(self):
+        """
+        Returns whether every staple is part of a pair.
+        """
+
+        flagged = np.zeros(self.num_staples, dtype=bool)
+        flagged[self.first] = True
+        flagged[self.second] = True
+
+        return flagged
+
+    def pairs(self):
+        """
+        Returns every pair as dictionary, in rank order.
+        """
+
+        return [{
+            'first': int(self.first[i]),
+            'second': int(self.second[i]),
+            'score': int(self.score[i]),
+            'first_letters': [int(self.first_start[i]), int(self.first_end[i])],
+            'second_letters': [int(self.second_start[i]), int(self.second_end[i])],
+        } for i in range(len(self))]
+
+
+def screen_staples(sequences, settings=None, workers=1):
+    """
+    Screens all pairs of staple sequences for cross-hybridization. Pairs
+    sharing a complementary k-mer are scored with a banded local
+    alignment, see score_pairs, pairs without a common k-mer are not
+    scored. Chunks of CHUNK_PAIRS candidates are scored in a process pool
+    of workers processes, or in this process if workers is 1. Letters
+    other than ACGT (i.e. X for skips) never pair.
+    Returns a DimerReport of the pairs scoring at least min_score, with
+    the best scoring seed of every pair.
+    """
+
+    if isinstance(sequences, str):
+        sequences = [sequences]
+
+    settings = screen_settings(settings)
+    codes, starts, lengths = pack_sequences(sequences)
+    first, second, diagonals = candidate_pairs(sequences, settings['k'])
+
+    chunks = [(first[i:i + CHUNK_PAIRS], second[i:i + CHUNK_PAIRS], diagonals[i:i + CHUNK_PAIRS])
+              for i in range(0, len(first), CHUNK_PAIRS)]
+
+    if workers == 1 or len(chunks) <= 1:
+        results = [score_pairs(codes, starts, lengths, *chunk, settings) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(codes, starts, lengths)) as executor:
+            results = list(executor.map(score_chunk, *zip(*chunks), [settings] * len(chunks)))
+
+    score = np.concatenate([result.astype(np.int64) for result in results] +
+                           [np.zeros(0, dtype=np.int64)])
+
+    # Best seed of every pair scoring at least min_score
+    order = np.lexsort((diagonals, -score, second, first))
+    leading = np.ones(len(order), dtype=bool)
+    leading[1:] = (first[order][1:] != first[order][:-1]) | (second[order][1:] != second[order][:-1])
+    best = order[leading]
+    best = best[score[best] >= settings['min_score']]
+
+    # Pairs ranked by score, the duplex of the few reported pairs is
+    # located by scoring them again
+    best = best[np.lexsort((second[best], first[best], -score[best]))]
+    _, first_start, first_end, second_start, second_end = score_pairs(
+        codes, starts, lengths, first[best], second[best], diagonals[best], settings, locate=True)
+
+    return DimerReport(len(sequences), settings, first[best], second[best], score[best],
+                       first_start, first_end, second_start, second_end, len(first))
@@ -0,0 +1,597 @@
+import os
+import sys
+import json
+import time
+import pickle
+import zipfile
+import hashlib
+import logging
+import argparse
+import numpy as np
+import seq_designer
+from staple_quality import QualityReport, rule_settings, merge_reports, VERIFY_RULES
+
+
+logger = logging.getLogger(__name__)
+
+
+def scaffold_key(scaffold_seq, offset, rng, offTarget=None):
+    """
+    Returns a key of everything the scaffold letters depend on apart from
+    the design, or None if rng is not a seed and runs can't be compared.
+    offTarget, the k-mer length the other scaffolds avoid, changes their
+    letters as well.
+    """
+
+    if not isinstance(rng, int):
+        return None
+
+    digest = hashlib.sha256(
+        (str(offset) + "\n" + str(rng) + "\n" + str(offTarget) + "\n").encode())
+    digest.update(scaffold_seq.encode())
+
+    return digest.hexdigest()
+
+
+def helix_hashes(strand_data, helix_rows, num_strands):
+    """
+    Returns the sha256 of the number, scaf, stap, skip and loop data of
+    every helix, by row, to find the helices that changed between runs.
+    The data is pickled, which is several times faster than converting it
+    to arrays. Equal data can pickle differently if it shares objects,
+    that only marks a helix as changed.
+    """
+
+    hashes = [""] * num_strands
+    for i, vstrand in enumerate(strand_data):
+        data = [vstrand.get(key) for key in ['num', 'scaf', 'stap', 'skip', 'loop']]
+        hashes[helix_rows[i]] = hashlib.sha256(pickle.dumps(data, protocol=4)).hexdigest()
+
+    return np.array(hashes)
+
+
+def tm_key(conditions):
+    """
+    Returns the conditions of melting temperatures, defaults included, as
+    string to compare runs with.
+    """
+
+    from thermodynamics import DEFAULT_CONDITIONS
+
+    return json.dumps(dict(DEFAULT_CONDITIONS, **(conditions or {})), sort_keys=True)
+
+
+def loops_to_arrays(loops):
+    """
+    Returns the (helix, index) keys, concatenated letters and lengths of a
+    dictionary of loop sequences as arrays.
+    """
+
+    keys = sorted(loops)
+    bases = np.array(keys, dtype=np.int64).reshape(-1, 2)
+    letters = np.frombuffer(
+        ''.join(loops[key] for key in keys).encode('ascii'), dtype=np.uint8)
+    lengths = np.array([len(loops[key]) for key in keys], dtype=np.int64)
+
+    return bases, letters, lengths
+
+
+def arrays_to_loops(bases, letters, lengths):
+    """
+    Returns the dictionary of loop sequences stored by loops_to_arrays.
+    """
+
+    loops = {}
+    letters = letters.tobytes().decode()
+    start = 0
+    for (helix, index), length in zip(bases.tolist(), lengths.tolist()):
+        loops[helix, index] = letters[start:start + length]
+        start += length
+
+    return loops
+
+
+def state_path(directory, name):
+    """
+    Returns the state file of a design in its output directory.
+    """
+
+    return os.path.join(directory, "state_" + name + ".npz")
+
+
+def save_state(path, result, key=None):
+    """
+    Saves the topology, look up tables and loops of a sequenced design,
+    together with its scaffold key, as state for the next run. key defaults
+    to the scaffold key a redesign result was sequenced with. The helix
+    hashes of a redesign result and the quality issues and melting
+    temperatures of the staples are saved as well, so the next run only
+    parses changed helices and checks changed staples.
+    """
+
+    arrays = result.topology.ToArrays()
+    arrays['lookUpScaffold'] = result.lookUpScaffold
+    arrays['lookUpStaple'] = result.lookUpStaple
+    for name, loops in [('scaffoldLoops', result.scaffoldLoops), ('stapleLoops', result.stapleLoops)]:
+        bases, letters, lengths = loops_to_arrays(loops)
+        arrays[name + 'Bases'] = bases
+        arrays[name + 'Letters'] = letters
+        arrays[name + 'Lengths'] = lengths
+    if key is None:
+        key = getattr(result, 'scaffoldKey', None)
+    arrays['scaffoldKey'] = np.array("" if key is None else key)
+
+    helix_hashes = getattr(result, 'helixHashes', None)
+    if helix_hashes is not None:
+        arrays['helixHashes'] = helix_hashes
+
+    if result.quality is not None:
+        arrays['qualitySettings'] = np.array(json.dumps(result.quality.settings))
+        arrays['qualityStaple'] = result.quality.staple
+        arrays['qualityRule'] = result.quality.rule
+        arrays['qualityPosition'] = result.quality.position
+        arrays['qualityValue'] = result.quality.value
+
+    if result.stapleTm is not None:
+        arrays['tmConditions'] = np.array(tm_key(result.conditions))
+        arrays['stapleTm'] = result.stapleTm
+        arrays['domainTm'] = np.concatenate(list(result.domainTm) + [np.zeros(0)])
+        arrays['domainCounts'] = np.array([len(tms) for tms in result.domainTm], dtype=np.int64)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporary_path = path + "." + str(os.getpid()) + ".tmp"
+    with open(temporary_path, 'wb') as file:
+        np.savez(file, **arrays)
+    os.replace(temporary_path, path)
+
+
+def load_state(path):
+    """
+    Returns the state saved by save_state as dictionary of arrays, or None
+    if there is no state or it can't be read.
+    """
+
+    try:
+        with np.load(path) as state:
+            return {name: state[name] for name in state.files}
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile) as error:
+        logger.info("Ignoring unreadable state " +
+                    path + ": " + str(error))
+        return None
+
+
+def state_loops(state, name):
+    """
+    Returns the scaffold or staple loops of a state.
+    """
+
+    return arrays_to_loops(state[name + 'Bases'], state[name + 'Letters'], state[name + 'Lengths'])
+
+
+def state_quality(state):
+    """
+    Returns the QualityReport of the staples of a state, None if it has
+    none.
+    """
+
+    if 'qualitySettings' not in state:
+        return None
+
+    return QualityReport(len(state['stapleLengths']), json.loads(str(state['qualitySettings'])),
+                         state['qualityStaple'], state['qualityRule'], state['qualityPosition'],
+                         state['qualityValue'])
+
+
+def parse_changed_helices(cadnano_data, old, state):
+    """
+    Parses only the helices of a design whose hash differs from the state,
+    the arrays of the other helices are taken from the previous topology
+    old. Only the bases of changed helices and the bases pointing into
+    them are validated. Returns the arrays as ParseJson does, the helix
+    hashes and whether every row changed, or None if the helices or their
+    length changed or the state has no hashes.
+    """
+
+    if 'helixHashes' not in state:
+        return None
+
+    strand_data, nums, helix_nums, helix_rows, num_strands, length_strands = seq_designer.HelixLayout(
+        cadnano_data)
+    if length_strands != old.lengthStrands or not np.array_equal(helix_nums, old.helixNums):
+        return None
+
+    hashes = helix_hashes(strand_data, helix_rows, num_strands)
+    rows = hashes != state['helixHashes']
+    helices = [i for i in range(len(strand_data)) if rows[helix_rows[i]]]
+
+    # Previous arrays with helix numbers in the pointers, as in the file
+    scaffolds = old.scaffolds.copy()
+    staples = old.staples.copy()
+    skip = old.skip.copy()
+    loop = old.loop.copy()
+    seq_designer.RemapPointers(scaffolds, staples, helix_nums, toRows=False)
+    seq_designer.FillHelices(strand_data, nums, helix_rows, scaffolds, staples, skip, loop, helices)
+
+    # Bases of other helices can only break by pointing into a changed one
+    cells = np.zeros((num_strands, length_strands), dtype=bool)
+    cells[rows] = True
+    for strand in [scaffolds, staples]:
+        for j in [0, 2]:
+            cells |= np.isin(strand[:, :, j], helix_nums[rows])
+    seq_designer.ValidateDesign(scaffolds, staples, skip, loop, helix_nums, cells)
+
+    seq_designer.RemapPointers(scaffolds, staples, helix_nums)
+
+    return num_strands, length_strands, scaffolds, staples, skip, loop, helix_nums, hashes, rows
+
+
+def trace_strands(strand, cells, helix_nums=None):
+    """
+    Returns the flat bases of every strand running through the given flat
+    cells, ordered by start base. Only these strands are walked: backwards
+    to their 5' end and then forward, so the work is proportional to their
+    length instead of the size of the design.
+    """
+
+    length_strands = strand.shape[1]
+    blocks = strand.reshape(-1, 4)
+
+    occupied = (blocks[cells] != -1).any(axis=1)
+    cells = cells[occupied].tolist()
+
+    # Walk back to the 5' end, stop at bases already seen
+    visited = set()
+    starts = set()
+    for cell in cells:
+        current = cell
+        while current not in visited:
+            visited.add(current)
+            prev_helix, prev_index = blocks[current, 0:2].tolist()
+            if prev_helix == -1:
+                starts.add(current)
+                break
+            current = prev_helix * length_strands + prev_index
+
+    strand_bases = []
+    traced = set()
+    for start in sorted(starts):
+        bases = []
+        current = start
+        while current != -1:
+            if current in traced:
+                raise seq_designer.TopologyError("Strand starting at base " +
+                                                 seq_designer.BaseName(divmod(start, length_strands), helix_nums) +
+                                                 " runs into base " +
+                                                 seq_designer.BaseName(divmod(current, length_strands), helix_nums) +
+                                                 " a second time\nPrevious and next bases in json file are not consistent")
+            traced.add(current)
+            bases.append(current)
+            next_helix, next_index = blocks[current, 2:4].tolist()
+            if next_helix == -1:
+                current = -1
+            else:
+                current = next_helix * length_strands + next_index
+        strand_bases.append(np.array(bases, dtype=np.int64))
+
+    # A base that can't be reached from a 5' end lies on a circular strand
+    untraced = np.array([cell for cell in cells if cell not in traced], dtype=np.int64)
+    if len(untraced) != 0:
+        visited = [False] * len(blocks)
+        for base in traced:
+            visited[base] = True
+        circular_bases, _ = seq_designer.FindCircularStrands(
+            untraced, seq_designer.FlatNextBases(strand).tolist(), visited)
+        raise seq_designer.CircularStrandError([list(divmod(base, length_strands)) for base in circular_bases],
+                                               helix_nums)
+
+    return strand_bases
+
+
+def changed_strands(strands, old_bases, old_look_up, old_loops, length_strands):
+    """
+    Returns for every strand whether it differs from the strand with the
+    same start base in the previous run, in its bases or its letters.
+    """
+
+    old_by_start = {int(bases[0]): bases for bases in old_bases}
+
+    changed = []
+    for strand in strands:
+        bases = strand.helices.astype(np.int64) * length_strands + strand.indices
+        previous = old_by_start.get(int(bases[0]))
+        if previous is None or not np.array_equal(previous, bases):
+            changed.append(True)
+            continue
+
+        old_strand = seq_designer.SplitStrands(
+            [previous], length_strands, old_look_up.ravel()[previous], old_loops)[0]
+        changed.append(old_strand.letters != strand.letters)
+
+    return changed
+
+
+def changed_rows(result, state, changed_cells):
+    """
+    Returns for every helix row whether its cells or letters differ from
+    the previous run.
+    """
+
+    rows = changed_cells.any(axis=1)
+    rows |= (result.lookUpScaffold != state['lookUpScaffold']).any(axis=1)
+    rows |= (result.lookUpStaple != state['lookUpStaple']).any(axis=1)
+
+    for name, loops in [('scaffoldLoops', result.scaffoldLoops), ('stapleLoops', result.stapleLoops)]:
+        old_loops = state_loops(state, name)
+        for base in set(loops) | set(old_loops):
+            if loops.get(base) != old_loops.get(base):
+                rows[base[0]] = True
+
+    return rows
+
+
+def redesign(cadnano, scaffold_seq, state, rng=0, offset=0, rules=None, conditions=None, offTarget=None,
+             dimers=None, workers=1):
+    """
+    Sequences a design again after a local change, given the state of the
+    previous run as returned by load_state. Only the helices whose data
+    changed are parsed and validated. If the scaffold path and scaffold
+    input, including offTarget, are unchanged, only the staples running through changed cells
+    are traced and sequenced again, the other staples are reused as they
+    are, and the quality rules and melting temperatures are only computed
+    for the new staples. The off-target and dimer screens, which compare
+    staples with the scaffolds and with each other, run on all staples.
+    Otherwise, or without a usable state, the design is sequenced in full.
+    rules, conditions, offTarget, dimers and workers are passed on as in
+    design. Returns a DesignResult with changedStaples, changedRows,
+    helixHashes and scaffoldKey set.
+    """
+
+    key = scaffold_key(scaffold_seq, offset, rng, offTarget)
+
+    fileName = seq_designer.DesignName(cadnano)
+    cadnano = seq_designer.LoadJson(cadnano)
+
+    old = None
+    if state is not None:
+        old = seq_designer.Topology.FromArrays(fileName, state)
+
+    parsed = None
+    if old is not None:
+        parsed = parse_changed_helices(cadnano, old, state)
+
+    # Changed cells per helix
+    if parsed is not None:
+        numStrands, lengthStrands, scaffolds, staples, skip, loop, helixNums, hashes, rows = parsed
+        same_layout = True
+        changed_cells = np.zeros((numStrands, lengthStrands), dtype=bool)
+        changed_cells[rows] = (scaffolds[rows] != old.scaffolds[rows]).any(axis=2) | \
+            (staples[rows] != old.staples[rows]).any(axis=2) | \
+            (skip[rows] != old.skip[rows]) | (loop[rows] != old.loop[rows])
+    else:
+        numStrands, lengthStrands, scaffolds, staples, _, skip, loop, helixNums = seq_designer.ParseJson(
+            cadnano)
+        strand_data, _, _, helix_rows, _, _ = seq_designer.HelixLayout(cadnano)
+        hashes = helix_hashes(strand_data, helix_rows, numStrands)
+
+        same_layout = old is not None and old.lengthStrands == lengthStrands and \
+            np.array_equal(old.helixNums, helixNums)
+
+        changed_cells = None
+        if same_layout:
+            changed_cells = (scaffolds != old.scaffolds).any(axis=2) | \
+                (staples != old.staples).any(axis=2) | \
+                (skip != old.skip) | (loop != old.loop)
+
+    same_scaffold = same_layout and key is not None and str(state['scaffoldKey']) == key and \
+        np.array_equal(scaffolds, old.scaffolds) and np.array_equal(skip, old.skip) and \
+        np.array_equal(loop, old.loop)
+
+    if not same_scaffold:
+        logger.info("Scaffold changed, sequencing full design...")
+
+        topology = seq_designer.BuildTopology(
+            fileName, numStrands, lengthStrands, scaffolds, staples, skip, loop, helixNums)
+        result = seq_designer.design(topology, scaffold_seq, rng, offset, rules=rules, conditions=conditions,
+                                     offTarget=offTarget, dimers=dimers, workers=workers)
+
+        if same_layout:
+            result.changedStaples = changed_strands(result.staples, old.stapleBases, state['lookUpStaple'],
+                                                    state_loops(state, 'stapleLoops'), lengthStrands)
+            result.changedRows = changed_rows(result, state, changed_cells)
+        else:
+            result.changedStaples = [True] * len(result.staples)
+            result.changedRows = np.ones(numStrands, dtype=bool)
+        result.helixHashes = hashes
+        result.scaffoldKey = key
+
+        return result
+
+    logger.info("Scaffold unchanged, sequencing changed staples...")
+
+    # Ids of the previous staples at every base
+    old_ids = np.full(numStrands * lengthStrands, -1, dtype=np.int64)
+    old_lengths = np.array([len(bases)
+                           for bases in old.stapleBases], dtype=np.int64)
+    if len(old.stapleBases) != 0:
+        old_ids[np.concatenate(old.stapleBases)] = np.repeat(
+            np.arange(len(old.stapleBases)), old_lengths)
+
+    # Previous staples touching a changed cell are dropped, every staple
+    # through a changed cell or a cell of a dropped staple is traced again
+    cells = np.flatnonzero(changed_cells)
+    dropped = np.unique(old_ids[cells])
+    dropped = dropped[dropped != -1]
+
+    dropped_bases = np.zeros(0, dtype=np.int64)
+    if len(dropped) != 0:
+        dropped_bases = np.concatenate(
+            [old.stapleBases[i] for i in dropped.tolist()])
+
+    new_bases = trace_strands(staples, np.union1d(
+        cells, dropped_bases), helixNums)
+
+    # Reuse scaffold letters, remove the letters of dropped staples
+    lookUpScaffold = state['lookUpScaffold'].copy()
+    scaffoldLoops = state_loops(state, 'scaffoldLoops')
+    lookUpStaple = state['lookUpStaple'].copy()
+    stapleLoops = state_loops(state, 'stapleLoops')
+
+    np.put(lookUpStaple, dropped_bases, 0)
+    for base in dropped_bases.tolist():
+        stapleLoops.pop(divmod(base, lengthStrands), None)
+
+    new_staples = seq_designer.FindStapleSequences(
+        staples, new_bases, lookUpScaffold, lookUpStaple, scaffoldLoops, stapleLoops, workers)
+
+    # Kept staples are rebuilt from the previous letters
+    kept = np.ones(len(old.stapleBases), dtype=bool)
+    kept[dropped] = False
+    kept_ids = np.flatnonzero(kept)
+    kept_bases = [old.stapleBases[i] for i in kept_ids.tolist()]
+    kept_letters = np.zeros(0, dtype=np.uint8)
+    if len(kept_bases) != 0:
+        kept_letters = state['lookUpStaple'].ravel()[
+            np.concatenate(kept_bases)]
+    kept_staples = seq_designer.SplitStrands(
+        kept_bases, lengthStrands, kept_letters, state_loops(state, 'stapleLoops'))
+
+    new_changed = changed_strands(new_staples, old.stapleBases, state['lookUpStaple'],
+                                  state_loops(state, 'stapleLoops'), lengthStrands)
+
+    # Merge kept and new staples in start base order, as a full run does
+    stapleBases = kept_bases + new_bases
+    stapleSequence = kept_staples + new_staples
+    changedStaples = [False] * len(kept_staples) + new_changed
+    order = np.argsort([int(bases[0])
+                       for bases in stapleBases], kind='stable').tolist()
+    stapleBases = [stapleBases[i] for i in order]
+    stapleSequence = [stapleSequence[i] for i in order]
+    changedStaples = [changedStaples[i] for i in order]
+
+    # Merged position of every previous and every new staple, -1 if dropped
+    merged = np.empty(len(order), dtype=np.int64)
+    merged[order] = np.arange(len(order))
+    old_position = np.full(len(old.stapleBases), -1, dtype=np.int64)
+    old_position[kept_ids] = merged[:len(kept_ids)]
+    new_position = merged[len(kept_ids):]
+
+    # Scaffolds are rebuilt from the previous letters
+    scaffoldLetters = np.zeros(0, dtype=np.uint8)
+    if len(old.scaffoldBases) != 0:
+        scaffoldLetters = lookUpScaffold.ravel()[
+            np.concatenate(old.scaffoldBases)]
+    scaffoldSequence = seq_designer.SplitStrands(
+        old.scaffoldBases, lengthStrands, scaffoldLetters, scaffoldLoops)
+    scaffoldStrands = list(scaffoldSequence)
+    scaffoldSequence.sort(key=len, reverse=True)
+
+    # Quality rules of the new staples, the issues of kept staples are
+    # reused if the previous run checked the same rules
+    old_quality = state_quality(state)
+    settings = rule_settings(VERIFY_RULES if rules is None else rules)
+    if old_quality is not None and json.dumps(old_quality.settings) == json.dumps(settings):
+        new_quality = seq_designer.VerifyReport(new_staples, rules)
+        quality = merge_reports(len(stapleSequence), [old_quality, new_quality],
+                                [old_position, new_position])
+    else:
+        quality = seq_designer.VerifyReport(stapleSequence, rules)
+    warnings = seq_designer.ReportWarnings(quality, stapleSequence, helixNums)
+
+    # Melting temperatures of the new staples, likewise
+    if 'stapleTm' in state and str(state['tmConditions']) == tm_key(conditions):
+        new_tm, new_domain_tm = seq_designer.FindStapleTm(new_staples, conditions)
+        domain_ends = np.cumsum(state['domainCounts']).tolist()
+        domain_starts = [0] + domain_ends[:-1]
+        staple_tm = np.empty(len(stapleSequence))
+        staple_tm[old_position[kept_ids]] = state['stapleTm'][kept_ids]
+        staple_tm[new_position] = new_tm
+        domain_tm = [None] * len(stapleSequence)
+        for i in kept_ids.tolist():
+            domain_tm[old_position[i]] = state['domainTm'][domain_starts[i]:domain_ends[i]]
+        for i, tms in zip(new_position.tolist(), new_domain_tm):
+            domain_tm[i] = tms
+    else:
+        staple_tm, domain_tm = seq_designer.FindStapleTm(stapleSequence, conditions)
+
+    # Staple domains binding the scaffolds at other places
+    off_targets = None
+    if offTarget is not None:
+        from kmer_index import scaffold_index
+        try:
+            primary_index = scaffold_index(scaffold_seq, offTarget)
+        except ValueError as error:
+            raise seq_designer.InputError(str(error)) from error
+        off_targets, domain_bases = seq_designer.FindOffTargets(
+            stapleSequence, scaffoldStrands, old.scaffoldBases, old.scaffoldOffsets, numStrands,
+            lengthStrands, primary_index, offset)
+        warnings += seq_designer.OffTargetWarnings(stapleSequence, off_targets, domain_bases, helixNums)
+
+    # Staple pairs binding each other
+    dimer_report = None
+    if dimers is not None:
+        dimer_report = seq_designer.FindStapleDimers(stapleSequence, dimers, workers)
+        warnings += seq_designer.DimerWarnings(seq_designer.DimerRows(stapleSequence, dimer_report, helixNums))
+
+    topology = seq_designer.Topology(fileName, numStrands, lengthStrands, helixNums, scaffolds, staples, skip,
+                                     loop, stapleBases, old.scaffoldIds, old.scaffoldBases, old.scaffoldOffsets)
+
+    result = seq_designer.DesignResult(fileName, numStrands, lengthStrands, helixNums, loop, scaffoldSequence,
+                                       stapleSequence, lookUpScaffold, lookUpStaple, scaffoldLoops, stapleLoops,
+                                       warnings, topology, changedStaples, quality=quality, stapleTm=staple_tm,
+                                       domainTm=domain_tm, offTargets=off_targets, dimers=dimer_report,
+                                       conditions=conditions)
+    result.changedRows = changed_rows(result, state, changed_cells)
+    result.helixHashes = hashes
+    result.scaffoldKey = key
+
+    return result
+
+
+def main(argv=None):
+    """
+    Command line interface of the incremental designer
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Sequence a cadnano design again, reusing the staples that did not change since the last run.")
+    parser.add_argument("json", help="cadnano .json file")
+    parser.add_argument("scaffold", help="scaffold sequence file")
+    parser.add_argument("--state",
+                        help="state of the previous run (default: state_<name>.npz in the output directory)")
+    parser.add_argument("--offset", type=int, default=0,
+                        help="start index of the scaffold sequence (default: 0)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed for secondary scaffolds (default: 0)")
+    parser.add_argument("--compress", action="store_true",
+                        help="write gzip compressed output files")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO,
+                        format="%(message)s", stream=sys.stdout)
+
+    name = seq_designer.DesignName(args.json)
+    path = args.state or state_path(name, name)
+
+    try:
+        rawScaffoldSequence = seq_designer.RawScaffoldSequence(args.scaffold)
+
+        result = redesign(args.json, rawScaffoldSequence, load_state(path),
+                          args.seed, args.offset)
+
+        result.WriteFiles(compress=args.compress)
+        save_state(path, result)
+    except seq_designer.SequenceDesignerError as error:
+        sys.exit(str(error))
+
+    logger.info(str(sum(result.changedStaples)) + " of " + str(len(result.staples)) + " staples and " +
+                str(int(result.changedRows.sum())) + " of " + str(result.numStrands) + " helices changed")
+    logger.info("Done!")
+
+
+if __name__ == "__main__":
+    time_start = time.time()
+    main()
+    time_elapsed = (time.time() - time_start)
+    print("Time elapsed: " + str(time_elapsed) + " seconds")
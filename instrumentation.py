@@ -0,0 +1,174 @@
+import time
+import pstats
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def max_rss():
+    """
+    Returns the peak resident memory of the process in bytes, or None on
+    platforms without the resource module.
+    """
+
+    if resource is None:
+        return None
+
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Profiler:
+    """
+    Collects wall time, CPU time and memory of named pipeline stages and
+    counters such as the number of bases traversed. Stages may be nested,
+    the time of a stage includes its inner stages.
+    If trace_memory is set, the peak_memory of a stage is the peak of
+    traced Python allocations during it, using tracemalloc. Otherwise a
+    stage only gets rss_growth, how much it raised the peak resident
+    memory of the process, as the process peak itself is the same for
+    every stage after the largest one. If cprofile is set, all stages are
+    profiled with cProfile as well.
+    """
+
+    def __init__(self, trace_memory=False, cprofile=False):
+        self.stages = {}
+        self.counters = {}
+        self.trace_memory = trace_memory
+        self.cprofile = cProfile.Profile() if cprofile else None
+
+        # Peak memory of every open stage, or the peak resident memory of the
+        # process when it opened, innermost last
+        self._peaks = []
+        self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager that adds the wall time, CPU time and memory of its
+        body to stage name.
+        """
+
+        if len(self._peaks) == 0:
+            self._start()
+
+        if self.trace_memory:
+            # Keep the peak of the enclosing stage before resetting it
+            peak = tracemalloc.get_traced_memory()[1]
+            if len(self._peaks) != 0:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            tracemalloc.reset_peak()
+            self._peaks.append(0)
+        else:
+            self._peaks.append(max_rss())
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - wall_start
+            cpu_time = time.process_time() - cpu_start
+
+            peak = self._peaks.pop()
+
+            entry = self.stages.setdefault(name, {'calls': 0, 'wall_time': 0.0, 'cpu_time': 0.0})
+            entry['calls'] += 1
+            entry['wall_time'] += wall_time
+            entry['cpu_time'] += cpu_time
+
+            if self.trace_memory:
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                if len(self._peaks) != 0:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+                entry['peak_memory'] = max(entry.get('peak_memory', 0), peak)
+            elif peak is not None:
+                entry['rss_growth'] = entry.get('rss_growth', 0) + max_rss() - peak
+
+            if len(self._peaks) == 0:
+                self._stop()
+
+    def count(self, name, amount=1):
+        """
+        Adds amount to counter name.
+        """
+
+        self.counters[name] = self.counters.get(name, 0) + int(amount)
+
+    def _start(self):
+        """
+        Starts tracing memory and profiling when the outermost stage opens.
+        """
+
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def _stop(self):
+        """
+        Stops what _start started when the outermost stage closes.
+        """
+
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def functions(self, limit=20):
+        """
+        Returns the limit functions with the largest cumulative time
+        measured by cProfile, empty if cprofile isn't set.
+        """
+
+        if self.cprofile is None:
+            return []
+
+        functions = []
+        for (file_name, line, function), (_, calls, total_time, cumulative_time, _) in \
+                pstats.Stats(self.cprofile).stats.items():
+            functions.append({
+                'function': function,
+                'file': file_name,
+                'line': line,
+                'calls': calls,
+                'total_time': total_time,
+                'cumulative_time': cumulative_time,
+            })
+        functions.sort(key=lambda function: function['cumulative_time'], reverse=True)
+
+        return functions[:limit]
+
+    def dump_stats(self, file_name):
+        """
+        Writes the cProfile statistics to file_name, to be read with pstats
+        or a viewer like snakeviz.
+        """
+
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(file_name)
+
+    def report(self):
+        """
+        Returns stages, counters, the peak resident memory of the process
+        and, if profiled, the most expensive functions as dictionary that
+        can be written as json. Times are in seconds, memory in bytes.
+        """
+
+        report = {
+            'stages': {name: dict(entry) for name, entry in self.stages.items()},
+            'counters': dict(self.counters),
+            'memory': 'traced' if self.trace_memory else 'rss_growth',
+            'max_rss': max_rss(),
+        }
+        if self.cprofile is not None:
+            report['functions'] = self.functions()
+
+        return report
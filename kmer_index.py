@@ -0,0 +1,197 @@
+import hashlib
+import numpy as np
+from sequence_metrics import encode_sequence, kmer_hashes
+
+
+# Length of the indexed k-mers, a random 12-mer occurs in an 8 kb
+# scaffold with a chance of about 1 in 2000
+DEFAULT_K = 12
+
+# Indexes kept in memory, by sequence, k and circular
+MAX_INDEXES = 8
+_indexes = {}
+
+
+class KmerIndex:
+    """
+    Sorted table of the k-mers of one or more sequences. hashes holds the
+    k-mers in base 4 (A=0, C=1, G=2, T=3) in sorted order, sequences and
+    positions where every k-mer starts. k-mers of circular sequences wrap
+    around their end. Lookups are binary searches in hashes.
+    """
+
+    def __init__(self, k, hashes, sequences, positions, lengths, circular):
+        self.k = k
+        self.hashes = hashes
+        self.sequences = sequences
+        self.positions = positions
+        self.lengths = lengths
+        self.circular = circular
+        self._hash_set = None
+
+    @classmethod
+    def build(cls, sequences, k=DEFAULT_K, circular=False):
+        """
+        Returns the index of a sequence or a list of sequences. k-mers
+        containing other letters than ACGT are left out.
+        """
+
+        if isinstance(sequences, str):
+            sequences = [sequences]
+        if not 0 < k <= 31:
+            raise ValueError("k has to be between 1 and 31")
+
+        lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+
+        # Circular sequences are extended by their first k - 1 letters
+        if circular:
+            sequences = [sequence + sequence[:k - 1] * (len(sequence) > 0) for sequence in sequences]
+
+        codes = encode_sequence(''.join(sequences))
+        extended = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+        starts = np.zeros(len(sequences), dtype=np.int64)
+        np.cumsum(extended[:-1], out=starts[1:])
+
+        positions, sequence_ids, hashes, _ = kmer_hashes(codes, starts, extended, k)
+        positions = positions - starts[sequence_ids]
+
+        # Extension letters only complete k-mers, they don't start one
+        original = positions < lengths[sequence_ids]
+        order = np.argsort(hashes[original], kind='stable')
+
+        return cls(k, hashes[original][order], sequence_ids[original][order],
+                   positions[original][order], lengths, circular)
+
+    def count(self, hashes):
+        """
+        Returns the number of occurrences of every k-mer hash.
+        """
+
+        hashes = np.asarray(hashes, dtype=np.int64)
+
+        return np.searchsorted(self.hashes, hashes, side='right') - \
+            np.searchsorted(self.hashes, hashes, side='left')
+
+    def matches(self, hashes):
+        """
+        Returns every occurrence of every k-mer hash as the index of the
+        hash, the sequence and the position, ordered by hash index.
+        """
+
+        hashes = np.asarray(hashes, dtype=np.int64)
+        low = np.searchsorted(self.hashes, hashes, side='left')
+        counts = np.searchsorted(self.hashes, hashes, side='right') - low
+
+        queries = np.repeat(np.arange(len(hashes)), counts)
+        found = np.repeat(low, counts) + np.arange(counts.sum()) - \
+            np.repeat(np.cumsum(counts) - counts, counts)
+
+        return queries, self.sequences[found], self.positions[found]
+
+    def locate(self, hash):
+        """
+        Returns the sequences and positions of all occurrences of a k-mer
+        hash.
+        """
+
+        low, high = np.searchsorted(self.hashes, [hash, hash + 1])
+
+        return self.sequences[low:high], self.positions[low:high]
+
+    def repeated(self, sequence=0):
+        """
+        Returns whether the k-mer starting at every position of a sequence
+        occurs more than once in the index. Positions without a k-mer are
+        False.
+        """
+
+        counts = np.zeros(self.lengths[sequence], dtype=np.int64)
+        own = self.sequences == sequence
+        counts[self.positions[own]] = self.count(self.hashes[own])
+
+        return counts > 1
+
+    def shared(self, sequences):
+        """
+        Returns the number of k-mers of every sequence that occur in the
+        index.
+        """
+
+        if isinstance(sequences, str):
+            sequences = [sequences]
+
+        other = KmerIndex.build(sequences, self.k)
+
+        return np.bincount(other.sequences[self.count(other.hashes) > 0],
+                           minlength=len(sequences))
+
+    def hash_set(self):
+        """
+        Returns the k-mer hashes as set, for lookups one k-mer at a time.
+        """
+
+        if self._hash_set is None:
+            self._hash_set = set(self.hashes.tolist())
+
+        return self._hash_set
+
+    def to_arrays(self):
+        """
+        Returns the index as dictionary of arrays.
+        """
+
+        return {
+            'k': np.array(self.k),
+            'hashes': self.hashes,
+            'sequences': self.sequences,
+            'positions': self.positions,
+            'lengths': self.lengths,
+            'circular': np.array(self.circular),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Returns the index stored by to_arrays.
+        """
+
+        return cls(int(arrays['k']), arrays['hashes'], arrays['sequences'], arrays['positions'],
+                   arrays['lengths'], bool(arrays['circular']))
+
+
+def scaffold_index(sequence, k=DEFAULT_K, circular=True, cache=None):
+    """
+    Returns the index of a scaffold sequence, circular by default. Indexes
+    are built once and kept in memory, and stored to and loaded from
+    cache, a TopologyCache, if given, so they are shared across runs.
+    """
+
+    memory_key = (sequence, k, circular)
+    index = _indexes.get(memory_key)
+    if index is not None:
+        return index
+
+    key = None
+    if cache is not None:
+        digest = hashlib.sha256(("kmer_index\n" + str(k) + "\n" + str(circular) + "\n").encode())
+        digest.update(sequence.encode())
+        key = digest.hexdigest()
+
+        arrays = cache.load(key)
+        if arrays is not None:
+            index = KmerIndex.from_arrays(arrays)
+
+    if index is None:
+        index = KmerIndex.build(sequence, k, circular)
+        if cache is not None:
+            try:
+                cache.store(key, index.to_arrays())
+            except OSError:
+                pass
+
+    # Drop the oldest index
+    if len(_indexes) >= MAX_INDEXES:
+        _indexes.pop(next(iter(_indexes)))
+    _indexes[memory_key] = index
+
+    return index
@@ -0,0 +1,326 @@
+import sys
+import argparse
+import numpy as np
+import seq_designer
+from topology_cache import TopologyCache
+from sequence_metrics import encode_sequence, IS_GC, COMPLEMENT_CODES
+from staple_quality import MAX_RUNS
+from kmer_index import scaffold_index, DEFAULT_K
+
+# Weight of every score component in the total score
+SCORE_WEIGHTS = {
+    'extreme_gc': 1.0,
+    'gc_windows': 0.1,
+    'runs': 1.0,
+    'tm_spread': 1.0,
+    'repeats': 1.0,
+}
+
+
+def staple_letter_map(cadnano, scaffold_seq, rng=0, cache=None):
+    """
+    Maps every letter of every staple to the letter of the scaffold
+    sequence it is complementary to. The staple letters are ordered as in
+    the staple sequences, skips have no letter.
+    Returns a dictionary with:\n
+    positions - position in the primary scaffold of every staple letter\n
+    is_primary - whether the letter pairs with the primary scaffold\n
+    fixed_codes - base code of letters that don't depend on the offset,
+    paired with a secondary scaffold or unpaired\n
+    starts, lengths - letter start and number of letters of every staple\n
+    primary_length - number of letters of the primary scaffold\n
+    The parsed topology is taken from cache, a TopologyCache, if given.
+    """
+
+    topology = seq_designer.FindTopology(cadnano, cache)
+    numStrands = topology.numStrands
+    lengthStrands = topology.lengthStrands
+    skip = topology.skip
+    stapleBases = topology.stapleBases
+    scaffoldIds = topology.scaffoldIds
+    scaffoldBases = topology.scaffoldBases
+    scaffoldOffsets = topology.scaffoldOffsets
+    stapleLengths = np.array([len(bases) for bases in stapleBases], dtype=np.int64)
+
+    lookUpScaffold, scaffoldLoops = seq_designer.CreateLookUpTable(
+        numStrands, lengthStrands)
+
+    # Sequence the scaffolds as the designer does, only the letters of the
+    # secondary scaffolds are used
+    seq_designer.FindScaffoldSequences(
+        scaffoldBases, scaffoldOffsets, scaffold_seq, lookUpScaffold, skip, scaffoldLoops, rng)
+
+    scaffold_lengths = seq_designer.FindLength(scaffoldOffsets)
+    primary = int(np.argmax(scaffold_lengths))
+
+    # Letter start and number of letters of every base of the primary scaffold
+    letter_starts = np.zeros(numStrands * lengthStrands, dtype=np.int64)
+    letter_starts[scaffoldBases[primary]] = scaffoldOffsets[primary][:-1]
+    base_lengths = seq_designer.BaseLengths(skip, topology.loop).ravel()
+
+    if len(stapleBases) == 0:
+        bases = np.zeros(0, dtype=np.int64)
+    else:
+        bases = np.concatenate(stapleBases)
+    on_primary = scaffoldIds.ravel()[bases] == primary
+
+    # Letters of bases that are not on the primary scaffold, a loop gets
+    # its reversed complement, a skip no letter and an unpaired base 'A'
+    scaffold_letters = lookUpScaffold.ravel()[bases]
+    fixed_letters = [None] * len(bases)
+    for k in np.flatnonzero(~on_primary).tolist():
+        base = divmod(int(bases[k]), lengthStrands)
+        if base in scaffoldLoops:
+            fixed_letters[k] = seq_designer.Complement(scaffoldLoops[base])
+        elif scaffold_letters[k] == ord('X'):
+            fixed_letters[k] = ""
+        else:
+            fixed_letters[k] = chr(seq_designer.COMPLEMENT[scaffold_letters[k]])
+
+    letter_counts = np.where(on_primary, base_lengths[bases], 0)
+    for k in np.flatnonzero(~on_primary).tolist():
+        letter_counts[k] = len(fixed_letters[k])
+
+    # Expand bases to letters, the letters of a loop run backwards along
+    # the scaffold
+    num_letters = int(letter_counts.sum())
+    letter_base = np.repeat(np.arange(len(bases)), letter_counts)
+    base_starts = np.zeros(len(bases) + 1, dtype=np.int64)
+    np.cumsum(letter_counts, out=base_starts[1:])
+    within = np.arange(num_letters) - base_starts[letter_base]
+
+    is_primary = on_primary[letter_base]
+    positions = letter_starts[bases][letter_base] + \
+        letter_counts[letter_base] - 1 - within
+    positions[~is_primary] = 0
+
+    fixed_codes = np.full(num_letters, 4, dtype=np.uint8)
+    fixed_codes[~is_primary] = encode_sequence(
+        ''.join(letters for letters in fixed_letters if letters is not None))
+
+    # Letters per staple
+    staple_ends = np.cumsum(stapleLengths, dtype=np.int64)
+    lengths = base_starts[staple_ends] - \
+        base_starts[staple_ends - stapleLengths]
+
+    starts = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+
+    return {
+        'positions': positions,
+        'is_primary': is_primary,
+        'fixed_codes': fixed_codes,
+        'starts': starts,
+        'lengths': lengths,
+        'primary_length': scaffold_lengths[primary],
+    }
+
+
+def tm_proxy(gc_count, length):
+    """
+    Returns a rough melting temperature in degrees Celsius from the GC count
+    and length of a sequence.
+    """
+
+    return 64.9 + 41 * (gc_count - 16.4) / length
+
+
+def score_offsets(letter_map, scaffold_seq, offsets, window=8, window_gc=(0.2, 0.8),
+                  staple_gc=(0.3, 0.7), max_runs=MAX_RUNS, index=None, block_letters=1 << 22):
+    """
+    Scores the staples for every start offset of the scaffold sequence at
+    once. The letters of all staples for a block of offsets are gathered
+    from the doubled scaffold sequence into one array of shape
+    (letters, offsets), every metric is computed along its first axis.
+    Returns a dictionary with an array of one value per offset for:\n
+    extreme_gc - staples with a GC fraction outside staple_gc\n
+    gc_windows - windows of given size with a GC fraction outside window_gc\n
+    runs - letters in excess of the longest allowed run of their base\n
+    tm_spread - length weighted standard deviation of the staple Tm proxy\n
+    repeats - staple k-mers on the primary scaffold whose scaffold k-mer
+    occurs elsewhere in the scaffold, with index the circular KmerIndex of
+    the scaffold sequence, by default of 12-mers
+    """
+
+    offsets = np.asarray(offsets, dtype=np.int64) % len(scaffold_seq)
+    num_offsets = len(offsets)
+
+    positions = letter_map['positions']
+    is_primary = letter_map['is_primary'][:, None]
+    fixed_codes = letter_map['fixed_codes'][:, None]
+    starts = letter_map['starts']
+    lengths = letter_map['lengths']
+    num_letters = len(positions)
+
+    results = {
+        'extreme_gc': np.zeros(num_offsets, dtype=np.int64),
+        'gc_windows': np.zeros(num_offsets, dtype=np.int64),
+        'runs': np.zeros(num_offsets, dtype=np.int64),
+        'tm_spread': np.zeros(num_offsets),
+        'repeats': np.zeros(num_offsets, dtype=np.int64),
+    }
+
+    non_empty = lengths > 0
+    starts = starts[non_empty]
+    lengths = lengths[non_empty]
+    ends = starts + lengths
+    if num_letters == 0 or len(lengths) == 0:
+        return results
+
+    # Staple codes come from the complement of the rotated scaffold, a
+    # letter at position p for offset o is at p + o of the doubled sequence
+    scaffold_codes = encode_sequence(scaffold_seq)
+    scaffold_codes = COMPLEMENT_CODES[np.concatenate(
+        [scaffold_codes, scaffold_codes])]
+
+    # Start of every full window of every staple
+    window_counts = np.maximum(lengths - window + 1, 0)
+    window_offsets = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(window_counts[:-1], out=window_offsets[1:])
+    window_starts = np.repeat(starts - window_offsets, window_counts) + \
+        np.arange(window_counts.sum())
+    low_gc = window_gc[0] * window
+    high_gc = window_gc[1] * window
+
+    # Pairs of neighbouring letters within the same staple
+    same_staple = np.ones(num_letters - 1, dtype=bool)
+    same_staple[starts[starts > 0] - 1] = False
+
+    run_limits = sorted(set(max_runs))
+    base_limits = np.array(list(max_runs) + [num_letters], dtype=np.int64)
+
+    weights = lengths / lengths.sum()
+
+    # k-mers of letters pairing with consecutive letters of the primary
+    # scaffold, a staple k-mer ending at letter p binds the scaffold k-mer
+    # starting at p + o of the doubled sequence
+    if index is None:
+        index = scaffold_index(scaffold_seq, DEFAULT_K)
+    k = index.k
+    repeated = index.repeated()
+    repeated = np.concatenate([repeated, repeated])
+    step = same_staple & letter_map['is_primary'][1:] & letter_map['is_primary'][:-1] & \
+        ((positions[:-1] - positions[1:]) % len(scaffold_seq) == 1)
+    cum_step = np.zeros(num_letters, dtype=np.int64)
+    np.cumsum(step, out=cum_step[1:])
+    kmer_ends = np.flatnonzero(cum_step[k - 1:] - cum_step[:max(num_letters - k + 1, 0)] == k - 1) + k - 1
+    kmer_positions = positions[kmer_ends]
+
+    block = max(1, block_letters // num_letters)
+    for first in range(0, num_offsets, block):
+        current = offsets[first:first + block]
+
+        codes = np.where(is_primary, scaffold_codes[positions[:, None] + current[None, :]],
+                         fixed_codes)
+
+        # GC count prefix sums along every staple
+        cum_gc = np.zeros((num_letters + 1, len(current)), dtype=np.int32)
+        np.cumsum(IS_GC[codes], axis=0, out=cum_gc[1:])
+
+        # Whole staple GC fraction and Tm proxy
+        gc_count = cum_gc[ends] - cum_gc[starts]
+        gc = gc_count / lengths[:, None]
+        results['extreme_gc'][first:first + block] = (
+            (gc < staple_gc[0]) | (gc > staple_gc[1])).sum(axis=0)
+
+        tm = tm_proxy(gc_count, lengths[:, None])
+        tm_mean = weights @ tm
+        results['tm_spread'][first:first + block] = np.sqrt(
+            weights @ (tm - tm_mean) ** 2)
+
+        # GC count of every window
+        window_count = cum_gc[window_starts + window] - cum_gc[window_starts]
+        results['gc_windows'][first:first + block] = (
+            (window_count < low_gc) | (window_count > high_gc)).sum(axis=0)
+
+        # A letter exceeds a run limit m if it starts m + 1 equal letters,
+        # every letter of a run beyond the limit is counted once
+        same = (codes[1:] == codes[:-1]) & same_staple[:, None]
+        cum_same = np.zeros((num_letters, len(current)), dtype=np.int32)
+        np.cumsum(same, axis=0, out=cum_same[1:])
+        limits = base_limits[np.minimum(codes, 4)]
+
+        runs = np.zeros(len(current), dtype=np.int64)
+        for limit in run_limits:
+            if limit >= num_letters:
+                continue
+            long_run = cum_same[limit:] - cum_same[:-limit] == limit
+            runs += (long_run & (limits[:-limit] == limit)).sum(axis=0)
+        results['runs'][first:first + block] = runs
+
+        results['repeats'][first:first + block] = repeated[
+            kmer_positions[:, None] + current[None, :]].sum(axis=0)
+
+    return results
+
+
+def scan_offsets(cadnano, scaffold_seq, top=10, rng=0, offsets=None, weights=SCORE_WEIGHTS, cache=None, **kwargs):
+    """
+    Scores every start offset of the scaffold sequence on the primary
+    scaffold of a design and returns the top best offsets as list of
+    dictionaries with the offset, its total score (lower is better) and
+    the score components of score_offsets. Offsets are the rotations the
+    designer applies with design(..., offset=offset), by default all
+    positions of the scaffold sequence.
+    """
+
+    letter_map = staple_letter_map(cadnano, scaffold_seq, rng, cache)
+
+    if offsets is None:
+        offsets = np.arange(len(scaffold_seq))
+
+    if 'index' not in kwargs:
+        kwargs['index'] = scaffold_index(scaffold_seq, cache=cache)
+    results = score_offsets(letter_map, scaffold_seq, offsets, **kwargs)
+
+    score = np.zeros(len(offsets))
+    for name, weight in weights.items():
+        score += weight * results[name]
+
+    order = np.lexsort((offsets, score))[:top]
+
+    ranking = []
+    for i in order.tolist():
+        entry = {'offset': int(offsets[i]), 'score': float(score[i])}
+        for name in results:
+            entry[name] = results[name][i].item()
+        ranking.append(entry)
+
+    return ranking
+
+
+def main(argv=None):
+    """
+    Command line interface of the offset scan
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Find the best start offsets of the scaffold sequence for a cadnano design.")
+    parser.add_argument("json", help="cadnano .json file")
+    parser.add_argument("scaffold", help="scaffold sequence file")
+    parser.add_argument("--top", type=int, default=10,
+                        help="number of offsets to report (default: 10)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed for secondary scaffolds (default: 0)")
+    parser.add_argument("--cache", metavar="DIRECTORY",
+                        help="cache parsed designs in this directory")
+    args = parser.parse_args(argv)
+
+    try:
+        rawScaffoldSequence = seq_designer.RawScaffoldSequence(args.scaffold)
+        cache = None if args.cache is None else TopologyCache(args.cache)
+        ranking = scan_offsets(args.json, rawScaffoldSequence,
+                               args.top, args.seed, cache=cache)
+    except seq_designer.SequenceDesignerError as error:
+        sys.exit(str(error))
+
+    print("Offset,Score,ExtremeGC,GCWindows,Runs,TmSpread,Repeats")
+    for entry in ranking:
+        print(','.join([str(entry['offset']), "{:.2f}".format(entry['score']),
+                        str(entry['extreme_gc']), str(entry['gc_windows']),
+                        str(entry['runs']), "{:.2f}".format(entry['tm_spread']),
+                        str(entry['repeats'])]))
+
+
+if __name__ == "__main__":
+    main()
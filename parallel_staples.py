@@ -0,0 +1,222 @@
+import numpy as np
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Bases sequenced per task, tasks hold whole staples
+CHUNK_BASES = 1 << 18
+
+# Shared arrays and their memory blocks of a worker process
+worker_arrays = {}
+worker_blocks = []
+
+
+def create_shared(shape, dtype):
+    """
+    Returns a new shared memory block and an array of given shape and
+    dtype on it.
+    """
+
+    dtype = np.dtype(dtype)
+    block = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def attach_shared(specs):
+    """
+    Attaches to the shared arrays described by specs, a dictionary of
+    (block name, shape, dtype). Returns the blocks and a dictionary of the
+    arrays.
+    """
+
+    blocks = []
+    arrays = {}
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    return blocks, arrays
+
+
+def init_worker(specs):
+    """
+    Attaches to the shared arrays once per worker process.
+    """
+
+    blocks, arrays = attach_shared(specs)
+    worker_blocks.extend(blocks)
+    worker_arrays.update(arrays)
+
+
+def sequence_chunk(arrays, first, last, length_strands):
+    """
+    Sequences staples first to last - 1. Gathers the scaffold letter of
+    every base, writes its complement to base_letters and the letters of
+    the staples, with loops expanded, to letters. Writes the helix row and
+    index of every base and the letter offsets of every staple, relative
+    to its first letter, with one extra entry per staple. Returns the
+    first base without a valid complement, -1 if all are valid.
+    """
+
+    base_starts = arrays['base_starts']
+    letter_starts = arrays['letter_starts']
+    first_base = base_starts[first]
+    last_base = base_starts[last]
+
+    bases = arrays['bases'][first_base:last_base]
+    letters = arrays['complement'][arrays['look_up_scaffold'][bases]]
+
+    invalid = np.flatnonzero(letters == 0)
+    if len(invalid) != 0:
+        return int(first_base + invalid[0])
+
+    arrays['base_letters'][first_base:last_base] = letters
+    helices, indices = np.divmod(bases, length_strands)
+    arrays['helices'][first_base:last_base] = helices
+    arrays['indices'][first_base:last_base] = indices
+
+    # One letter per base, loops replace it with their letters
+    starts = letter_starts[first_base:last_base]
+    arrays['letters'][starts] = letters
+    loop_of = arrays['loop_of'][first_base:last_base]
+    loop_starts = arrays['loop_starts']
+    for k in np.flatnonzero(loop_of >= 0).tolist():
+        loop = loop_of[k]
+        arrays['letters'][starts[k]:starts[k] + loop_starts[loop + 1] - loop_starts[loop]] = \
+            arrays['loop_letters'][loop_starts[loop]:loop_starts[loop + 1]]
+
+    # Letter offsets of every staple, staple s takes entries
+    # base_starts[s] + s to base_starts[s + 1] + s
+    staple_of = arrays['staple_of'][first_base:last_base]
+    arrays['offsets'][np.arange(first_base, last_base) + staple_of] = \
+        starts - letter_starts[base_starts[staple_of]]
+    staples = np.arange(first, last)
+    arrays['offsets'][base_starts[staples + 1] + staples] = \
+        letter_starts[base_starts[staples + 1]] - letter_starts[base_starts[staples]]
+
+    return -1
+
+
+def sequence_worker(first, last, length_strands):
+    """
+    Sequences staples first to last - 1 on the shared arrays of the worker.
+    """
+
+    return sequence_chunk(worker_arrays, first, last, length_strands)
+
+
+def sequence_staples(staple_bases, look_up_scaffold, loops, complement, workers=1, chunk_bases=None):
+    """
+    Sequences all staples, staple_bases holds the flat bases of every
+    staple, look_up_scaffold the scaffold letter of every base, loops the
+    letters of staple loops by (helix, index) and complement the
+    complementary letter of every letter code, 0 if invalid. With more
+    than one worker, the inputs and outputs are put in shared memory and
+    chunks of whole staples of about chunk_bases bases, CHUNK_BASES by
+    default, are sequenced by a process pool, every chunk writes its own
+    part of the outputs, so the result doesn't depend on the number of
+    workers and no per base data is pickled. Designs of a single chunk are
+    sequenced in process.
+    Returns a dictionary with base_letters, helices, indices, letters,
+    offsets, base_starts and letter_starts, see sequence_chunk, and
+    invalid, the first base without a valid complement or -1.
+    """
+
+    length_strands = look_up_scaffold.shape[1]
+    base_counts = np.array([len(bases) for bases in staple_bases], dtype=np.int64)
+    num_staples = len(staple_bases)
+    bases = np.concatenate(staple_bases).astype(np.int64)
+    num_bases = len(bases)
+
+    base_starts = np.zeros(num_staples + 1, dtype=np.int64)
+    np.cumsum(base_counts, out=base_starts[1:])
+    staple_of = np.repeat(np.arange(num_staples), base_counts)
+
+    # Loops of the staple bases
+    loop_cells = np.array(sorted(helix * length_strands + index for helix, index in loops), dtype=np.int64)
+    loop_texts = [loops[divmod(int(cell), length_strands)] for cell in loop_cells.tolist()]
+    loop_lengths = np.array([len(text) for text in loop_texts], dtype=np.int64)
+    loop_starts = np.zeros(len(loop_cells) + 1, dtype=np.int64)
+    np.cumsum(loop_lengths, out=loop_starts[1:])
+    loop_letters = np.frombuffer(''.join(loop_texts).encode('ascii'), dtype=np.uint8)
+
+    loop_of = np.searchsorted(loop_cells, bases)
+    is_loop = loop_of < len(loop_cells)
+    is_loop[is_loop] = loop_cells[loop_of[is_loop]] == bases[is_loop]
+    loop_of = np.where(is_loop, loop_of, -1)
+
+    letter_counts = np.ones(num_bases, dtype=np.int64)
+    letter_counts[is_loop] = loop_lengths[loop_of[is_loop]]
+    letter_starts = np.zeros(num_bases + 1, dtype=np.int64)
+    np.cumsum(letter_counts, out=letter_starts[1:])
+
+    inputs = {
+        'look_up_scaffold': look_up_scaffold.ravel(),
+        'complement': complement,
+        'bases': bases,
+        'base_starts': base_starts,
+        'staple_of': staple_of,
+        'letter_starts': letter_starts,
+        'loop_of': loop_of,
+        'loop_starts': loop_starts,
+        'loop_letters': loop_letters,
+    }
+    outputs = {
+        'base_letters': ((num_bases,), np.uint8),
+        'helices': ((num_bases,), np.int32),
+        'indices': ((num_bases,), np.int32),
+        'letters': ((int(letter_starts[-1]),), np.uint8),
+        'offsets': ((num_bases + num_staples,), np.int32),
+    }
+
+    # Chunks of whole staples of about chunk_bases bases
+    if chunk_bases is None:
+        chunk_bases = CHUNK_BASES
+    bounds = np.unique(np.append(np.searchsorted(
+        base_starts, np.arange(0, num_bases, chunk_bases), side='right') - 1, num_staples))
+    firsts = bounds[:-1].tolist()
+    lasts = bounds[1:].tolist()
+
+    if workers == 1 or len(firsts) <= 1:
+        arrays = dict(inputs)
+        for name, (shape, dtype) in outputs.items():
+            arrays[name] = np.empty(shape, dtype=dtype)
+        invalid = [sequence_chunk(arrays, first, last, length_strands) for first, last in zip(firsts, lasts)]
+        results = {name: arrays[name] for name in outputs}
+
+    else:
+        blocks = []
+        arrays = {}
+        try:
+            specs = {}
+            for name, array in inputs.items():
+                block, arrays[name] = create_shared(array.shape, array.dtype)
+                arrays[name][...] = array
+                blocks.append(block)
+                specs[name] = (block.name, array.shape, array.dtype.str)
+            for name, (shape, dtype) in outputs.items():
+                block, arrays[name] = create_shared(shape, dtype)
+                blocks.append(block)
+                specs[name] = (block.name, shape, np.dtype(dtype).str)
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                     initargs=(specs,)) as executor:
+                invalid = list(executor.map(sequence_worker, firsts, lasts,
+                                            [length_strands] * len(firsts)))
+
+            # Copy the outputs out of the shared blocks before freeing them
+            results = {name: np.array(arrays[name]) for name in outputs}
+        finally:
+            arrays = None
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    results['base_starts'] = base_starts
+    results['letter_starts'] = letter_starts
+    results['invalid'] = next((base for base in invalid if base >= 0), -1)
+    results['bases'] = bases
+
+    return results
@@ -1,17 +1,20 @@
 import random
 import itertools
-from openpyxl import Workbook
-from pathlib import Path
+import bisect
+import numpy as np
+from sequence_metrics import sequence_metrics
 
 
-def random_seq_creator(length):
+BASES = ["A", "C", "G", "T"]
+BASE_WEIGHTS = (29, 21, 21, 29)
 
-    bases = ["A", "C", "G", "T"]
-    sequence = []
+# Index of the avoided k-mers of a worker process
+worker_avoid = {}
 
-    for _ in range(length):
-        base = random.choices(bases, weights=(29, 21, 21, 29), k=1)
-        sequence = sequence + (base)
+
+def random_seq_creator(length, weights=BASE_WEIGHTS, rng=random):
+
+    sequence = rng.choices(BASES, weights=weights, k=length)
 
     sequence = ''.join(sequence)
     return sequence
@@ -19,63 +22,243 @@ def random_seq_creator(length):
 
 def consecutive_g_count(sequence):
 
-    consecutive_G = 0
+    consecutive_G = sequence_metrics(sequence)['max_runs'][0, 2]
 
-    counter = ([[k, len(list(g))] for k, g in itertools.groupby(sequence)])
-    #G_counter = [char for char in counter if counter [0]=="G"]
-    for char in counter:
-        if char[0] == "G":
-            G_count = char[1]
-            if G_count >= consecutive_G:
-                consecutive_G = G_count
-
-    return consecutive_G
+    return int(consecutive_G)
 
 
 def consecutive_c_count(sequence):
 
-    consecutive_C = 0
-
-    counter = ([[k, len(list(g))] for k, g in itertools.groupby(sequence)])
-    #C_counter = [char for char in counter if counter [0]=="G"]
-    for char in counter:
-        if char[0] == "C":
-            C_count = char[1]
-            if C_count >= consecutive_C:
-                consecutive_C = C_count
+    consecutive_C = sequence_metrics(sequence)['max_runs'][0, 1]
 
-    return consecutive_C
+    return int(consecutive_C)
 
 
-def gc_content(sequence, length):
+def gc_content(sequence, length=None):
 
-    GC_count = 0
+    if length is None:
+        length = len(sequence)
 
-    for base in sequence:
-        if base == 'G' or base == 'C':
-            GC_count = GC_count + 1
+    GC_count = int(sequence_metrics(sequence)['gc_count'][0])
 
     GC_percentage = GC_count/length * 100
 
     return GC_percentage
 
 
-def sequence_creator(length):
+def max_gc_count(length, max_gc):
+    """
+    Returns the largest number of G's and C's a sequence of given length
+    can contain without exceeding max_gc percent.
+    """
+
+    max_count = int(length * max_gc / 100)
+
+    # Guard against rounding up in the percentage calculation
+    while max_count > 0 and max_count / length * 100 > max_gc:
+        max_count -= 1
+
+    return max_count
+
+
+def allowed_weights(weights, allow_g, allow_c):
+    """
+    Returns the base weights with G and/or C set to zero if not allowed.
+    """
+
+    return (weights[0], weights[1] * allow_c, weights[2] * allow_g, weights[3])
+
+
+def sequence_creator(length, max_consecutive=4, max_gc=44, weights=BASE_WEIGHTS, rng=random, avoid=None):
+    """
+    Returns a pseudorandom sequence of given length and its GC percentage,
+    drawn from rng, the random module, a random.Random instance or a NumPy
+    Generator.
+    The sequence has no runs of more than max_consecutive G's or C's and a
+    GC content of at most max_gc percent. Both rules are enforced while
+    the sequence is built, a base that would break them is never drawn, so
+    the sequence never has to be regenerated. If avoid, a KmerIndex, is
+    given, a base that would complete one of its k-mers isn't drawn either,
+    unless every base would.
+    """
+
+    if length == 0:
+        return "", 0.0
+
+    # Cumulative weights for every combination of allowed G and C
+    cum_weights = {}
+    for allow_g in [True, False]:
+        for allow_c in [True, False]:
+            cum_weights[allow_g, allow_c] = list(itertools.accumulate(
+                allowed_weights(weights, allow_g, allow_c)))
 
-    should_restart = True
+    gc_left = max_gc_count(length, max_gc)
+    run_base = None
+    run_length = 0
 
-    while should_restart == True:
+    # Last k - 1 bases in base 4, to look up the k-mer every base completes
+    if avoid is not None:
+        avoid_hashes = avoid.hash_set()
+        prefix_mask = (1 << (2 * (avoid.k - 1))) - 1
+        prefix = 0
 
-        should_restart = False
-        sequence = random_seq_creator(length)
-        consecutive_G = consecutive_g_count(sequence)
-        consecutive_C = consecutive_c_count(sequence)
-        gc_percentage = gc_content(sequence, length)
+    # NumPy Generators draw all numbers at once
+    if isinstance(rng, np.random.Generator):
+        draw = iter(rng.random(length).tolist()).__next__
+    else:
+        draw = rng.random
 
-        if consecutive_C > 4 or consecutive_G > 4 or gc_percentage > 44:
-            should_restart = True
-            continue
+    sequence = [None] * length
 
-    #print ('Finished,', "Consecutive C = ", consecutive_C, "Consecutive G = ", consecutive_G)
+    for i in range(length):
+        allow_gc = gc_left > 0
+        allow_g = allow_gc and not (
+            run_base == "G" and run_length >= max_consecutive)
+        allow_c = allow_gc and not (
+            run_base == "C" and run_length >= max_consecutive)
+
+        current_weights = cum_weights[allow_g, allow_c]
+
+        if avoid is not None and i >= avoid.k - 1:
+            blocked = [(prefix << 2 | code) in avoid_hashes for code in range(4)]
+            if any(blocked):
+                avoid_weights = [0 if blocked[code] else weight for code, weight in
+                                 enumerate(allowed_weights(weights, allow_g, allow_c))]
+                if sum(avoid_weights) > 0:
+                    current_weights = list(itertools.accumulate(avoid_weights))
+
+        base = BASES[bisect.bisect(
+            current_weights, draw() * current_weights[-1], 0, 3)]
+
+        if avoid is not None:
+            prefix = (prefix << 2 | BASES.index(base)) & prefix_mask
+
+        if base == run_base:
+            run_length += 1
+        else:
+            run_base = base
+            run_length = 1
+
+        if base == "G" or base == "C":
+            gc_left -= 1
+
+        sequence[i] = base
+
+    sequence = ''.join(sequence)
+    gc_percentage = gc_content(sequence, length)
 
     return sequence, gc_percentage
+
+
+def run_seed(rng):
+    """
+    Returns the seed of a run, rng itself if it is an integer seed, else a
+    64 bit seed drawn from rng, the random module, a random.Random instance
+    or any other seed of random.Random.
+    """
+
+    # random.Random ignores the sign of integer seeds
+    if isinstance(rng, int):
+        return abs(rng)
+
+    if not hasattr(rng, 'getrandbits'):
+        rng = random.Random(rng)
+
+    return rng.getrandbits(64)
+
+
+def strand_rng(seed, start):
+    """
+    Returns the random stream of the strand starting at base start, a
+    NumPy Generator keyed by the run seed and start. Streams of different
+    strands are independent, so a strand gets the same sequence whatever
+    other strands are generated and in which order.
+    """
+
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(start,)))
+
+
+def init_worker(avoid):
+    """
+    Stores the index of the avoided k-mers once per worker process.
+    """
+
+    worker_avoid['avoid'] = avoid
+
+
+def strand_worker(length, seed, start):
+    """
+    Returns the sequence of a strand, avoiding the k-mers of the worker.
+    """
+
+    sequence, _ = sequence_creator(length, rng=strand_rng(seed, start), avoid=worker_avoid['avoid'])
+
+    return sequence
+
+
+def strand_sequences(lengths, starts, seed, avoid=None, workers=1):
+    """
+    Returns a pseudorandom sequence for every strand, see sequence_creator,
+    of given lengths, drawn from the stream of its start base, see
+    strand_rng. Strands are generated in a process pool of workers
+    processes, or in this process if workers is 1, the sequences don't
+    depend on the number of workers.
+    """
+
+    if workers == 1 or len(lengths) <= 1:
+        return [sequence_creator(length, rng=strand_rng(seed, start), avoid=avoid)[0]
+                for length, start in zip(lengths, starts)]
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(avoid,)) as executor:
+        return list(executor.map(strand_worker, lengths, [seed] * len(lengths), starts))
+
+
+def sequence_batch_creator(count, length, max_consecutive=4, max_gc=44, weights=BASE_WEIGHTS, rng=None):
+    """
+    Returns count pseudorandom sequences of given length and their GC
+    percentages, following the same rules as sequence_creator. All
+    sequences are built at once, one position at a time, using NumPy.
+    """
+
+    if rng is None:
+        rng = np.random.default_rng()
+
+    weights = np.array(weights, dtype=np.float64)
+    is_g = np.array([False, False, True, False])
+    is_c = np.array([False, True, False, False])
+    is_gc = is_g | is_c
+
+    gc_left = np.full(count, max_gc_count(length, max_gc))
+    run_base = np.full(count, -1)
+    run_length = np.zeros(count, dtype=np.int64)
+
+    sequences = np.empty((count, length), dtype=np.uint8)
+
+    for i in range(length):
+        # Zero the weights of the bases that would break a rule
+        run_full = run_length >= max_consecutive
+        current_weights = np.tile(weights, (count, 1))
+        current_weights[gc_left <= 0] *= ~is_gc
+        current_weights[run_full & (run_base == 2)] *= ~is_g
+        current_weights[run_full & (run_base == 1)] *= ~is_c
+
+        # Draw a base for every sequence from its cumulative weights
+        cum_weights = np.cumsum(current_weights, axis=1)
+        draw = rng.random(count) * cum_weights[:, -1]
+        base = np.minimum((cum_weights <= draw[:, None]).sum(axis=1), 3)
+
+        run_length = np.where(base == run_base, run_length + 1, 1)
+        run_base = base
+        gc_left -= is_gc[base]
+
+        sequences[:, i] = base
+
+    # Convert base indices to letters
+    letters = np.frombuffer(''.join(BASES).encode(), dtype=np.uint8)
+    sequences = [seq.tobytes().decode() for seq in letters[sequences]]
+    gc_percentages = sequence_metrics(sequences)['gc_count'] / max(length, 1) * 100
+
+    return sequences, gc_percentages
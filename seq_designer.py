@@ -1,471 +1,951 @@
 import os
 import json
 import sys
+import gzip
+import logging
+import argparse
 import numpy as np
 import random
-from scaffold_generator import sequence_creator
+from scaffold_generator import run_seed, strand_sequences
+from staple_quality import check_staples, DEFAULT_RULES, VERIFY_RULES
+from sequence_metrics import BASE_CODES, kmer_hashes
 import time
 
 
-def ParseJson():
+# Progress messages and staple warnings, shown by the command line interface
+logger = logging.getLogger(__name__)
+
+
+class SequenceDesignerError(Exception):
     """
-    Parse cadnano json file given by as command line argument.
-    Returns number of strands, length of strands (number of bases),
-    scaffolds and staple data.
+    Base class of all errors raised while sequencing a design.
+    """
+
+
+class InputError(SequenceDesignerError):
+    """
+    Raised when an input file or argument can't be used.
+    """
+
+
+class TopologyError(SequenceDesignerError):
+    """
+    Raised when the scaffold/staple data of a design is not valid, i.e. a
+    strand without breakpoint or an invalid skip/loop.
+    """
+
+
+class CircularStrandError(TopologyError):
+    """
+    Raised when scaffolds or staples have no breakpoint. bases holds the
+    [helix row, index] of a base of every circular strand, strandTypes
+    optionally whether it is a scaffold or staple.
+    """
+
+    def __init__(self, bases, helixNums=None, strandTypes=None):
+        self.bases = bases
+        self.strandTypes = strandTypes
+
+        names = [BaseName(base, helixNums) for base in bases]
+        if strandTypes is not None:
+            names = [strandType + " " + name for strandType,
+                     name in zip(strandTypes, names)]
+
+        super().__init__("Loop detected at base: " + ", ".join(names) +
+                         "\nMake sure staple or scaffolds at this base has a start and end" +
+                         "\nScaffold or staple does not have breakpoint")
+
+
+class ValidationError(TopologyError):
+    """
+    Raised when the json file is malformed, i.e. pointers to bases that
+    don't exist or don't point back. problems lists every problem found.
+    """
+
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__("Found " + str(len(problems)) + " problem(s) in json file:\n" +
+                         "\n".join(problems))
+
+
+class ScaffoldError(SequenceDesignerError):
+    """
+    Raised when the scaffolds can't be sequenced, i.e. there are none or the
+    scaffold sequence is too short or contains invalid bases.
+    """
+
+
+# Complement of every letter in the look up tables, 0 marks an empty base
+# which pairs with 'A'. Letters that are not a valid base map to 0.
+COMPLEMENT = np.zeros(256, dtype=np.uint8)
+COMPLEMENT[0] = ord('A')
+for base, complementBase in zip("ATGCX", "TACGX"):
+    COMPLEMENT[ord(base)] = ord(complementBase)
+
+
+class Strand:
     """
+    Scaffold or staple strand with the helix rows and indices of its bases
+    as int32 arrays and its letters as bytes. The letters of base k are
+    letters[offsets[k]:offsets[k + 1]], i.e. a single letter, 'X' for a
+    skip or multiple letters for a loop.
+    """
+
+    __slots__ = ['helices', 'indices', 'letters', 'offsets']
+
+    def __init__(self, helices, indices, letters, offsets):
+        self.helices = helices
+        self.indices = indices
+        self.letters = letters
+        self.offsets = offsets
+
+    def __len__(self):
+        """
+        Returns the number of bases.
+        """
+        return len(self.helices)
+
+    @property
+    def start(self):
+        """
+        Returns the first base as [helix, index].
+        """
+        return [int(self.helices[0]), int(self.indices[0])]
+
+    @property
+    def end(self):
+        """
+        Returns the last base as [helix, index].
+        """
+        return [int(self.helices[-1]), int(self.indices[-1])]
+
+    @property
+    def sequence(self):
+        """
+        Returns the sequence without skips.
+        """
+        return self.letters.replace(b'X', b'').decode()
+
+    @property
+    def length(self):
+        """
+        Returns the length of the sequence without skips.
+        """
+        return len(self.letters) - self.letters.count(b'X')
+
+    def BaseLetters(self, k):
+        """
+        Returns the letters of base k.
+        """
+        return self.letters[self.offsets[k]:self.offsets[k + 1]].decode()
+
+
+def CreateStrand(bases, lengthStrands, baseLetters, baseLoops):
+    """
+    Returns a Strand for the given flat base indices with one letter per
+    base from the uint8 array baseLetters. baseLoops maps positions along
+    the strand to the letters of a loop, which replace the single letter.
+    """
+
+    helices, indices = np.divmod(bases, lengthStrands)
+    helices = helices.astype(np.int32)
+    indices = indices.astype(np.int32)
+
+    if len(baseLoops) == 0:
+        offsets = np.arange(len(bases) + 1, dtype=np.int32)
+        return Strand(helices, indices, baseLetters.tobytes(), offsets)
+
+    baseLengths = np.ones(len(bases), dtype=np.int32)
+    letters = []
+    start = 0
+    for k in sorted(baseLoops):
+        baseLengths[k] = len(baseLoops[k])
+        letters.append(baseLetters[start:k].tobytes())
+        letters.append(baseLoops[k].encode('ascii'))
+        start = k + 1
+    letters.append(baseLetters[start:].tobytes())
+
+    offsets = np.zeros(len(bases) + 1, dtype=np.int32)
+    np.cumsum(baseLengths, out=offsets[1:])
+
+    return Strand(helices, indices, b''.join(letters), offsets)
+
+
+def DesignName(inputJson):
+    """
+    Returns the name of a design, the json file name without extension, or
+    the name in already loaded json data.
+    """
+
+    if isinstance(inputJson, dict):
+        return os.path.splitext(inputJson.get('name', 'design'))[0]
+
+    return os.path.splitext(os.path.basename(inputJson))[0]
+
 
-    print("Parsing json file...")
+def LoadJson(inputJson):
+    """
+    Returns the json data of a cadnano design, given as path or as already
+    loaded json data.
+    """
+
+    if isinstance(inputJson, dict):
+        return inputJson
+
+    try:
+        with open(inputJson, 'r') as json_data:
+            return json.load(json_data)
+    except (OSError, ValueError) as error:
+        raise InputError("Could not read json file " +
+                         str(inputJson) + ": " + str(error)) from error
+
+
+def IntegerProblem(values):
+    """
+    Returns why values, an array of json data, can't be stored as int32,
+    or None if they can. Floats, strings and booleans are not integers,
+    even if they have an integer value.
+    """
 
-    # Find json file location from argument input
-    if len(sys.argv) < 3:
-        sys.exit(
-            "Not enough files provided.\nPlease use \"Python3 seq_designer.py <filename.json> <scaffoldseq.txt>\" ")
-    elif len(sys.argv) > 3:
-        sys.exit(
-            "Too many files provided provided.\nPlease use \"Python3 seq_designer.py <filename.json> <scaffoldseq.txt>\" ")
+    if values.size == 0:
+        return None
+
+    limits = np.iinfo(np.int32)
+
+    if values.dtype.kind == 'O':
+        # Mixed values or integers too large for int64
+        items = values.ravel().tolist()
+        if any(not isinstance(item, int) or isinstance(item, bool) for item in items):
+            return "is not an integer"
+        inRange = limits.min <= min(items) and max(items) <= limits.max
+    elif values.dtype.kind in 'iu':
+        inRange = limits.min <= values.min() and values.max() <= limits.max
     else:
-        inputJson = sys.argv[1]
+        return "is not an integer"
 
-    # Load cadnano data
-    with open(inputJson, 'r') as json_data:
-        cadnanoData = json.load(json_data)
+    if not inRange:
+        return "is out of range"
 
-    strandData = cadnanoData['vstrands']
+    return None
+
+
+def HelixLayout(cadnanoData):
+    """
+    Returns the vstrands of loaded json data, the helix number of every
+    vstrand, the sorted helix numbers, the row of every vstrand, the number
+    of rows and the number of bases per helix. Raises a ValidationError if
+    a helix has no number or not the same number of bases in all arrays.
+    """
 
-    # Find filename without extension
-    if os.path.exists(sys.argv[1]):
-        fileName = os.path.basename(sys.argv[1])
-        fileName = os.path.splitext(fileName)[0]
+    if 'vstrands' not in cadnanoData or len(cadnanoData['vstrands']) == 0:
+        raise InputError("No vstrands found in json file")
+
+    strandData = cadnanoData['vstrands']
 
     # Numbers contained in strands
     nums = []
+    problems = []
     for i in range(len(strandData)):
+        if 'num' not in strandData[i]:
+            problems.append("Helix " + str(i) + " in json file has no number")
+            continue
         currNum = strandData[i]['num']
+        problem = IntegerProblem(np.asarray(currNum))
+        if problem is not None:
+            problems.append("Helix " + str(i) + " in json file has number " + repr(currNum) + ", which " + problem)
         nums.append(currNum)
+    if len(problems) != 0:
+        raise ValidationError(problems)
 
-    maxNum = max(nums)+1
+    # Sorted helix numbers, the position of a number is its row
+    helixNums = np.unique(np.array(nums, dtype=np.int32))
+    if len(helixNums) != len(nums):
+        raise InputError("Helix numbers in json file are not unique")
+    helixRows = np.searchsorted(helixNums, nums)
 
-    numStrands = maxNum
-    lengthStrands = len(strandData[0]['scaf'])
-
-    # Initialize arrays
-    scaffolds = np.empty(numStrands, dtype=object)
-    staples = np.empty(numStrands, dtype=object)
-    skip = np.empty(numStrands, dtype=object)
-    loop = np.empty(numStrands, dtype=object)
+    numStrands = len(helixNums)
+    lengthStrands = len(strandData[0].get('scaf', []))
 
-    emptyStrand = []
-    for i in range(lengthStrands):
-        emptyStrand.append([-1, -1, -1, -1])
+    # Every helix needs the same number of bases in all arrays
+    for i in range(len(strandData)):
+        for key in ['scaf', 'stap', 'skip', 'loop']:
+            if key not in strandData[i]:
+                problems.append("Helix " + str(nums[i]) + ": no " + key + " data")
+            elif len(strandData[i][key]) != lengthStrands:
+                problems.append("Helix " + str(nums[i]) + ": " + key + " has " + str(len(strandData[i][key])) +
+                                " bases, expected " + str(lengthStrands))
+    if len(problems) != 0:
+        raise ValidationError(problems)
 
-    # Load data of scaffolds and staples
-    for i in range(numStrands):
-        # If i exist in nums, set strandData
-        if i in nums:
-            scaffolds[i] = strandData[nums.index(i)]['scaf']
-            staples[i] = strandData[nums.index(i)]['stap']
-            skip[i] = strandData[nums.index(i)]['skip']
-            loop[i] = strandData[nums.index(i)]['loop']
-
-        # if strand doesn't exist
-        else:
-            scaffolds[i] = emptyStrand
-            staples[i] = emptyStrand
-            skip[i] = 0
-            loop[i] = 0
+    return strandData, nums, helixNums, helixRows, numStrands, lengthStrands
 
-    return numStrands, lengthStrands, scaffolds, staples, fileName, skip, loop
 
+def FillHelices(strandData, nums, helixRows, scaffolds, staples, skip, loop, helices=None):
+    """
+    Copies the scaf, stap, skip and loop data of the given vstrands, all if
+    helices is not given, to their rows of the arrays. Raises a
+    ValidationError if the data has the wrong shape.
+    """
 
-def CreateLookUpTable(numStrands, lengthStrands):
+    if helices is None:
+        helices = range(len(strandData))
+
+    problems = []
+    for i in helices:
+        for key, array in [('scaf', scaffolds), ('stap', staples), ('skip', skip), ('loop', loop)]:
+            try:
+                values = np.asarray(strandData[i][key])
+                problem = IntegerProblem(values)
+                if problem is not None:
+                    problems.append("Helix " + str(nums[i]) + ": " + key + " has a value which " + problem)
+                    continue
+                array[helixRows[i]] = values
+            except (ValueError, TypeError):
+                problems.append("Helix " + str(nums[i]) + ": " + key + " is not a list of " +
+                                ("[helix, index, helix, index] blocks" if array.ndim == 3 else "numbers"))
+    if len(problems) != 0:
+        raise ValidationError(problems)
+
+
+def RemapPointers(scaffolds, staples, helixNums, toRows=True):
     """
-    Returns a look up table for the scaffold in string formatm
-    initialized with empty initial values = ''.
+    Replaces the helix numbers of previous and next bases by helix rows in
+    place, or rows by numbers if toRows is not set.
     """
-    lookUpScaffold = [['' for x in range(lengthStrands)]
-                      for y in range(numStrands)]
-    return lookUpScaffold
 
+    for strand in [scaffolds, staples]:
+        for j in [0, 2]:
+            pointer = strand[:, :, j]
+            hasPointer = pointer != -1
+            if toRows:
+                pointer[hasPointer] = np.searchsorted(helixNums, pointer[hasPointer])
+            else:
+                pointer[hasPointer] = helixNums[pointer[hasPointer]]
 
-def RawScaffoldSequence():
+
+def ParseJson(inputJson):
     """
-    Returns raw scaffold sequence from input file
+    Parse cadnano json file, given as path or as already loaded json data.
+    Returns number of strands, length of strands (number of bases),
+    scaffolds and staple data. Scaffolds and staples are int32 arrays of
+    shape (numStrands, lengthStrands, 4), skip and loop int32 arrays of
+    shape (numStrands, lengthStrands).
+    Only helices present in the file get a row, ordered by helix number.
+    Helix numbers in the scaffold and staple pointers are remapped to rows,
+    helixNums holds the original helix number of every row.
     """
 
-    print("Parsing scaffold sequence...")
+    logger.info("Parsing json file...")
 
-    # Find scaffold sequence file location from argument input
-    if len(sys.argv) < 3:
-        sys.exit(
-            "Not enough files provided.\nPlease use \"Python3 seq_designer.py <filename.json> <scaffoldseq.txt>\" ")
-    else:
-        inputScaffold = sys.argv[2]
+    fileName = DesignName(inputJson)
 
-    # Load scaffold sequence data
-    with open(inputScaffold, 'r') as file:
-        scaffold_seq = file.read().replace('\n', '')
+    # Load cadnano data
+    cadnanoData = LoadJson(inputJson)
+    strandData, nums, helixNums, helixRows, numStrands, lengthStrands = HelixLayout(cadnanoData)
+
+    # Initialize arrays
+    scaffolds = np.empty((numStrands, lengthStrands, 4), dtype=np.int32)
+    staples = np.empty((numStrands, lengthStrands, 4), dtype=np.int32)
+    skip = np.empty((numStrands, lengthStrands), dtype=np.int32)
+    loop = np.empty((numStrands, lengthStrands), dtype=np.int32)
+
+    # Load data of scaffolds and staples
+    FillHelices(strandData, nums, helixRows, scaffolds, staples, skip, loop)
+
+    ValidateDesign(scaffolds, staples, skip, loop, helixNums)
+
+    # Remap helix numbers of previous and next bases to rows
+    RemapPointers(scaffolds, staples, helixNums)
+
+    return numStrands, lengthStrands, scaffolds, staples, fileName, skip, loop, helixNums
 
-    return scaffold_seq
 
+def ProblemsAt(mask, message, helixNums):
+    """
+    Returns a (row, index, text) problem for every base in mask, message
+    is a string or an array holding the text of every base in mask.
+    """
+
+    rows, indices = np.nonzero(mask)
+    if isinstance(message, str):
+        message = [message] * len(rows)
+
+    return [(row, index, BaseName([row, index], helixNums) + ": " + text)
+            for row, index, text in zip(rows.tolist(), indices.tolist(), message)]
+
+
+def ValidateDesign(scaffolds, staples, skip, loop, helixNums, cells=None):
+    """
+    Checks the arrays of a design in one vectorized pass over all bases,
+    before their pointers are remapped to rows. Checks that previous and
+    next bases are fully specified, on a helix in the file and within its
+    length, that they are not empty and point back, and that skips and
+    loops of scaffold bases are valid. cells, a boolean array of shape
+    (numStrands, lengthStrands), restricts the checks to the bases it
+    selects. Raises a ValidationError listing every problem, ordered by
+    location.
+    """
 
-def ForwardTraverse(strand, startBase):
+    numStrands, lengthStrands = skip.shape
+    problems = []
+
+    if cells is None:
+        cells = np.ones((numStrands, lengthStrands), dtype=bool)
+    cellRows, cellIndices = np.nonzero(cells)
+
+    def At(mask):
+        """
+        Returns the mask of the selected bases as mask of all bases.
+        """
+
+        full = np.zeros(cells.shape, dtype=bool)
+        full[cellRows[mask], cellIndices[mask]] = True
+
+        return full
+
+    for strandType, strand in [("scaffold", scaffolds), ("staple", staples)]:
+        blocks = strand[cellRows, cellIndices]
+        for direction, helixColumn, backColumn in [("previous", 0, 2), ("next", 2, 0)]:
+            helix = blocks[:, helixColumn]
+            index = blocks[:, helixColumn + 1]
+            hasHelix = helix != -1
+            hasIndex = index != -1
+
+            problems += ProblemsAt(At(hasHelix != hasIndex), strandType + " " + direction +
+                                   " base is only partly specified", helixNums)
+
+            # Helix numbers that are not in the file
+            rows = np.minimum(np.searchsorted(
+                helixNums, helix), numStrands - 1)
+            knownHelix = hasHelix & (helixNums[rows] == helix)
+            unknown = hasHelix & hasIndex & ~knownHelix
+            problems += ProblemsAt(At(unknown), [strandType + " " + direction + " base is on helix " + str(num) +
+                                                 ", which is not in json file" for num in helix[unknown].tolist()],
+                                   helixNums)
+
+            outOfRange = knownHelix & hasIndex & (
+                (index < 0) | (index >= lengthStrands))
+            problems += ProblemsAt(At(outOfRange), [strandType + " " + direction + " base index " + str(i) +
+                                                    " is out of range" for i in index[outOfRange].tolist()],
+                                   helixNums)
+
+            # Previous and next bases have to point back
+            valid = knownHelix & hasIndex & ~outOfRange
+            target = strand[rows[valid], index[valid]]
+            targetEmpty = (target == -1).all(axis=1)
+            pointsBack = (target[:, backColumn] == helixNums[cellRows[valid]]) & \
+                (target[:, backColumn + 1] == cellIndices[valid])
+
+            empty = np.zeros_like(valid)
+            empty[valid] = targetEmpty
+            problems += ProblemsAt(At(empty), strandType + " " + direction +
+                                   " base is empty", helixNums)
+
+            notBack = np.zeros_like(valid)
+            notBack[valid] = ~targetEmpty & ~pointsBack
+            problems += ProblemsAt(At(notBack), strandType + " " + direction +
+                                   " base does not point back to this base", helixNums)
+
+    # Skips and loops of scaffold bases
+    occupied = (scaffolds[cellRows, cellIndices] != -1).any(axis=1)
+    cellSkip = skip[cellRows, cellIndices]
+    cellLoop = loop[cellRows, cellIndices]
+    problems += ProblemsAt(At(occupied & (cellSkip != 0) & (cellSkip != -1)),
+                           "skip is not 0 or -1", helixNums)
+    problems += ProblemsAt(At(occupied & (cellLoop < 0)), "loop is negative", helixNums)
+    problems += ProblemsAt(At(occupied & (cellSkip == -1) & (cellLoop != 0)),
+                           "skip and loop at the same index", helixNums)
+
+    if len(problems) != 0:
+        problems.sort(key=lambda problem: problem[:2])
+        raise ValidationError([problem[2] for problem in problems])
+
+
+def BaseName(base, helixNums=None):
     """
-    Traverse scaffold/staple strand forward by a single base.
-    Returns next adjacent base and block.
+    Returns the location of a base in cadnano style, i.e. helix[index].
+    The row of the base is translated to its helix number if helixNums
+    is given.
     """
 
-    currentBase = startBase
-    currentBlock = strand[currentBase[0]][currentBase[1]]
+    helix = base[0] if helixNums is None else helixNums[base[0]]
 
-    nextBase = [currentBlock[2], currentBlock[3]]
-    nextBlock = strand[nextBase[0]][nextBase[1]]
+    return str(helix) + "[" + str(base[1]) + "]"
 
-    return nextBase, nextBlock
+
+def CreateLookUpTable(numStrands, lengthStrands):
+    """
+    Returns a look up table for the scaffold as uint8 array of letters,
+    initialized with empty initial values = 0, and an empty side table for
+    the sequences of loops, keyed by (helix, index).
+    """
+    lookUpScaffold = np.zeros((numStrands, lengthStrands), dtype=np.uint8)
+    lookUpLoops = {}
+    return lookUpScaffold, lookUpLoops
 
 
-def ReverseTraverse(strand, startBase):
+def RawScaffoldSequence(inputScaffold):
     """
-    Traverse scaffold/staple strand by a single base in reverse.
-    Returns previous adjacent base and block.
+    Returns raw scaffold sequence from input file
     """
 
-    currentBase = startBase
-    currentBlock = strand[currentBase[0]][currentBase[1]]
+    logger.info("Parsing scaffold sequence...")
 
-    prevBase = [currentBlock[0], currentBlock[1]]
-    prevBlock = strand[prevBase[0]][prevBase[1]]
+    # Load scaffold sequence data
+    try:
+        with open(inputScaffold, 'r') as file:
+            scaffold_seq = file.read().replace('\n', '')
+    except OSError as error:
+        raise InputError("Could not read scaffold file " +
+                         str(inputScaffold) + ": " + str(error)) from error
 
-    return prevBase, prevBlock
+    return scaffold_seq
 
 
-def TraverseEntireForward(strand, startSearchBase):
+def FindTerminalBases(strand):
     """
-    Traverse entire strand forward, returns end base.
-    If start search base doesn't have adjacent strands, i.e. [-1,-1,-1,-1],
-    return [-1,-1]. If no breakpoint is found, will exit.
+    Returns the start (5') and end (3') bases of all strands in the given
+    scaffold/staple array as [helix, index] rows. A start base is a
+    non-empty block without a previous base, an end base a non-empty block
+    without a next base.
     """
 
-    currentBase = startSearchBase
-    currentBlock = strand[currentBase[0]][currentBase[1]]
+    occupied = (strand != -1).any(axis=2)
 
-    # If current block is empty, return empty base
-    if currentBlock == [-1, -1, -1, -1]:
-        return [-1, -1]
+    startBases = np.argwhere(occupied & (strand[:, :, 0] == -1))
+    endBases = np.argwhere(occupied & (strand[:, :, 2] == -1))
 
-    nextBase, nextBlock = ForwardTraverse(strand, currentBase)
+    return startBases, endBases
 
-    # Traverse scaffolds until next base is [-1,-1]
-    while nextBase != [-1, -1]:
-        currentBlock = nextBlock
-        currentBase = nextBase
 
-        nextBase, nextBlock = ForwardTraverse(strand, currentBase)
+def FlatNextBases(strand):
+    """
+    Returns for every base the flat index (helix * lengthStrands + index)
+    of the next base in the strand, or -1 if there is no next base.
+    """
 
-        # Catch infinite loop when strand doesnt have breakpoint
-        if nextBase == startSearchBase:
-            print("Error: Loop detected at base: " +
-                  str(startSearchBase[0]) + "[" + str(startSearchBase[1]) + "]")
-            print("Make sure staple or scaffolds at this base has a start and end base")
-            sys.exit("Scaffold or staple does not have breakpoint")
+    lengthStrands = strand.shape[1]
 
-    endBase = currentBase
+    nextBases = strand[:, :, 2].astype(np.int64) * \
+        lengthStrands + strand[:, :, 3]
+    nextBases[strand[:, :, 2] == -1] = -1
 
-    return endBase
+    return nextBases.ravel()
 
 
-def TraverseEntireReverse(strand, startSearchBase):
+def BaseLengths(skip, loop):
     """
-    Traverse entire strand in reverse, returns start base.
-    If start search base doesn't have adjacent strands, i.e. [-1,-1,-1,-1],
-    return [-1,-1]. If no breakpoint is found, will exit.
+    Returns the number of letters every base adds to a sequence:
+    0 for a skip, loop + 1 for a loop and 1 otherwise.
     """
 
-    currentBase = startSearchBase
-    currentBlock = strand[currentBase[0]][currentBase[1]]
+    return np.where(skip == -1, 0, loop + 1)
+
 
-    # If current block is empty, return empty base
-    if currentBlock == [-1, -1, -1, -1]:
-        return [-1, -1]
+def FindCircularStrands(unvisited, nextBases, visited):
+    """
+    Walks the bases that can't be reached from a 5' end, in order, marking
+    them in visited. Returns the first base of every walk and the flat
+    bases of every walk that closes into a ring, starting at its lowest
+    base. A walk that runs into a dead end or an earlier walk is not a ring.
+    """
 
-    prevBase, prevBlock = ReverseTraverse(strand, currentBase)
+    circularBases = []
+    rings = []
 
-    # ForwardTraverse scaffolds until previous base is [-1,-1]
-    while prevBase != [-1, -1]:
-        currentBlock = prevBlock
-        currentBase = prevBase
+    for firstBase in unvisited.tolist():
+        if visited[firstBase]:
+            continue
 
-        prevBase, prevBlock = ReverseTraverse(strand, currentBase)
+        circularBases.append(firstBase)
 
-        # Catch infinite loop when strand doesnt have breakpoint
-        if prevBase == startSearchBase:
-            print("Error: Loop detected at base: " +
-                  str(startSearchBase[0]) + "[" + str(startSearchBase[1]) + "]")
-            print("Make sure staple or scaffolds at this base has a start and end")
-            sys.exit("Scaffold or staple does not have breakpoint")
+        # Position of every base along the walk
+        positions = {}
+        bases = []
+        currentBase = firstBase
+        while currentBase != -1 and not visited[currentBase]:
+            visited[currentBase] = True
+            positions[currentBase] = len(bases)
+            bases.append(currentBase)
+            currentBase = nextBases[currentBase]
 
-    startBase = currentBase
+        if currentBase in positions:
+            ring = bases[positions[currentBase]:]
+            lowest = ring.index(min(ring))
+            rings.append(ring[lowest:] + ring[:lowest])
 
-    return startBase
+    return circularBases, rings
 
 
-def FindStartStaples(strand, numStrands, lengthStrands):
+def BreakCircularStrands(strand, rings, position, helixNums=None):
     """
-    Returns all start and end bases of given strand.
+    Breaks circular strands in place, every ring of flat bases gets its
+    5' end position bases after its lowest base, i.e. its first base in
+    helix and index order.
     """
 
-    print("Finding staples...")
+    lengthStrands = strand.shape[1]
 
-    startBases = []
-    # Check all strands
-    for i in range(numStrands):
-        # Check all bases in each strand
-        for j in range(lengthStrands):
+    for ring in rings:
+        startBase = divmod(ring[position % len(ring)], lengthStrands)
+        endBase = divmod(ring[(position - 1) % len(ring)], lengthStrands)
 
-            startSearchBase = [i, j]
-            startBase = TraverseEntireReverse(strand, startSearchBase)
+        strand[startBase][0:2] = -1
+        strand[endBase][2:4] = -1
 
-            if startBase != [-1, -1]:
-                startBases.append(startBase)
+        logger.info("Warning: circular strand at " + BaseName(divmod(ring[0], lengthStrands), helixNums) +
+                    " broken before " + BaseName(startBase, helixNums))
 
-    # Extracts only unique start bases
-    startBases = [list(x) for x in set(tuple(x)
-                                       for x in startBases)]
 
-    return startBases
-
-
-def TraverseEntireReverseCheck(strand, startSearchBase, lookUpScaffold):
+def FindStrands(strand, numStrands, lengthStrands, helixNums=None, skip=None, loop=None, breakCircular=None):
     """
-    Traverse entire strand in reverse, returns start base.
-    If start search base doesn't have adjacent strands, i.e. [-1,-1,-1,-1],
-    return [-1,-1]. If no breakpoint is found, will exit.
-    Will return [-1,-1] if currentBase has already been checked through
-    look up scaffold.
+    Decomposes scaffold/staple data into separate strands. Every strand is
+    walked exactly once, starting from its 5' end, i.e. a non-empty block
+    without a previous base. Bases are marked as visited, so every walk is
+    bounded by the number of bases. Bases that are never visited belong to
+    circular strands, which are all reported in a CircularStrandError, or,
+    if breakCircular is a position, broken in place by
+    BreakCircularStrands at that position.
+    Returns strand ids for every base, ordered flat base indices
+    (helix * lengthStrands + index) of every strand, strand lengths (number
+    of bases) and strand offsets. The offsets of a strand are the prefix sum
+    of the number of letters of its bases given skip and loop: base k starts
+    at letter offsets[k] and the strand has offsets[-1] letters.
     """
 
-    currentBase = startSearchBase
-    currentBlock = strand[currentBase[0]][currentBase[1]]
+    startBases, _ = FindTerminalBases(strand)
+    startBases = startBases[:, 0] * lengthStrands + startBases[:, 1]
+    nextBases = FlatNextBases(strand).tolist()
+
+    strandIds = np.full(numStrands * lengthStrands, -1, dtype=np.int32)
+    strandBases = [None] * len(startBases)
+    strandLengths = np.zeros(len(startBases), dtype=np.int32)
+
+    # Every base is visited at most once, so a walk can't run forever
+    visited = [False] * (numStrands * lengthStrands)
 
-    # If current block is empty, return empty base
-    if currentBlock == [-1, -1, -1, -1]:
-        return [-1, -1]
+    for currentId, currentBase in enumerate(startBases.tolist()):
+        bases = []
 
-    # Set mark that it has been checked
-    lookUpScaffold[currentBase[0]][currentBase[1]] = '0'
+        # Traverse strand until there is no next base
+        while currentBase != -1:
+            if visited[currentBase]:
+                raise TopologyError("Strand starting at base " +
+                                    BaseName(divmod(bases[0], lengthStrands), helixNums) +
+                                    " runs into base " +
+                                    BaseName(divmod(currentBase, lengthStrands), helixNums) +
+                                    " a second time\nPrevious and next bases in json file are not consistent")
+            visited[currentBase] = True
+            bases.append(currentBase)
+            currentBase = nextBases[currentBase]
 
-    # Traverse backwards
-    prevBase, prevBlock = ReverseTraverse(strand, currentBase)
+        strandBases[currentId] = np.array(bases, dtype=np.int64)
+        strandIds[strandBases[currentId]] = currentId
+        strandLengths[currentId] = len(bases)
 
-    # If already checked before, return early
-    if lookUpScaffold[prevBase[0]][prevBase[1]] == '0':
-        return [-1, -1]
+    # Bases not reached from any 5' end belong to a strand without breakpoint
+    occupied = (strand != -1).any(axis=2)
+    unvisited = np.flatnonzero(occupied.ravel() & (strandIds == -1))
+    if len(unvisited) != 0:
+        circularBases, rings = FindCircularStrands(
+            unvisited, nextBases, visited)
 
-    # ForwardTraverse scaffolds until previous base is [-1,-1]
-    while prevBase != [-1, -1]:
-        currentBlock = prevBlock
-        currentBase = prevBase
-        # Set mark that it has been checked
-        lookUpScaffold[currentBase[0]][currentBase[1]] = '0'
+        if breakCircular is None or len(rings) != len(circularBases):
+            raise CircularStrandError([list(divmod(base, lengthStrands)) for base in circularBases],
+                                      helixNums)
 
-        # Traverse backwards
-        prevBase, prevBlock = ReverseTraverse(strand, currentBase)
+        BreakCircularStrands(strand, rings, breakCircular, helixNums)
 
-        # If already checked before, return early
-        if lookUpScaffold[prevBase[0]][prevBase[1]] == '0':
-            return [-1, -1]
+        return FindStrands(strand, numStrands, lengthStrands, helixNums, skip, loop)
 
-        # Catch infinite loop when strand doesnt have breakpoint
-        if prevBase == startSearchBase:
-            print("Error: Loop detected at base: " +
-                  str(startSearchBase[0]) + "[" + str(startSearchBase[1]) + "]")
-            print("Make sure staple or scaffolds at this base has a start and end")
-            sys.exit("Scaffold or staple does not have breakpoint")
+    strandIds = strandIds.reshape(numStrands, lengthStrands)
 
-    startBase = currentBase
+    # Prefix sum of the number of letters over all strands at once
+    if skip is None:
+        baseLengths = np.ones(numStrands * lengthStrands, dtype=np.int64)
+    else:
+        baseLengths = BaseLengths(skip, loop).ravel()
+
+    strandOffsets = [None] * len(strandBases)
+    if len(strandBases) != 0:
+        allOffsets = np.zeros(strandLengths.sum() + 1, dtype=np.int64)
+        np.cumsum(baseLengths[np.concatenate(strandBases)],
+                  out=allOffsets[1:])
 
-    return startBase
+        start = 0
+        for i in range(len(strandBases)):
+            end = start + strandLengths[i]
+            strandOffsets[i] = allOffsets[start:end + 1] - allOffsets[start]
+            start = end
 
+    return strandIds, strandBases, strandLengths, strandOffsets
 
-def FindStartScaffolds(strand, numStrands, lengthStrands, lookUpScaffold):
+
+def FindStartStaples(staples, numStrands, lengthStrands, helixNums=None, breakCircular=None):
     """
-    Returns all start and end bases of given strand.
+    Decomposes staple data into strands, see FindStrands.
+    Returns strand ids, bases, lengths and offsets of all staples.
     """
 
-    print("Finding scaffolds...")
+    logger.info("Finding staples...")
 
-    startBases = []
-    # Check all strands
-    for i in range(numStrands):
-        # Check all bases in each strand
-        for j in range(lengthStrands):
+    return FindStrands(staples, numStrands, lengthStrands, helixNums, breakCircular=breakCircular)
 
-            startSearchBase = [i, j]
-            startBase = TraverseEntireReverseCheck(
-                strand, startSearchBase, lookUpScaffold)
 
-            if startBase != [-1, -1]:
-                startBases.append(startBase)
+def FindStartScaffolds(scaffolds, numStrands, lengthStrands, helixNums=None, skip=None, loop=None,
+                       breakCircular=None):
+    """
+    Decomposes scaffold data into strands, see FindStrands. The offsets
+    account for skip and loop if given.
+    Returns strand ids, bases, lengths and offsets of all scaffolds.
+    """
 
-    # Extracts only unique start bases
-    startBases = [list(x) for x in set(tuple(x)
-                                       for x in startBases)]
+    logger.info("Finding scaffolds...")
 
-    return startBases
+    return FindStrands(scaffolds, numStrands, lengthStrands, helixNums, skip, loop, breakCircular)
 
 
-def CheckMultipleBase(startBase):
+def FindLength(strandOffsets):
     """
-    Checks if startBase contains multiple bases, if so returns true. Ex:\n
-    startBase = [0,50] -> returns false\n
-    startBase = [[3, 82], [0, 45]] -> returns true\n
-    This to avoid len(startBase) == 2 for both examples above.
+    Returns length of sequences for the strand offsets provided.
     """
 
-    return any(isinstance(el, list) for el in startBase)
+    return [int(offsets[-1]) for offsets in strandOffsets]
 
 
-def FindLength(strand, startSearchBase, skip, loop):
+def JoinArrays(arrays, dtype=np.int64):
     """
-    Returns length of sequences for the start bases provided.
+    Returns a list of 1D arrays as one concatenated array and the length of
+    every array.
     """
 
-    maxRange = len(startSearchBase)
-    length = [None] * len(startSearchBase)
+    lengths = np.array([len(array) for array in arrays], dtype=np.int64)
+    if len(arrays) == 0:
+        return np.zeros(0, dtype=dtype), lengths
 
-    # To avoid i.e. [0,50] and [[3, 82], [0, 45]] both having length 2
-    if len(startSearchBase) == 2:
-        if CheckMultipleBase(startSearchBase):
-            maxRange = 2
-        else:
-            length = [None] * 1
-            maxRange = 1
+    return np.concatenate(arrays).astype(dtype, copy=False), lengths
 
-    for i in range(maxRange):
-        if CheckMultipleBase(startSearchBase):
-            currentBase = startSearchBase[i]
-        else:
-            currentBase = startSearchBase
 
-        currentBlock = strand[currentBase[0]][currentBase[1]]
-        currentSkip = skip[currentBase[0]][currentBase[1]]
-        currentLoop = loop[currentBase[0]][currentBase[1]]
+def SplitArrays(joined, lengths):
+    """
+    Splits a concatenated array back into a list of arrays of given lengths.
+    """
 
-        length[i] = 0
+    return np.split(joined, np.cumsum(lengths)[:-1]) if len(lengths) != 0 else []
 
-        # If current block is empty, return empty base
-        if currentBlock == [-1, -1, -1, -1]:
-            break
 
-        nextBase, nextBlock = ForwardTraverse(strand, currentBase)
+class Topology:
+    """
+    Parsed design with its strands decomposed, everything needed to
+    sequence it apart from the scaffold sequence. Holds the arrays of
+    ParseJson, the flat bases of every staple and scaffold, the scaffold id
+    of every base and the scaffold offsets of FindStrands.
+    """
 
-        # If there is no skip and no loop
-        if currentSkip == 0 and currentLoop == 0:
-            length[i] = length[i] + 1
+    __slots__ = ['name', 'numStrands', 'lengthStrands', 'helixNums', 'scaffolds', 'staples',
+                 'skip', 'loop', 'stapleBases', 'scaffoldIds', 'scaffoldBases', 'scaffoldOffsets']
+
+    def __init__(self, name, numStrands, lengthStrands, helixNums, scaffolds, staples, skip, loop,
+                 stapleBases, scaffoldIds, scaffoldBases, scaffoldOffsets):
+        self.name = name
+        self.numStrands = numStrands
+        self.lengthStrands = lengthStrands
+        self.helixNums = helixNums
+        self.scaffolds = scaffolds
+        self.staples = staples
+        self.skip = skip
+        self.loop = loop
+        self.stapleBases = stapleBases
+        self.scaffoldIds = scaffoldIds
+        self.scaffoldBases = scaffoldBases
+        self.scaffoldOffsets = scaffoldOffsets
+
+    def ToArrays(self):
+        """
+        Returns the topology as dictionary of arrays, without its name.
+        Lists of arrays are concatenated.
+        """
+
+        stapleBases, stapleLengths = JoinArrays(self.stapleBases)
+        scaffoldBases, scaffoldLengths = JoinArrays(self.scaffoldBases)
+        scaffoldOffsets, _ = JoinArrays(self.scaffoldOffsets)
+
+        return {
+            'numStrands': np.array(self.numStrands),
+            'lengthStrands': np.array(self.lengthStrands),
+            'helixNums': self.helixNums,
+            'scaffolds': self.scaffolds,
+            'staples': self.staples,
+            'skip': self.skip,
+            'loop': self.loop,
+            'stapleBases': stapleBases,
+            'stapleLengths': stapleLengths,
+            'scaffoldIds': self.scaffoldIds,
+            'scaffoldBases': scaffoldBases,
+            'scaffoldLengths': scaffoldLengths,
+            'scaffoldOffsets': scaffoldOffsets,
+        }
+
+    @classmethod
+    def FromArrays(cls, name, arrays):
+        """
+        Returns the topology stored by ToArrays.
+        """
+
+        return cls(name, int(arrays['numStrands']), int(arrays['lengthStrands']), arrays['helixNums'],
+                   arrays['scaffolds'], arrays['staples'], arrays['skip'], arrays['loop'],
+                   SplitArrays(arrays['stapleBases'], arrays['stapleLengths']),
+                   arrays['scaffoldIds'],
+                   SplitArrays(arrays['scaffoldBases'],
+                               arrays['scaffoldLengths']),
+                   SplitArrays(arrays['scaffoldOffsets'], arrays['scaffoldLengths'] + 1))
+
+
+def BuildTopology(fileName, numStrands, lengthStrands, scaffolds, staples, skip, loop, helixNums, breakCircular=None, profiler=None):
+    """
+    Decomposes the staples and scaffolds of parsed json data, as returned
+    by ParseJson. Circular strands are broken at position breakCircular if
+    given, see FindStrands. Both walks are timed and counted by profiler if
+    given. Returns a Topology.
+    """
 
-        # If there is no skip, but there is a loop
-        elif currentSkip == 0 and currentLoop != 0:
-            length[i] = length[i] + currentLoop
+    if profiler is None:
+        from instrumentation import Profiler
+        profiler = Profiler()
 
-        # Traverse strand until next base is [-1,-1]
-        while nextBase != [-1, -1]:
-            currentBlock = nextBlock
-            currentBase = nextBase
-            currentSkip = skip[currentBase[0]][currentBase[1]]
-            currentLoop = loop[currentBase[0]][currentBase[1]]
+    # Circular staples and scaffolds are reported together
+    circularBases = []
+    strandTypes = []
 
-            nextBase, nextBlock = ForwardTraverse(strand, currentBase)
+    # Find staples
+    try:
+        with profiler.stage("FindStartStaples"):
+            profiler.count("traversal_calls")
+            _, stapleBases, stapleLengths, _ = FindStartStaples(
+                staples, numStrands, lengthStrands, helixNums, breakCircular)
+        profiler.count("strands_traversed", len(stapleBases))
+        profiler.count("bases_traversed", stapleLengths.sum())
+    except CircularStrandError as error:
+        circularBases += error.bases
+        strandTypes += ["staple"] * len(error.bases)
 
-            # If there is no skip and no loop
-            if currentSkip == 0 and currentLoop == 0:
-                length[i] = length[i] + 1
+    # Find scaffolds
+    try:
+        with profiler.stage("FindStartScaffolds"):
+            profiler.count("traversal_calls")
+            scaffoldIds, scaffoldBases, scaffoldLengths, scaffoldOffsets = FindStartScaffolds(
+                scaffolds, numStrands, lengthStrands, helixNums, skip, loop, breakCircular)
+        profiler.count("strands_traversed", len(scaffoldBases))
+        profiler.count("bases_traversed", scaffoldLengths.sum())
+    except CircularStrandError as error:
+        circularBases += error.bases
+        strandTypes += ["scaffold"] * len(error.bases)
 
-            # If there is no skip, but there is a loop
-            elif currentSkip == 0 and currentLoop != 0:
-                length[i] = length[i] + currentLoop
+    if len(circularBases) != 0:
+        raise CircularStrandError(circularBases, helixNums, strandTypes)
 
-    return length
+    return Topology(fileName, numStrands, lengthStrands, helixNums, scaffolds, staples, skip, loop,
+                    stapleBases, scaffoldIds, scaffoldBases, scaffoldOffsets)
 
 
-def FindSingleScaffold(scaffold, startBase, inputSequence, lookUpScaffold, skip, loop):
+def FindTopology(inputJson, cache=None, breakCircular=None, profiler=None):
     """
-    Appends base letter from inputSequence to each base in scaffold.
-    Returns sequence containing bases and base letters.
+    Parses a cadnano design and decomposes its staples and scaffolds,
+    circular strands are broken at position breakCircular if given.
+    Returns a Topology, inputJson itself if it already is one. If cache, a
+    TopologyCache, is given and holds the design, parsing and traversal are
+    skipped entirely. Otherwise the result is stored in the cache. Parsing
+    and traversal are timed by profiler if given.
     """
 
-    finalSequence = []
-    cnt = 0
-    currentBase = startBase
+    if isinstance(inputJson, Topology):
+        return inputJson
 
-    # Traverse scaffold until nextBase is [-1,-1]
-    while True:
+    if profiler is None:
+        from instrumentation import Profiler
+        profiler = Profiler()
 
-        currentSkip = skip[currentBase[0]][currentBase[1]]
-        currentLoop = loop[currentBase[0]][currentBase[1]]
+    fileName = DesignName(inputJson)
 
-        # If there is no skip and no loop
-        if currentSkip == 0 and currentLoop == 0:
+    if cache is not None:
+        # Files are keyed by their bytes, a hit never loads the json
+        try:
+            key = cache.key(inputJson, breakCircular)
+        except OSError as error:
+            raise InputError("Could not read json file " +
+                             str(inputJson) + ": " + str(error)) from error
 
-            # Append sequence
-            currentBase.append(inputSequence[cnt])
-            finalSequence.append(currentBase)
-            lookUpScaffold[currentBase[0]][currentBase[1]] = inputSequence[cnt]
+        with profiler.stage("TopologyCache:load"):
+            arrays = cache.load(key)
+        if arrays is not None:
+            logger.info("Loading cached topology...")
+            profiler.count("topology_cache_hits")
+            return Topology.FromArrays(fileName, arrays)
 
-            cnt += 1
+    # Load json data
+    with profiler.stage("ParseJson"):
+        numStrands, lengthStrands, scaffolds, staples, _, skip, loop, helixNums = ParseJson(
+            inputJson)
 
-        # If there is no skip, but there is a loop
-        elif currentSkip == 0 and currentLoop != 0:
+    topology = BuildTopology(fileName, numStrands, lengthStrands,
+                             scaffolds, staples, skip, loop, helixNums, breakCircular, profiler)
 
-            loopSequence = [inputSequence[cnt]]
-            cnt += 1
+    if cache is not None:
+        try:
+            cache.store(key, topology.ToArrays())
+        except OSError as error:
+            logger.info("Could not write topology cache: " + str(error))
 
-            # Find sequence for the whole loop
-            for i in range(currentLoop):
-                loopSequence.append(inputSequence[cnt])
-                cnt += 1
-            loopSequence = ''.join(loopSequence)
+    return topology
 
-            # Append sequence
-            currentBase.append(loopSequence)
-            finalSequence.append(currentBase)
-            lookUpScaffold[currentBase[0]][currentBase[1]] = loopSequence
 
-        # If there is a skip
-        elif currentSkip == -1:
+def FindSingleScaffold(scaffoldBases, scaffoldOffsets, inputSequence, lookUpScaffold, skip, scaffoldLoops):
+    """
+    Assigns letters from inputSequence to each base in scaffold, the
+    letters of base k start at scaffoldOffsets[k].
+    Returns the scaffold as Strand.
+    """
 
-            # Append 'X' to indicate skip
-            currentBase.append('X')
-            finalSequence.append(currentBase)
-            lookUpScaffold[currentBase[0]][currentBase[1]] = 'X'
+    lengthStrands = lookUpScaffold.shape[1]
 
-        else:
-            print("There is a skip and loop in the same index!")
-            sys.exit("Not a valid skip/loop array in json file!")
+    starts = scaffoldOffsets[:-1]
+    baseLengths = np.diff(scaffoldOffsets)
+    letters = np.frombuffer(
+        inputSequence[:scaffoldOffsets[-1]].encode('ascii'), dtype=np.uint8)
 
-        nextBase, nextBlock = ForwardTraverse(scaffold, currentBase)
+    # First letter of every base, 'X' to indicate skip
+    baseLetters = np.full(len(scaffoldBases), ord('X'), dtype=np.uint8)
+    hasLetters = baseLengths != 0
+    baseLetters[hasLetters] = letters[starts[hasLetters]]
+    np.put(lookUpScaffold, scaffoldBases, baseLetters)
 
-        # Break if end of scaffold is reached
-        if nextBase == [-1, -1]:
-            break
+    # Find sequence for the whole loop
+    baseLoops = {}
+    for k in np.flatnonzero(baseLengths > 1).tolist():
+        loopSequence = inputSequence[starts[k]:starts[k] + baseLengths[k]]
+        baseLoops[k] = loopSequence
+        scaffoldLoops[divmod(int(scaffoldBases[k]), lengthStrands)] = loopSequence
 
-        # Traverse to next base
-        currentBase = nextBase
-        currentBlock = nextBlock
-    return finalSequence
+    return CreateStrand(scaffoldBases, lengthStrands, baseLetters, baseLoops)
 
 
-def FindScaffoldSequences(scaffolds, scaffoldStartBase, rawScaffoldSequence, lookUpScaffold, skip, loop):
+def FindScaffoldSequences(scaffoldBases, scaffoldOffsets, rawScaffoldSequence, lookUpScaffold, skip, scaffoldLoops, rng=random, offset=0, avoid=None, workers=1):
     """
     Returns all scaffolds sequences, assigns the rawScaffoldSequence to the
-    longest scaffold. The other scaffolds get pseudorandomly generated sequences.
+    longest scaffold, starting at index offset of the circular sequence.
+    The other scaffolds get pseudorandomly generated sequences, without the
+    k-mers of avoid, a KmerIndex, if given. Every scaffold draws from its
+    own stream, keyed by the seed of rng and its first base, see
+    scaffold_generator.strand_rng, in workers processes.
     """
 
-    print("Generating scaffold sequences...")
+    logger.info("Generating scaffold sequences...")
 
-    length = FindLength(scaffolds, scaffoldStartBase, skip, loop)
+    length = FindLength(scaffoldOffsets)
 
     # Exit if no scaffold is found
     if length == []:
-        sys.exit("No scaffolds found")
+        raise ScaffoldError("No scaffolds found")
 
     maxIndex = np.argmax(length)
     maxRange = len(length)
@@ -473,27 +953,31 @@ def FindScaffoldSequences(scaffolds, scaffoldStartBase, rawScaffoldSequence, loo
 
     # Exit if scaffold sequence provided is not long enough
     if length[maxIndex] > len(rawScaffoldSequence):
-        sys.exit(
+        raise ScaffoldError(
             "Scaffold sequence given is not long enough.\nScaffold input length: "
             + str(len(rawScaffoldSequence)) + "\nLongest scaffold in json: "
             + str(length[maxIndex]) + "\nPlease provide a longer sequence.")
 
-    for i in range(maxRange):
-        if CheckMultipleBase(scaffoldStartBase):
-            currentBase = scaffoldStartBase[i]
-        else:
-            currentBase = scaffoldStartBase
+    # Rotate circular scaffold to start at offset
+    offset %= max(len(rawScaffoldSequence), 1)
+    rawScaffoldSequence = rawScaffoldSequence[offset:] + \
+        rawScaffoldSequence[:offset]
+
+    # Generate pseudorandom sequences for all other scaffolds
+    others = [i for i in range(maxRange) if i != maxIndex]
+    randomScaffoldSequences = dict(zip(others, strand_sequences(
+        [length[i] for i in others], [int(scaffoldBases[i][0]) for i in others],
+        run_seed(rng), avoid, workers)))
 
+    for i in range(maxRange):
         # Assign input scaffold to the longest scaffold in the file
         if i == maxIndex:
             finalSequence[i] = FindSingleScaffold(
-                scaffolds, currentBase, rawScaffoldSequence, lookUpScaffold, skip, loop)
+                scaffoldBases[i], scaffoldOffsets[i], rawScaffoldSequence, lookUpScaffold, skip, scaffoldLoops)
 
-        # Else generate pseudorandom sequence
         else:
-            randomScaffoldSequence, _ = sequence_creator(length[i])
             finalSequence[i] = FindSingleScaffold(
-                scaffolds, currentBase, randomScaffoldSequence, lookUpScaffold, skip, loop)
+                scaffoldBases[i], scaffoldOffsets[i], randomScaffoldSequences[i], lookUpScaffold, skip, scaffoldLoops)
 
     return finalSequence
 
@@ -505,333 +989,968 @@ def Complement(inputBase):
     calculated, and the sequence will be reversed.
     """
 
-    # Check for a loop
-    if len(inputBase) != 1:
-        complementBase = [None] * len(inputBase)
+    complementBase = COMPLEMENT[np.frombuffer(
+        inputBase.encode('ascii'), dtype=np.uint8)]
 
-        for i in range(len(inputBase)):
-            complementBase[i] = SingleComplement(inputBase[i])
+    if (complementBase == 0).any():
+        raise ScaffoldError(str(inputBase) + " is not a valid base")
 
-        # Invert loop sequence
-        complementBase = complementBase[::-1]
-        complementBase = ''.join(complementBase)
+    # Invert loop sequence
+    return complementBase[::-1].tobytes().decode()
 
-    # Else just return single complementary base
-    else:
-        complementBase = SingleComplement(inputBase)
 
-    return complementBase
+def FindStapleSequences(staples, stapleBases, lookUpScaffold, lookUpStaple, scaffoldLoops, stapleLoops, workers=1):
+    """
+    Finds complementary scaffold base letters of all staple bases at once,
+    by gathering the ordered bases of every staple from the look up
+    scaffold. Bases without a scaffold get 'A'. With more than one worker,
+    chunks of staples are sequenced in worker processes on shared memory,
+    see parallel_staples.sequence_staples. Returns all staples as Strand.
+    """
+
+    logger.info("Generating staple sequences...")
+
+    if len(stapleBases) == 0:
+        return []
+
+    # Loops are complemented and reversed as a whole
+    for loopBase, loopSequence in scaffoldLoops.items():
+        if (staples[loopBase] != -1).any():
+            stapleLoops[loopBase] = Complement(loopSequence)
+
+    if workers != 1:
+        return SharedStapleSequences(stapleBases, lookUpScaffold, lookUpStaple, stapleLoops, workers)
 
+    lengthStrands = staples.shape[1]
+    bases = np.concatenate(stapleBases)
 
-def SingleComplement(inputBase):
+    # Gather scaffold letters and take their complement
+    scaffoldLetters = lookUpScaffold.ravel()[bases]
+    letters = COMPLEMENT[scaffoldLetters]
+
+    invalid = np.flatnonzero(letters == 0)
+    if len(invalid) != 0:
+        raise ScaffoldError(
+            chr(scaffoldLetters[invalid[0]]) + " is not a valid base")
+
+    np.put(lookUpStaple, bases, letters)
+
+    return SplitStrands(stapleBases, lengthStrands, letters, stapleLoops)
+
+
+def SharedStapleSequences(stapleBases, lookUpScaffold, lookUpStaple, stapleLoops, workers):
     """
-    Returns the complementary base of a single input base.
+    Sequences all staples in workers processes, see FindStapleSequences.
+    The Strands are views of the gathered letters, helices, indices and
+    offsets of all staples.
     """
 
-    if inputBase == 'A':
-        return 'T'
-    elif inputBase == 'T':
-        return 'A'
-    elif inputBase == 'G':
-        return 'C'
-    elif inputBase == 'C':
-        return 'G'
+    from parallel_staples import sequence_staples
 
-    # Denotes a skip
-    elif inputBase == 'X':
-        return 'X'
+    sequenced = sequence_staples(stapleBases, lookUpScaffold, stapleLoops, COMPLEMENT, workers)
 
-    else:
-        sys.exit(str(inputBase) + " is not a valid base")
+    if sequenced['invalid'] >= 0:
+        raise ScaffoldError(
+            chr(lookUpScaffold.ravel()[sequenced['bases'][sequenced['invalid']]]) + " is not a valid base")
+
+    np.put(lookUpStaple, sequenced['bases'], sequenced['base_letters'])
+
+    baseStarts = sequenced['base_starts'].tolist()
+    letterStarts = sequenced['letter_starts'][sequenced['base_starts']].tolist()
+    helices = sequenced['helices']
+    indices = sequenced['indices']
+    offsets = sequenced['offsets']
+    letters = sequenced['letters'].tobytes()
 
+    return [Strand(helices[baseStarts[i]:baseStarts[i + 1]], indices[baseStarts[i]:baseStarts[i + 1]],
+                   letters[letterStarts[i]:letterStarts[i + 1]], offsets[baseStarts[i] + i:baseStarts[i + 1] + i + 1])
+            for i in range(len(stapleBases))]
 
-def FindStapleBase(stapleBase, lookUpScaffold):
+
+def SplitStrands(strandBases, lengthStrands, letters, loops):
     """
-    Find staple base by taking the complement of the scaffold base 
-    taken from the look up scaffold.
+    Returns a Strand for every array of flat bases in strandBases. letters
+    holds one letter per base of all strands concatenated, loops maps
+    (helix, index) to the letters of a loop, which replace the letter of
+    that base.
     """
 
-    # Look up base letter from look up table
-    scaffoldBaseLetter = lookUpScaffold[stapleBase[0]][stapleBase[1]]
+    if len(strandBases) == 0:
+        return []
 
-    # If no corresponding scaffolds is found, assign 'A'
-    if scaffoldBaseLetter == '':
-        stapleBaseLetter = 'A'
-    # Otherwise take complement of scaffold
-    else:
-        stapleBaseLetter = Complement(scaffoldBaseLetter)
+    bases = np.concatenate(strandBases)
+
+    # Positions of loops along every strand
+    ends = np.cumsum([len(bases) for bases in strandBases])
+    loopBases = np.array([helix * lengthStrands + index for helix, index in loops],
+                         dtype=np.int64)
+
+    loopPositions = [[] for i in range(len(strandBases))]
+    for position in np.flatnonzero(np.isin(bases, loopBases)).tolist():
+        i = np.searchsorted(ends, position, side='right')
+        loopPositions[i].append(position - (ends[i] - len(strandBases[i])))
+
+    # Split letters per strand
+    finalSequence = [None] * len(strandBases)
+    start = 0
+
+    for i in range(len(strandBases)):
+        end = ends[i]
+        baseLoops = {}
+        for k in loopPositions[i]:
+            baseLoops[k] = loops[divmod(
+                int(strandBases[i][k]), lengthStrands)]
+        finalSequence[i] = CreateStrand(
+            strandBases[i], lengthStrands, letters[start:end], baseLoops)
+        start = end
+
+    return finalSequence
 
-    return stapleBaseLetter
 
+def StapleDomains(stapleSequence):
+    """
+    Splits all staples into domains, stretches of bases on a single helix
+    between crossovers. Returns the base codes of the letters of all
+    staples concatenated, the letter start and number of letters of every
+    staple, the first letter of every base, and the first base, first
+    letter, end letter and number of domains of every staple.
+    """
 
-def FindStapleSequences(staples, stapleStartBases, lookUpScaffold, lookUpStaple):
+    codes = BASE_CODES[np.frombuffer(
+        b''.join(staple.letters for staple in stapleSequence), dtype=np.uint8)]
+
+    # Letter start of every staple and of every base
+    letterCounts = np.array([len(staple.letters) for staple in stapleSequence], dtype=np.int64)
+    letterStarts = np.zeros(len(stapleSequence), dtype=np.int64)
+    np.cumsum(letterCounts[:-1], out=letterStarts[1:])
+    baseCounts = np.array([len(staple) for staple in stapleSequence], dtype=np.int64)
+    baseStarts = np.zeros(len(stapleSequence), dtype=np.int64)
+    np.cumsum(baseCounts[:-1], out=baseStarts[1:])
+    baseLetters = np.concatenate([staple.offsets[:-1] for staple in stapleSequence]) + \
+        np.repeat(letterStarts, baseCounts)
+
+    # A domain starts at every staple start and every helix change
+    helices = np.concatenate([staple.helices for staple in stapleSequence])
+    newDomain = np.ones(len(helices), dtype=bool)
+    newDomain[1:] = helices[1:] != helices[:-1]
+    newDomain[baseStarts[baseCounts > 0]] = True
+    domainBases = np.flatnonzero(newDomain)
+    domainStarts = baseLetters[domainBases]
+    domainEnds = np.append(domainStarts[1:], len(codes))
+    domainCounts = np.bincount(np.searchsorted(baseStarts, domainBases, side='right') - 1,
+                               minlength=len(stapleSequence))
+
+    return codes, letterStarts, letterCounts, baseLetters, domainBases, domainStarts, domainEnds, domainCounts
+
+
+def FindStapleTm(stapleSequence, conditions=None):
     """
-    Finds complementary scaffold base letter from look up scaffold.
-    appends it to each staple base. Returns all staple sequences.
+    Computes the nearest-neighbor melting temperature of every staple and
+    of every domain of it, a stretch of bases on a single helix between
+    crossovers, all at once. conditions overrides the salt and strand
+    concentrations of thermodynamics.DEFAULT_CONDITIONS.
+    Returns the Tm of every staple and a list with the Tms of the domains
+    of every staple, nan for domains of fewer than two bases.
     """
 
-    print("Generating staple sequences...")
+    if len(stapleSequence) == 0:
+        return np.zeros(0), []
 
-    finalSequence = [None] * len(stapleStartBases)
+    from thermodynamics import segment_thermodynamics, DEFAULT_CONDITIONS
 
-    for i in range(len(stapleStartBases)):
+    conditions = dict(DEFAULT_CONDITIONS, **(conditions or {}))
 
-        currentBase = stapleStartBases[i]
-        currentBlock = staples[currentBase[0]][currentBase[1]]
+    codes, letterStarts, letterCounts, _, _, domainStarts, domainEnds, domainCounts = StapleDomains(
+        stapleSequence)
 
-        baseLetter = FindStapleBase(currentBase, lookUpScaffold)
-        currentBase.append(baseLetter)
-        finalSequence[i] = [currentBase]
+    try:
+        stapleTm = segment_thermodynamics(
+            codes, letterStarts, letterStarts + letterCounts, **conditions)['tm']
+        domainTm = segment_thermodynamics(
+            codes, domainStarts, domainEnds, **conditions)['tm']
+    except ValueError as error:
+        raise InputError(str(error)) from error
 
-        lookUpStaple[currentBase[0]][currentBase[1]] = baseLetter
+    return stapleTm, np.split(domainTm, np.cumsum(domainCounts)[:-1])
 
-        nextBase, nextBlock = ForwardTraverse(staples, currentBase)
 
-        # ForwardTraverse scaffolds until nextBase is [-1,-1]
-        while nextBase != [-1, -1]:
+def TmColumns(stapleTm, domainTm):
+    """
+    Returns the Tm and Domain Tm columns of the staple file, domain Tms
+    separated by spaces, '-' for domains too short for a Tm.
+    """
 
-            currentBase = nextBase
-            currentBlock = nextBlock
+    def Format(tm):
+        return "-" if np.isnan(tm) else "{:.1f}".format(tm)
 
-            baseLetter = FindStapleBase(currentBase, lookUpScaffold)
-            currentBase.append(baseLetter)
-            finalSequence[i].append(currentBase)
+    return [("Tm", [Format(tm) for tm in stapleTm.tolist()]),
+            ("Domain Tm", [' '.join(Format(tm) for tm in tms.tolist()) for tms in domainTm])]
 
-            lookUpStaple[currentBase[0]][currentBase[1]] = baseLetter
 
-            nextBase, nextBlock = ForwardTraverse(staples, currentBase)
+def FindOffTargets(stapleSequence, scaffoldStrands, scaffoldBases, scaffoldOffsets, numStrands, lengthStrands,
+                   primaryIndex, offset=0):
+    """
+    Counts for every staple domain the places its sequence binds the
+    scaffolds, apart from the place it is designed to bind. Every k-mer of
+    a domain, k of primaryIndex, the index of the circular input scaffold
+    sequence, is looked up in primaryIndex and in an index of the other
+    scaffolds, scaffoldStrands in FindScaffoldSequences order. Places
+    where any letter of a k-mer pairs with the scaffold letter it lines up
+    with are the designed place, and left out, as are k-mers with unpaired
+    letters. The input sequence starts at offset on the longest scaffold.
+    Returns a list with the largest number of other places of any k-mer of
+    every domain of every staple, and the first base of every domain.
+    """
 
-    return finalSequence
+    if len(stapleSequence) == 0:
+        return [], []
+
+    from kmer_index import KmerIndex
+
+    k = primaryIndex.k
+    primaryLength = int(primaryIndex.lengths[0])
+    lengths = FindLength(scaffoldOffsets)
+    primary = int(np.argmax(lengths))
+    secondaries = [i for i in range(len(scaffoldStrands)) if i != primary]
+    secondaryIndex = KmerIndex.build([scaffoldStrands[i].sequence for i in secondaries], k)
+
+    # Scaffold and first scaffold letter of every cell
+    cellScaffold = np.full(numStrands * lengthStrands, -1, dtype=np.int64)
+    cellLetter = np.zeros(numStrands * lengthStrands, dtype=np.int64)
+    for i in range(len(scaffoldBases)):
+        cellScaffold[scaffoldBases[i]] = i
+        cellLetter[scaffoldBases[i]] = scaffoldOffsets[i][:-1]
+
+    codes, letterStarts, letterCounts, baseLetters, domainBases, domainStarts, domainEnds, domainCounts = \
+        StapleDomains(stapleSequence)
+
+    # Scaffold letter every staple letter pairs with, loops run backwards
+    cells = np.concatenate([staple.helices.astype(np.int64) * lengthStrands + staple.indices
+                            for staple in stapleSequence])
+    baseLetterCounts = np.concatenate([np.diff(staple.offsets) for staple in stapleSequence])
+    letterBase = np.repeat(np.arange(len(cells)), baseLetterCounts)
+    within = np.arange(len(codes)) - baseLetters[letterBase]
+    letterScaffold = cellScaffold[cells][letterBase]
+    letterPosition = cellLetter[cells][letterBase] + baseLetterCounts[letterBase] - 1 - within
+
+    # Letters of the primary scaffold in input sequence coordinates
+    onPrimary = letterScaffold == primary
+    letterPosition[onPrimary] = (letterPosition[onPrimary] + offset) % max(primaryLength, 1)
+
+    # Leave out skips, letter bounds move along
+    keep = codes < 4
+    cumKeep = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(keep, out=cumKeep[1:])
+    codes = codes[keep]
+    letterScaffold = letterScaffold[keep]
+    letterPosition = letterPosition[keep]
+    stapleStarts = cumKeep[letterStarts]
+    stapleLengths = cumKeep[letterStarts + letterCounts] - stapleStarts
+    domainStarts = cumKeep[domainStarts]
+    domainEnds = cumKeep[domainEnds]
+
+    # A staple k-mer binds where the scaffold has its reverse complement,
+    # k-mers with unpaired letters (i.e. 'A's without scaffold) are left out
+    cumUnpaired = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(letterScaffold == -1, out=cumUnpaired[1:])
+    positions, _, _, complementHashes = kmer_hashes(codes, stapleStarts, stapleLengths, k)
+    allPaired = cumUnpaired[positions + k] == cumUnpaired[positions]
+    positions = positions[allPaired]
+    complementHashes = complementHashes[allPaired]
+
+    primaryQueries, _, primaryPlaces = primaryIndex.matches(complementHashes)
+    secondaryQueries, secondaryIds, secondaryPlaces = secondaryIndex.matches(complementHashes)
+    queries = np.concatenate([primaryQueries, secondaryQueries])
+    scaffolds = np.concatenate([np.full(len(primaryQueries), primary, dtype=np.int64),
+                                np.array(secondaries, dtype=np.int64)[secondaryIds]])
+    places = np.concatenate([primaryPlaces, secondaryPlaces])
+
+    # A place is the designed one if any letter of the k-mer pairs with the
+    # scaffold letter it lines up with there
+    designed = np.zeros(len(queries), dtype=bool)
+    for m in range(k):
+        letters = positions[queries] + m
+        expected = places + k - 1 - m
+        expected = np.where(scaffolds == primary, expected % max(primaryLength, 1), expected)
+        designed |= (letterScaffold[letters] == scaffolds) & (letterPosition[letters] == expected)
+
+    others = np.bincount(queries[~designed], minlength=len(positions))
+
+    # Largest count of the k-mers within every domain
+    domains = np.searchsorted(domainStarts, positions, side='right') - 1
+    inside = positions + k <= domainEnds[domains]
+    domainOthers = np.zeros(len(domainStarts), dtype=np.int64)
+    np.maximum.at(domainOthers, domains[inside], others[inside])
+
+    split = np.cumsum(domainCounts)[:-1]
+
+    return np.split(domainOthers, split), np.split(domainBases, split)
+
+
+def OffTargetWarnings(stapleSequence, offTargets, domainBases, helixNums=None):
+    """
+    Returns a warning for every staple domain that binds the scaffolds at
+    other places, see FindOffTargets. Every warning is logged.
+    """
+
+    warnings = []
+    for i in range(len(stapleSequence)):
+        firstBase = int(domainBases[i][0]) if len(domainBases[i]) != 0 else 0
+        for others, base in zip(offTargets[i].tolist(), domainBases[i].tolist()):
+            if others > 0:
+                k = base - firstBase
+                warnings.append("Warning: staple " + str(i) + " at " +
+                                BaseName(stapleSequence[i].start, helixNums) + " has a domain at " +
+                                BaseName([int(stapleSequence[i].helices[k]), int(stapleSequence[i].indices[k])],
+                                         helixNums) +
+                                " that binds the scaffold at " + str(others) + " other places")
+
+    for warning in warnings:
+        logger.info(warning)
 
+    return warnings
 
-def VerifyStaples(stapleSequence):
+
+def FindStapleDimers(stapleSequence, settings=None, workers=1):
     """
-    Checks for staples shorter than 15 or longer than 60, returns warning if found.
-    Also checks if there are staples with more than 7 consecutive A's at the edge,
-    which might indicate a long staple strand which is not connected to a scaffold.
+    Screens all pairs of staples for cross-hybridization, see
+    cross_hybridization.screen_staples. settings overrides its
+    DEFAULT_SETTINGS, workers is the number of processes scoring pairs.
+    Returns a DimerReport.
     """
 
-    print("Verifying staples...")
+    from cross_hybridization import screen_staples
 
-    # Check for staples longer than 60 or shorter than 15
-    for i in range(len(stapleSequence)):
-        if len(stapleSequence[i]) > 60:
-            print("Warning: staple " + str(i) +
-                  " at " + str(stapleSequence[i][0][0]) + "[" + str(stapleSequence[i][0][1]) + "]" + " has length " + str(len(stapleSequence[i])) + " (>60)")
-        elif len(stapleSequence[i]) < 15:
-            print("Warning: staple " + str(i) +
-                  " at " + str(stapleSequence[i][0][0]) + "[" + str(stapleSequence[i][0][1]) + "]" + " has length " + str(len(stapleSequence[i])) + " (<15)")
-
-    # Check for 7 consecutive A's next to eachother at the staple edges
-    for i in range(len(stapleSequence)):
-        if len(stapleSequence[i]) >= 7:
-            if (stapleSequence[i][0][2] == stapleSequence[i][1][2] ==
-                    stapleSequence[i][2][2] == stapleSequence[i][3][2] ==
-                    stapleSequence[i][4][2] == stapleSequence[i][5][2] ==
-                    stapleSequence[i][6][2] == 'A'):
-                print("Warning: staple " + str(i) +
-                      " at " + str(stapleSequence[i][0][0]) + "[" + str(stapleSequence[i][0][1]) + "]" + " has 7 or more consecutive A's at the start")
-            if (stapleSequence[i][-1][2] == stapleSequence[i][-2][2] ==
-                stapleSequence[i][-3][2] == stapleSequence[i][-4][2] ==
-                stapleSequence[i][-5][2] == stapleSequence[i][-6][2] ==
-                    stapleSequence[i][-7][2] == 'A'):
-                print("Warning: staple " + str(i) +
-                      " at " + str(stapleSequence[i][0][0]) + "[" + str(stapleSequence[i][0][1]) + "]" + " has 7 or more consecutive A's at the end")
+    try:
+        return screen_staples([staple.sequence for staple in stapleSequence], settings, workers)
+    except ValueError as error:
+        raise InputError(str(error)) from error
+
+
+def LetterBase(strand, letter):
+    """
+    Returns the [helix, index] location of the base a letter of the
+    sequence of a strand, without skips, belongs to.
+    """
+
+    letters = np.flatnonzero(np.frombuffer(strand.letters, dtype=np.uint8) != ord('X'))
+    k = int(np.searchsorted(strand.offsets, letters[letter], side='right')) - 1
+
+    return [int(strand.helices[k]), int(strand.indices[k])]
+
+
+def DimerRows(stapleSequence, report, helixNums=None):
+    """
+    Returns a row for every staple pair of a DimerReport, in rank order:
+    rank, both staples and their start, score and the first and last base
+    of the duplex in both staples.
+    """
+
+    rows = []
+    for rank, pair in enumerate(report.pairs()):
+        first = stapleSequence[pair['first']]
+        second = stapleSequence[pair['second']]
+        rows.append([
+            str(rank + 1),
+            str(pair['first']), BaseName(first.start, helixNums),
+            str(pair['second']), BaseName(second.start, helixNums),
+            str(pair['score']),
+            BaseName(LetterBase(first, pair['first_letters'][0]), helixNums) + "-" +
+            BaseName(LetterBase(first, pair['first_letters'][1]), helixNums),
+            BaseName(LetterBase(second, pair['second_letters'][0]), helixNums) + "-" +
+            BaseName(LetterBase(second, pair['second_letters'][1]), helixNums)])
+
+    return rows
+
+
+def DimerWarnings(dimerRows):
+    """
+    Returns a warning for every staple pair of DimerRows that can bind
+    each other. Every warning is logged.
+    """
+
+    warnings = ["Warning: staples " + row[1] + " at " + row[2] + " and " + row[3] + " at " + row[4] +
+                " can bind each other between " + row[6] + " and " + row[7] + " (score " + row[5] + ")"
+                for row in dimerRows]
 
+    for warning in warnings:
+        logger.info(warning)
 
-def PrintSequence(sequence, fileName, view=1):
+    return warnings
+
+
+def PrintDimers(dimerRows, fileName, compress=False):
+    """
+    Prints the ranked staple pairs of DimerRows to file.
+    """
+
+    logger.info("Outputting data to " + fileName + "...")
+
+    with OpenOutputFile(fileName, compress) as outputFile:
+        outputFile.write("Rank,Staple 1,Start 1,Staple 2,Start 2,Score,Duplex 1,Duplex 2\n")
+        outputFile.write(''.join(','.join(row) + "\n" for row in dimerRows))
+
+
+def VerifyStaples(stapleSequence, helixNums=None, rules=None):
+    """
+    Checks all staples at once with the staple quality rules, by default
+    only those of the original verification: staples shorter than 15 or
+    longer than 60, and staples with 7 or more consecutive A's at the edge,
+    which might indicate a long staple strand which is not connected to a
+    scaffold. rules selects and configures other rules, see
+    staple_quality.check_staples.
+    Returns a list of all warnings.
+    """
+
+    report = VerifyReport(stapleSequence, rules)
+
+    return ReportWarnings(report, stapleSequence, helixNums)
+
+
+def VerifyReport(stapleSequence, rules=None):
+    """
+    Runs the staple quality rules on all staples, VERIFY_RULES if rules
+    is not given. Skips are kept as 'X' so they break runs and k-mers.
+    Returns a QualityReport.
+    """
+
+    logger.info("Verifying staples...")
+
+    if rules is None:
+        rules = VERIFY_RULES
+
+    try:
+        return check_staples([staple.letters.decode() for staple in stapleSequence], rules,
+                             [len(staple) for staple in stapleSequence])
+    except ValueError as error:
+        raise InputError(str(error)) from error
+
+
+def ReportWarnings(report, stapleSequence, helixNums=None):
+    """
+    Returns a warning for every issue of a QualityReport, naming the staple
+    and its start base. Every warning is logged.
+    """
+
+    warnings = []
+    for i in range(len(report)):
+        staple = int(report.staple[i])
+        warnings.append("Warning: staple " + str(staple) + " at " +
+                        BaseName(stapleSequence[staple].start, helixNums) + " " + report.message(i))
+
+    for warning in warnings:
+        logger.info(warning)
+
+    return warnings
+
+
+def OpenOutputFile(fileName, compress=False):
+    """
+    Opens file for writing text, gzip compressed if compress is set, in
+    which case .gz is appended to the file name.
+    """
+
+    if compress:
+        return gzip.open(fileName + ".gz", 'wt')
+
+    return open(fileName, 'w')
+
+
+def PrintSequence(sequence, fileName, view=1, helixNums=None, compress=False, changed=None, columns=None):
     """
-    Prints sequence to file, 0 = detailed view, 1 = cadnano view
+    Prints sequence to file, 0 = detailed view, 1 = cadnano view.
+    Every line is built in memory and written at once. columns adds
+    (header, values) columns to the cadnano view. If changed is given, it
+    gets a Status column marking every strand as changed or unchanged.
     """
 
-    print("Outputting data to " + fileName + "...")
+    if columns is None:
+        columns = []
+
+    logger.info("Outputting data to " + fileName + "...")
+
+    if view not in [0, 1]:
+        raise InputError("Not a valid print mode.")
 
     # Open file
-    outputFile = open(fileName, 'w')
-
-    # Print in detailed view
-    if view == 0:
-        for i in range(len(sequence)):
-            outputFile.write("Staple " + str(i) + ":\n")
-            for seq in sequence[i]:
-                outputFile.write(str(seq) + "\n")
-            outputFile.write("\n")
-
-    # Print in cadnano style view
-    elif view == 1:
-        outputFile.write("Start,End,Sequence,Length\n")
-        for i in range(len(sequence)):
-            currentSequence = sequence[i]
-            outputFile.write(str(currentSequence[0][0]) + "[" + str(currentSequence[0][1]) + "]," +
-                             str(currentSequence[-1][0]) + "[" + str(currentSequence[-1][1]) + "],")
-            cnt = 0
-            for j in range(len(currentSequence)):
-                if currentSequence[j][2] != 'X':
-                    outputFile.write(str(currentSequence[j][2]))
-                    cnt += len(currentSequence[j][2])
-            outputFile.write("," + str(cnt) + "\n")
-    else:
-        sys.exit("Not a valid print mode.")
+    with OpenOutputFile(fileName, compress) as outputFile:
+
+        # Print in detailed view
+        if view == 0:
+            for i in range(len(sequence)):
+                currentSequence = sequence[i]
+                helices = currentSequence.helices
+                if helixNums is not None:
+                    helices = helixNums[helices]
+
+                lines = ["Staple " + str(i) + ":\n"]
+                for j in range(len(currentSequence)):
+                    lines.append(str([int(helices[j]), int(currentSequence.indices[j]),
+                                      currentSequence.BaseLetters(j)]) + "\n")
+                lines.append("\n")
+                outputFile.write(''.join(lines))
+
+        # Print in cadnano style view
+        else:
+            headers = ["Start", "End", "Sequence", "Length"] + [header for header, _ in columns]
+            if changed is not None:
+                headers.append("Status")
+            outputFile.write(','.join(headers) + "\n")
+
+            for i in range(len(sequence)):
+                currentSequence = sequence[i]
+                values = [
+                    BaseName(currentSequence.start, helixNums),
+                    BaseName(currentSequence.end, helixNums),
+                    currentSequence.sequence,
+                    str(currentSequence.length)] + [column[i] for _, column in columns]
+                if changed is not None:
+                    values.append("changed" if changed[i] else "unchanged")
+                outputFile.write(','.join(values) + "\n")
+
+
+def VisualizerRow(lookUpRow, rowLoops, loopRow, reverseLoops):
+    """
+    Returns a single row of the visualizer for one helix of a look up
+    table. Empty bases are shown as '-', loops as the first letter followed
+    by the rest of the loop between curly brackets. rowLoops maps indices to
+    loop sequences, reverseLoops inverts them for strands running backwards.
+    """
 
-    # Close file
-    outputFile.close()
+    row = np.where(lookUpRow == 0, ord('-'), lookUpRow).astype(
+        np.uint8).tobytes().decode()
 
+    # Check for loops, place sequence between curly brackets
+    loopIndices = np.flatnonzero((loopRow != 0) & (lookUpRow != 0))
+    if len(loopIndices) == 0:
+        return row
 
-def PrintVisualizer(numStrands, lengthStrands, lookUpScaffold, lookUpStaple, fileName, loop):
+    pieces = []
+    start = 0
+    for j in loopIndices.tolist():
+        loopSequence = rowLoops.get(j, row[j])
+        if reverseLoops:
+            loopSequence = loopSequence[::-1]
+        pieces.append(row[start:j])
+        pieces.append(loopSequence[0] + "{" + loopSequence[1:] + "}")
+        start = j + 1
+    pieces.append(row[start:])
+
+    return ''.join(pieces)
+
+
+def PrintVisualizer(numStrands, lengthStrands, lookUpScaffold, lookUpStaple, fileName, loop, scaffoldLoops, stapleLoops, helixNums=None, compress=False, changedRows=None):
     """
     Print visual representation of the sequences in cadnano style format.
+    The output is streamed, only the rows of a single helix are held in
+    memory at a time. If changedRows is given, the rows of every helix are
+    marked as changed or unchanged.
     """
 
-    print("Outputting data to " + fileName + "...")
-    outputFile = open(fileName, 'w')
-
-    for i in range(numStrands):
-        # Even strands
-        if i % 2 == 0:
-            outputFile.write("Scaffold " + "{:<5}".format(str(i)) + "|")
-            for j in range(lengthStrands):
-                if lookUpScaffold[i][j] == '':
-                    outputFile.write("-")
-                else:
-                    # Check for loop, place sequence between curly brackets
-                    if loop[i][j] == 0:
-                        outputFile.write(lookUpScaffold[i][j])
-                    else:
-                        outputFile.write(lookUpScaffold[i][j][0])
-                        outputFile.write("{")
-                        outputFile.write(lookUpScaffold[i][j][1:])
-                        outputFile.write("}")
-
-            outputFile.write("|\n")
-            outputFile.write("Staple " + "{:<7}".format(str(i)) + "|")
-
-            for j in range(lengthStrands):
-                if lookUpStaple[i][j] == '':
-                    outputFile.write("-")
-                else:
-                    # Check for loop, invert loop sequence if found
-                    if loop[i][j] == 0:
-                        outputFile.write(lookUpStaple[i][j])
-                    else:
-                        reverseLoop = lookUpStaple[i][j][::-1]
-
-                        outputFile.write(reverseLoop[0])
-                        outputFile.write("{")
-                        outputFile.write(reverseLoop[1:])
-                        outputFile.write("}")
-
-            outputFile.write("|\n\n")
-        # Odd strands
-        else:
-            outputFile.write("Staple " + "{:<7}".format(str(i)) + "|")
+    logger.info("Outputting data to " + fileName + "...")
 
-            for j in range(lengthStrands):
-                if lookUpStaple[i][j] == '':
-                    outputFile.write("-")
-                else:
-                    # Check for loop, place sequence between curly brackets
-                    if loop[i][j] == 0:
-                        outputFile.write(lookUpStaple[i][j])
-                    else:
-                        outputFile.write(lookUpStaple[i][j][0])
-                        outputFile.write("{")
-                        outputFile.write(lookUpStaple[i][j][1:])
-                        outputFile.write("}")
+    if helixNums is None:
+        helixNums = range(numStrands)
 
-            outputFile.write("|\n")
-            outputFile.write("Scaffold " + "{:<5}".format(str(i)) + "|")
+    # Loop sequences per helix, keyed by index
+    scaffoldRowLoops = [{} for i in range(numStrands)]
+    for (i, j), loopSequence in scaffoldLoops.items():
+        scaffoldRowLoops[i][j] = loopSequence
+    stapleRowLoops = [{} for i in range(numStrands)]
+    for (i, j), loopSequence in stapleLoops.items():
+        stapleRowLoops[i][j] = loopSequence
 
-            for j in range(lengthStrands):
-                if lookUpScaffold[i][j] == '':
-                    outputFile.write("-")
-                else:
-                    # Check for loop, invert loop sequence if found
-                    if loop[i][j] == 0:
-                        outputFile.write(lookUpScaffold[i][j])
-                    else:
-                        reverseLoop = lookUpScaffold[i][j][::-1]
-                        outputFile.write(reverseLoop[0])
-                        outputFile.write("{")
-                        outputFile.write(reverseLoop[1:])
-                        outputFile.write("}")
+    with OpenOutputFile(fileName, compress) as outputFile:
+        for i in range(numStrands):
+            num = helixNums[i]
 
-            outputFile.write("|\n\n")
+            # Even strands run forward along the scaffold
+            isEven = num % 2 == 0
 
-    outputFile.close()
+            status = ""
+            if changedRows is not None:
+                status = " changed" if changedRows[i] else " unchanged"
 
+            scaffoldLine = "Scaffold " + "{:<5}".format(str(num)) + "|" + VisualizerRow(
+                lookUpScaffold[i], scaffoldRowLoops[i], loop[i], not isEven) + "|" + status + "\n"
+            stapleLine = "Staple " + "{:<7}".format(str(num)) + "|" + VisualizerRow(
+                lookUpStaple[i], stapleRowLoops[i], loop[i], isEven) + "|" + status + "\n"
 
-def OutputFiles(scaffoldSequence, stapleSequence, numStrands, lengthStrands, lookUpScaffold, lookUpStaple, fileName, loop):
+            if isEven:
+                outputFile.write(scaffoldLine + stapleLine + "\n")
+            else:
+                outputFile.write(stapleLine + scaffoldLine + "\n")
+
+
+def OutputFiles(scaffoldSequence, stapleSequence, numStrands, lengthStrands, lookUpScaffold, lookUpStaple, fileName, loop, scaffoldLoops, stapleLoops, helixNums=None, compress=False, concurrent=False, directoryName=None, changedStaples=None, changedRows=None, stapleColumns=None, dimerRows=None):
     """
-    Output files to folder with same name of input json file.
+    Output files to folder with same name of input json file, or to
+    directoryName if given. dimerRows, if given, are written to a fourth
+    file, see DimerRows.
+    If concurrent is set, the three files are written in parallel threads.
+    changedStaples and changedRows mark staples and visualizer rows as
+    changed or unchanged, stapleColumns are added to the staple file.
+    Returns the paths of the written files.
     """
 
-    directoryName = fileName
+    if directoryName is None:
+        directoryName = fileName
     scaffoldsFileName = "scaffolds_" + fileName + ".txt"
     staplesFileName = "staples_" + fileName + ".txt"
     visualizerFileName = "visualized_sequence_" + fileName + ".txt"
+    dimersFileName = "dimers_" + fileName + ".txt"
 
     # Sort scaffolds from longest to shortest for printing
     scaffoldSequence.sort(key = len, reverse=True)
 
     os.makedirs(directoryName, exist_ok=True)
 
-    # Print scaffold file
-    PrintSequence(scaffoldSequence, os.path.join(
-        directoryName, scaffoldsFileName))
+    outputs = [
+        # Print scaffold file
+        (PrintSequence, scaffoldSequence, os.path.join(
+            directoryName, scaffoldsFileName), 1, helixNums, compress),
+
+        # Print staple file
+        (PrintSequence, stapleSequence, os.path.join(
+            directoryName, staplesFileName), 1, helixNums, compress, changedStaples, stapleColumns),
+
+        # Print visualizer file
+        (PrintVisualizer, numStrands, lengthStrands, lookUpScaffold, lookUpStaple,
+         os.path.join(directoryName, visualizerFileName), loop, scaffoldLoops, stapleLoops, helixNums, compress,
+         changedRows)]
+    fileNames = [scaffoldsFileName, staplesFileName, visualizerFileName]
+
+    # Print staple pair file
+    if dimerRows is not None:
+        outputs.append((PrintDimers, dimerRows, os.path.join(directoryName, dimersFileName), compress))
+        fileNames.append(dimersFileName)
+
+    if concurrent:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=len(outputs)) as executor:
+            futures = [executor.submit(*output) for output in outputs]
+            for future in futures:
+                future.result()
+    else:
+        for output in outputs:
+            output[0](*output[1:])
 
-    # Print staple file
-    PrintSequence(stapleSequence, os.path.join(directoryName, staplesFileName))
+    paths = [os.path.join(directoryName, name) for name in fileNames]
+    if compress:
+        paths = [path + ".gz" for path in paths]
 
-    # Print visualizer file
-    PrintVisualizer(numStrands, lengthStrands, lookUpScaffold,
-                    lookUpStaple, os.path.join(directoryName, visualizerFileName), loop)
+    return paths
 
 
-def main():
+class DesignResult:
     """
-    Main program loop
+    Sequenced design as returned by design. scaffolds and staples are lists
+    of Strand, scaffolds sorted from longest to shortest, warnings the
+    staple warnings of VerifyStaples. Base locations are helix rows,
+    helixNums translates them to helix numbers. topology is the Topology
+    the design was sequenced from. changedStaples and changedRows, if set,
+    mark every staple and helix row as changed compared to a previous run.
+    profiler holds the stage timings and counters of the run, writing the
+    files is added to it. quality is the QualityReport the warnings were
+    made from. stapleTm and domainTm are the melting temperatures of every
+    staple and of its domains for conditions, see FindStapleTm. offTargets, if set, holds
+    the number of other places every domain binds the scaffolds, see
+    FindOffTargets. dimers, if set, is the DimerReport of the staple pairs
+    that can bind each other, see FindStapleDimers.
     """
 
-    # Set random seed
-    random.seed(0)
-
-    # Load json data
-    numStrands, lengthStrands, scaffolds, staples, fileName, skip, loop = ParseJson()
+    def __init__(self, name, numStrands, lengthStrands, helixNums, loop, scaffolds, staples,
+                 lookUpScaffold, lookUpStaple, scaffoldLoops, stapleLoops, warnings,
+                 topology=None, changedStaples=None, changedRows=None, profiler=None, quality=None,
+                 stapleTm=None, domainTm=None, offTargets=None, dimers=None, conditions=None):
+        self.name = name
+        self.numStrands = numStrands
+        self.lengthStrands = lengthStrands
+        self.helixNums = helixNums
+        self.loop = loop
+        self.scaffolds = scaffolds
+        self.staples = staples
+        self.lookUpScaffold = lookUpScaffold
+        self.lookUpStaple = lookUpStaple
+        self.scaffoldLoops = scaffoldLoops
+        self.stapleLoops = stapleLoops
+        self.warnings = warnings
+        self.topology = topology
+        self.changedStaples = changedStaples
+        self.changedRows = changedRows
+        if profiler is None:
+            from instrumentation import Profiler
+            profiler = Profiler()
+        self.profiler = profiler
+        self.quality = quality
+        self.stapleTm = stapleTm
+        self.domainTm = domainTm
+        self.offTargets = offTargets
+        self.dimers = dimers
+        self.conditions = conditions
+
+    def WriteFiles(self, fileName=None, compress=False, concurrent=False, directoryName=None):
+        """
+        Writes the scaffold, staple and visualizer files to a folder named
+        fileName, the name of the design by default, or to directoryName.
+        The staple file gets Tm columns if the melting temperatures are set
+        and an Off-target column if the off-target places are set. The
+        staple pairs are written to a dimers file if they are set.
+        Returns the paths of the written files.
+        """
+
+        stapleColumns = []
+        if self.stapleTm is not None:
+            stapleColumns += TmColumns(self.stapleTm, self.domainTm)
+        if self.offTargets is not None:
+            stapleColumns.append(("Off-target", [' '.join(str(others) for others in domainOthers.tolist())
+                                                 for domainOthers in self.offTargets]))
+
+        dimerRows = None
+        if self.dimers is not None:
+            dimerRows = DimerRows(self.staples, self.dimers, self.helixNums)
+
+        with self.profiler.stage("OutputFiles"):
+            paths = OutputFiles(self.scaffolds, self.staples, self.numStrands, self.lengthStrands,
+                                self.lookUpScaffold, self.lookUpStaple, fileName or self.name, self.loop,
+                                self.scaffoldLoops, self.stapleLoops, self.helixNums, compress, concurrent,
+                                directoryName, self.changedStaples, self.changedRows, stapleColumns,
+                                dimerRows)
+
+        self.profiler.count("files_written", len(paths))
+        self.profiler.count("bytes_written", sum(os.path.getsize(path) for path in paths))
+
+        return paths
+
+    def Profile(self):
+        """
+        Returns the stage timings and counters of the run as dictionary,
+        see Profiler.report.
+        """
+
+        return self.profiler.report()
+
+
+def design(cadnano, scaffold_seq, rng=0, offset=0, cache=None, breakCircular=None, profiler=None, rules=None,
+           conditions=None, offTarget=None, dimers=None, workers=1):
+    """
+    Sequences a cadnano design in-process, without writing any files.
+    cadnano is the loaded json data, the path to a json file or a Topology,
+    scaffold_seq the sequence assigned to the longest scaffold, starting at
+    index offset. The other scaffolds get pseudorandom sequences drawn from
+    streams seeded by rng, a seed or a random.Random instance, a scaffold
+    gets the same sequence whatever the other scaffolds are. The parsed topology is looked up in
+    and stored to cache, a TopologyCache, if given. Circular scaffolds and
+    staples raise a CircularStrandError, unless breakCircular is given, the
+    position after the lowest base of a ring to break it at. Stages are
+    timed and counted by profiler, a new Profiler if not given. Staples
+    are checked with the staple quality rules, see VerifyStaples. Melting
+    temperatures are computed for the salt and strand concentrations in
+    conditions, see FindStapleTm. If offTarget, a k-mer length, is given,
+    the other scaffolds avoid the k-mers of scaffold_seq and every staple
+    domain binding the scaffolds at other places is reported, see
+    FindOffTargets. The scaffold index is cached in cache as well. If
+    dimers, settings overriding cross_hybridization.DEFAULT_SETTINGS, is
+    given, all pairs of staples are screened for cross-hybridization, see
+    FindStapleDimers. With more than one of workers, the other scaffolds
+    are generated and staples sequenced and screened in worker processes.
+    Returns a DesignResult, raises a SequenceDesignerError subclass if the
+    design can't be sequenced.
+    """
 
-    # Initialize look up table for scaffold
-    lookUpScaffold = CreateLookUpTable(numStrands, lengthStrands)
-    lookUpStaple = CreateLookUpTable(numStrands, lengthStrands)
+    rng = run_seed(rng)
 
-    # Load raw scaffold sequence
-    rawScaffoldSequence = RawScaffoldSequence()
+    if profiler is None:
+        from instrumentation import Profiler
+        profiler = Profiler()
 
-    # Find staples
-    stapleStartBases = FindStartStaples(
-        staples, numStrands, lengthStrands)
+    # Load json data and find staples and scaffolds
+    with profiler.stage("FindTopology"):
+        topology = FindTopology(cadnano, cache, breakCircular, profiler)
+    numStrands = topology.numStrands
+    lengthStrands = topology.lengthStrands
+    helixNums = topology.helixNums
+    loop = topology.loop
 
-    # Find scaffolds
-    scaffoldStartBase = FindStartScaffolds(
-        scaffolds, numStrands, lengthStrands, lookUpScaffold)
+    # Initialize look up table for scaffold
+    lookUpScaffold, scaffoldLoops = CreateLookUpTable(
+        numStrands, lengthStrands)
+    lookUpStaple, stapleLoops = CreateLookUpTable(numStrands, lengthStrands)
+
+    # k-mer index of the circular scaffold sequence
+    primaryIndex = None
+    if offTarget is not None:
+        from kmer_index import scaffold_index
+        with profiler.stage("KmerIndex"):
+            try:
+                primaryIndex = scaffold_index(scaffold_seq, offTarget, cache=cache)
+            except ValueError as error:
+                raise InputError(str(error)) from error
 
     # Returns scaffolds sequence
-    scaffoldSequence = FindScaffoldSequences(
-        scaffolds, scaffoldStartBase, rawScaffoldSequence, lookUpScaffold, skip, loop)
+    with profiler.stage("FindScaffoldSequences"):
+        scaffoldSequence = FindScaffoldSequences(
+            topology.scaffoldBases, topology.scaffoldOffsets, scaffold_seq, lookUpScaffold, topology.skip,
+            scaffoldLoops, rng, offset, primaryIndex, workers)
+    scaffoldStrands = list(scaffoldSequence)
 
-    # Returns staple sequences
-    stapleSequence = FindStapleSequences(
-        staples, stapleStartBases, lookUpScaffold, lookUpStaple)
-
-    # Verifying staples
-    VerifyStaples(stapleSequence)
+    # All scaffolds but the longest get a sequence_creator sequence
+    scaffoldLengths = FindLength(topology.scaffoldOffsets)
+    profiler.count("generated_scaffolds", len(scaffoldLengths) - 1)
+    profiler.count("generated_letters", sum(scaffoldLengths) - max(scaffoldLengths))
 
-    # IO
-    OutputFiles(scaffoldSequence, stapleSequence, numStrands,
-                lengthStrands, lookUpScaffold, lookUpStaple, fileName, loop)
+    # Sort scaffolds from longest to shortest
+    scaffoldSequence.sort(key=len, reverse=True)
 
-    print("Done!")
+    # Returns staple sequences
+    with profiler.stage("FindStapleSequences"):
+        stapleSequence = FindStapleSequences(
+            topology.staples, topology.stapleBases, lookUpScaffold, lookUpStaple, scaffoldLoops, stapleLoops,
+            workers)
 
+    # Verifying staples
+    with profiler.stage("VerifyStaples"):
+        quality = VerifyReport(stapleSequence, rules)
+        warnings = ReportWarnings(quality, stapleSequence, helixNums)
+
+    # Melting temperatures of staples and domains
+    with profiler.stage("FindStapleTm"):
+        stapleTm, domainTm = FindStapleTm(stapleSequence, conditions)
+
+    # Staple domains binding the scaffolds at other places
+    offTargets = None
+    if primaryIndex is not None:
+        with profiler.stage("FindOffTargets"):
+            offTargets, domainBases = FindOffTargets(
+                stapleSequence, scaffoldStrands, topology.scaffoldBases, topology.scaffoldOffsets,
+                numStrands, lengthStrands, primaryIndex, offset)
+            warnings += OffTargetWarnings(stapleSequence, offTargets, domainBases, helixNums)
+
+    # Staple pairs binding each other
+    dimerReport = None
+    if dimers is not None:
+        with profiler.stage("FindStapleDimers"):
+            dimerReport = FindStapleDimers(stapleSequence, dimers, workers)
+            warnings += DimerWarnings(DimerRows(stapleSequence, dimerReport, helixNums))
+        profiler.count("dimer_candidates", dimerReport.candidates)
+
+    profiler.count("scaffolds_emitted", len(scaffoldSequence))
+    profiler.count("staples_emitted", len(stapleSequence))
+    profiler.count("warnings", len(warnings))
+
+    return DesignResult(topology.name, numStrands, lengthStrands, helixNums, loop, scaffoldSequence,
+                        stapleSequence, lookUpScaffold, lookUpStaple, scaffoldLoops, stapleLoops, warnings,
+                        topology, profiler=profiler, quality=quality, stapleTm=stapleTm, domainTm=domainTm,
+                        offTargets=offTargets, dimers=dimerReport, conditions=conditions)
+
+
+def main(argv=None):
+    """
+    Main program loop
+    """
 
-time_start = time.time()
-main()
-time_elapsed = (time.time() - time_start)
-print("Time elapsed: " + str(time_elapsed) + " seconds")
+    from kmer_index import DEFAULT_K
+    from thermodynamics import DEFAULT_CONDITIONS
+    from instrumentation import Profiler
+
+    parser = argparse.ArgumentParser(
+        description="Sequence scaffold and staple strands of a cadnano design.")
+    parser.add_argument("json", help="cadnano .json file")
+    parser.add_argument("scaffold", help="scaffold sequence file")
+    parser.add_argument("--compress", action="store_true",
+                        help="write gzip compressed output files")
+    parser.add_argument("--concurrent", action="store_true",
+                        help="write the output files in parallel")
+    parser.add_argument("--offset", type=int, default=0,
+                        help="start index of the scaffold sequence (default: 0)")
+    parser.add_argument("--cache", metavar="DIRECTORY",
+                        help="cache parsed designs in this directory")
+    parser.add_argument("--break-circular", type=int, metavar="POSITION",
+                        help="break circular strands POSITION bases after their first base instead of stopping")
+    parser.add_argument("--check-all", action="store_true",
+                        help="check staples with every quality rule, not only their length and A runs")
+    parser.add_argument("--staple-length", type=int, nargs=2, metavar=("MIN", "MAX"),
+                        help="warn about staples shorter than MIN or longer than MAX bases (default: 15 60)")
+    parser.add_argument("--off-target", type=int, nargs="?", const=DEFAULT_K, metavar="K",
+                        help="report staple domains whose K-mers (default: %(const)s) bind the scaffolds at other "
+                             "places, other scaffolds avoid the K-mers of the scaffold sequence")
+    parser.add_argument("--dimers", type=int, nargs="?", const=True, metavar="SCORE",
+                        help="report staple pairs that can bind each other with an alignment score of at least "
+                             "SCORE (default: min_score of the screen settings) and write them to a dimers file")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes sequencing and screening staples (default: %(default)s)")
+    parser.add_argument("--sodium", type=float, default=DEFAULT_CONDITIONS['sodium'] * 1e3, metavar="MM",
+                        help="monovalent salt concentration in mM for melting temperatures (default: %(default)g)")
+    parser.add_argument("--magnesium", type=float, default=DEFAULT_CONDITIONS['magnesium'] * 1e3, metavar="MM",
+                        help="magnesium concentration in mM for melting temperatures (default: %(default)g)")
+    parser.add_argument("--staple-concentration", type=float,
+                        default=DEFAULT_CONDITIONS['strand_concentration'] * 1e9, metavar="NM",
+                        help="concentration of every staple in nM (default: %(default)g)")
+    parser.add_argument("--scaffold-concentration", type=float,
+                        default=DEFAULT_CONDITIONS['complement_concentration'] * 1e9, metavar="NM",
+                        help="scaffold concentration in nM (default: %(default)g)")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="write stage timings, memory and counters to FILE as json")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="measure peak memory of every stage with tracemalloc (slower)")
+    parser.add_argument("--cprofile", metavar="FILE",
+                        help="profile every stage with cProfile and write the statistics to FILE")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO,
+                        format="%(message)s", stream=sys.stdout)
+
+    try:
+        # Load raw scaffold sequence
+        rawScaffoldSequence = RawScaffoldSequence(args.scaffold)
+
+        cache = None
+        if args.cache is not None:
+            from topology_cache import TopologyCache
+            cache = TopologyCache(args.cache)
+
+        profiler = Profiler(trace_memory=args.trace_memory,
+                            cprofile=args.cprofile is not None)
+
+        # Staple quality rules
+        rules = dict(DEFAULT_RULES if args.check_all else VERIFY_RULES)
+        if args.staple_length is not None:
+            rules['length'] = {'min_length': args.staple_length[0],
+                               'max_length': args.staple_length[1]}
+
+        # Melting temperature conditions in mol/L
+        conditions = {
+            'sodium': args.sodium * 1e-3,
+            'magnesium': args.magnesium * 1e-3,
+            'strand_concentration': args.staple_concentration * 1e-9,
+            'complement_concentration': args.scaffold_concentration * 1e-9,
+        }
+
+        result = design(args.json, rawScaffoldSequence,
+                        rng=0, offset=args.offset, cache=cache, breakCircular=args.break_circular,
+                        profiler=profiler, rules=rules, conditions=conditions,
+                        offTarget=args.off_target,
+                        dimers=None if args.dimers is None else {} if args.dimers is True else
+                        {'min_score': args.dimers},
+                        workers=args.workers)
+
+        # IO
+        result.WriteFiles(compress=args.compress, concurrent=args.concurrent)
+    except SequenceDesignerError as error:
+        sys.exit(str(error))
+
+    # Profiling output
+    if args.profile is not None:
+        with open(args.profile, 'w') as profileFile:
+            json.dump(result.Profile(), profileFile, indent=2)
+    if args.cprofile is not None:
+        profiler.dump_stats(args.cprofile)
+
+    logger.info("Done!")
+
+
+if __name__ == "__main__":
+    time_start = time.time()
+    main()
+    time_elapsed = (time.time() - time_start)
+    print("Time elapsed: " + str(time_elapsed) + " seconds")
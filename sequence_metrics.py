@@ -0,0 +1,191 @@
+import numpy as np
+
+
+BASES = "ACGT"
+
+# Code of every ASCII character, anything other than A, C, G or T
+# (i.e. X for skips) gets code 4
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate(BASES):
+    BASE_CODES[ord(base)] = code
+    BASE_CODES[ord(base.lower())] = code
+
+IS_GC = np.array([False, True, True, False, False])
+
+# Code of the complement of every base code, other letters stay 4
+COMPLEMENT_CODES = np.array([3, 2, 1, 0, 4], dtype=np.uint8)
+
+
+def encode_sequence(sequence):
+    """
+    Returns the uint8 base codes (A=0, C=1, G=2, T=3, other=4) of a sequence.
+    """
+
+    return BASE_CODES[np.frombuffer(sequence.encode('ascii'), dtype=np.uint8)]
+
+
+def pack_sequences(sequences):
+    """
+    Packs a list of sequences into one array of base codes.
+    Returns the codes, the start offset and the length of every sequence.
+    """
+
+    lengths = np.array([len(seq) for seq in sequences], dtype=np.int64)
+    starts = np.zeros(len(sequences), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+
+    codes = encode_sequence(''.join(sequences))
+
+    return codes, starts, lengths
+
+
+def find_runs(codes, starts):
+    """
+    Splits packed base codes into runs of the same base, runs never cross
+    the start of a sequence.
+    Returns start position, length, base code and sequence of every run.
+    """
+
+    new_run = np.ones(len(codes), dtype=bool)
+    new_run[1:] = codes[1:] != codes[:-1]
+    new_run[starts[starts < len(codes)]] = True
+
+    run_starts = np.flatnonzero(new_run)
+    run_lengths = np.diff(np.append(run_starts, len(codes)))
+    run_bases = codes[run_starts]
+    run_sequences = np.searchsorted(starts, run_starts, side='right') - 1
+
+    return run_starts, run_lengths, run_bases, run_sequences
+
+
+def kmer_hashes(codes, starts, lengths, k):
+    """
+    Returns the position, sequence, hash and reverse complement hash of
+    every k-mer of the packed sequences, k-mers containing other letters
+    than ACGT are left out. The hash is the k-mer in base 4.
+    """
+
+    ends = starts + lengths
+    sequence_of = np.repeat(np.arange(len(starts)), lengths)
+    positions = np.arange(len(codes))
+
+    # k-mers have to lie within their sequence and contain ACGT only
+    cum_invalid = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(codes == 4, out=cum_invalid[1:])
+    window_ends = positions + k
+    valid = window_ends <= ends[sequence_of]
+    valid[valid] = cum_invalid[window_ends[valid]] == cum_invalid[positions[valid]]
+    positions = positions[valid]
+
+    hashes = np.zeros(len(positions), dtype=np.int64)
+    complement_hashes = np.zeros(len(positions), dtype=np.int64)
+    for t in range(k):
+        letter = codes[positions + t].astype(np.int64)
+        hashes = hashes * 4 + letter
+        complement_hashes += COMPLEMENT_CODES[letter].astype(np.int64) << (2 * t)
+
+    return positions, sequence_of[positions], hashes, complement_hashes
+
+
+def window_gc(codes, starts, lengths, window):
+    """
+    Returns the lowest and highest GC fraction of all windows of given size
+    in every sequence. Sequences shorter than the window are taken as a
+    whole. Empty sequences get nan.
+    """
+
+    num_sequences = len(starts)
+    ends = starts + lengths
+
+    cum_gc = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(IS_GC[codes], out=cum_gc[1:])
+
+    # Window size of every sequence
+    windows = np.minimum(lengths, window)
+
+    # GC count of the window starting at every position
+    sequence_of = np.repeat(np.arange(num_sequences), lengths)
+    window_ends = np.arange(len(codes)) + windows[sequence_of]
+    valid = window_ends <= ends[sequence_of]
+    window_counts = cum_gc[np.minimum(window_ends, len(codes))] - \
+        cum_gc[:len(codes)]
+
+    min_gc = np.full(num_sequences, np.nan)
+    max_gc = np.full(num_sequences, np.nan)
+
+    non_empty = lengths > 0
+    if non_empty.any():
+        segments = starts[non_empty]
+        min_gc[non_empty] = np.minimum.reduceat(
+            np.where(valid, window_counts, np.iinfo(np.int64).max), segments)
+        max_gc[non_empty] = np.maximum.reduceat(
+            np.where(valid, window_counts, -1), segments)
+        min_gc[non_empty] /= windows[non_empty]
+        max_gc[non_empty] /= windows[non_empty]
+
+    return min_gc, max_gc
+
+
+def sequence_metrics(sequences, window=8):
+    """
+    Computes metrics for a sequence or a list of sequences in a single pass
+    over their base codes. Returns a dictionary of arrays with one entry
+    per sequence:\n
+    length - number of letters\n
+    gc_count - number of G's and C's\n
+    gc - GC fraction\n
+    max_runs - longest run of every base, shape (sequences, 4) in ACGT order\n
+    leading_base, leading_run - base code and length of the first run\n
+    trailing_base, trailing_run - base code and length of the last run\n
+    min_window_gc, max_window_gc - GC fraction extremes over sliding windows
+    """
+
+    if isinstance(sequences, str):
+        sequences = [sequences]
+
+    codes, starts, lengths = pack_sequences(sequences)
+    num_sequences = len(sequences)
+    non_empty = lengths > 0
+
+    # GC fraction
+    gc_count = np.zeros(num_sequences, dtype=np.int64)
+    if non_empty.any():
+        gc_count[non_empty] = np.add.reduceat(
+            IS_GC[codes].astype(np.int64), starts[non_empty])
+    gc = np.full(num_sequences, np.nan)
+    gc[non_empty] = gc_count[non_empty] / lengths[non_empty]
+
+    # Longest run of every base, runs of other letters end up in column 4
+    run_starts, run_lengths, run_bases, run_sequences = find_runs(
+        codes, starts)
+    max_runs = np.zeros((num_sequences, 5), dtype=np.int64)
+    np.maximum.at(max_runs, (run_sequences, run_bases), run_lengths)
+
+    # First and last run of every sequence
+    leading_base = np.full(num_sequences, 4, dtype=np.uint8)
+    leading_run = np.zeros(num_sequences, dtype=np.int64)
+    trailing_base = np.full(num_sequences, 4, dtype=np.uint8)
+    trailing_run = np.zeros(num_sequences, dtype=np.int64)
+
+    first = np.searchsorted(run_starts, starts[non_empty])
+    last = np.searchsorted(
+        run_starts, (starts + lengths)[non_empty] - 1, side='right') - 1
+    leading_base[non_empty] = run_bases[first]
+    leading_run[non_empty] = run_lengths[first]
+    trailing_base[non_empty] = run_bases[last]
+    trailing_run[non_empty] = (starts + lengths)[non_empty] - run_starts[last]
+
+    min_window_gc, max_window_gc = window_gc(codes, starts, lengths, window)
+
+    return {
+        'length': lengths,
+        'gc_count': gc_count,
+        'gc': gc,
+        'max_runs': max_runs[:, :4],
+        'leading_base': leading_base,
+        'leading_run': leading_run,
+        'trailing_base': trailing_base,
+        'trailing_run': trailing_run,
+        'min_window_gc': min_window_gc,
+        'max_window_gc': max_window_gc,
+    }
@@ -0,0 +1,302 @@
+import os
+import sys
+import copy
+import json
+import argparse
+import numpy as np
+import seq_designer
+from topology_cache import TopologyCache
+from sequence_metrics import BASE_CODES
+from thermodynamics import segment_thermodynamics, DEFAULT_CONDITIONS
+
+# Bounds and targets of the staples made by breaking, lengths in bases
+# without skips. A staple costs the square of its deviation from the
+# target length in units of length_scale plus the square of its Tm
+# deviation in units of tm_scale, and end_penalty for every end domain
+# shorter than min_end_domain. Breaks are at least min_crossover_distance
+# bases away from a crossover.
+DEFAULT_TARGETS = {
+    'min_length': 20,
+    'max_length': 60,
+    'target_length': 42,
+    'length_scale': 6.0,
+    'target_tm': 72.0,
+    'tm_scale': 5.0,
+    'min_end_domain': 7,
+    'end_penalty': 1.0,
+    'min_crossover_distance': 3,
+}
+
+
+def break_settings(targets=None):
+    """
+    Returns the targets of the breaks, targets overrides the defaults.
+    """
+
+    targets = dict(DEFAULT_TARGETS, **(targets or {}))
+
+    unknown = set(targets) - set(DEFAULT_TARGETS)
+    if len(unknown) != 0:
+        raise ValueError("Unknown break targets: " + ", ".join(sorted(unknown)))
+    if not 0 < targets['min_length'] <= targets['max_length']:
+        raise ValueError("Staple lengths have to satisfy 0 < min_length <= max_length")
+
+    return targets
+
+
+def find_breaks(staples, targets=None, conditions=None, selected=None, block_entries=1 << 20):
+    """
+    Chooses the breaks of every selected staple, a list of Strand, all
+    staples longer than max_length by default. A break is allowed between
+    two bases of a domain, a stretch of bases on a single helix, at least
+    min_crossover_distance bases from its ends, and not next to a skip.
+    The breaks of all staples are found by a single dynamic program over
+    the allowed breaks in path order: the best cost of the staples up to a
+    break is the lowest best cost of an earlier break plus the cost of the
+    staple between them, see DEFAULT_TARGETS. Staples longer than
+    max_length are never made, so only breaks at most max_length bases
+    back are looked at and the time grows linearly with the path length.
+    Costs are computed for blocks of block_entries staples at once.
+    Melting temperatures are computed for conditions, see
+    thermodynamics.DEFAULT_CONDITIONS.
+    Returns a list with the bases of every staple that start a new staple,
+    empty for staples that aren't broken, and the selected staples that
+    can't be broken within the targets.
+    """
+
+    targets = break_settings(targets)
+    conditions = dict(DEFAULT_CONDITIONS, **(conditions or {}))
+
+    lengths = np.array([staple.length for staple in staples], dtype=np.int64)
+    if selected is None:
+        selected = np.flatnonzero(lengths > targets['max_length'])
+    selected = np.asarray(selected, dtype=np.int64)
+
+    breaks = [[] for _ in staples]
+    if len(selected) == 0:
+        return breaks, []
+
+    # Bases of the selected staples in path order
+    helices = np.concatenate([staples[i].helices for i in selected]).astype(np.int64)
+    indices = np.concatenate([staples[i].indices for i in selected]).astype(np.int64)
+    baseCounts = np.array([len(staples[i]) for i in selected], dtype=np.int64)
+    letters = b''.join(staples[i].letters for i in selected)
+    codes = BASE_CODES[np.frombuffer(letters, dtype=np.uint8)]
+
+    # Letters of every base, a skip has an 'X' but no base
+    letterCounts = np.concatenate([np.diff(staples[i].offsets) for i in selected])
+    letterStarts = np.zeros(len(letterCounts) + 1, dtype=np.int64)
+    np.cumsum(letterCounts, out=letterStarts[1:])
+    skipped = codes[letterStarts[:-1]] == 4
+    baseLengths = np.where(skipped, 0, letterCounts)
+    cumLength = np.zeros(len(baseLengths) + 1, dtype=np.int64)
+    np.cumsum(baseLengths, out=cumLength[1:])
+
+    pathStarts = np.zeros(len(selected) + 1, dtype=np.int64)
+    np.cumsum(baseCounts, out=pathStarts[1:])
+    numBases = int(pathStarts[-1])
+
+    # Domains: bases follow each other on the same helix
+    newDomain = np.ones(numBases, dtype=bool)
+    newDomain[1:] = (helices[1:] != helices[:-1]) | (np.abs(indices[1:] - indices[:-1]) != 1)
+    newDomain[pathStarts[:-1]] = True
+    domainStarts = np.flatnonzero(newDomain)
+    domainEnds = np.append(domainStarts[1:], numBases)
+    domainOf = np.cumsum(newDomain) - 1
+    bases = np.arange(numBases)
+
+    # Breaks before base b, away from crossovers and skips
+    allowed = ~newDomain & \
+        (bases - domainStarts[domainOf] >= targets['min_crossover_distance']) & \
+        (domainEnds[domainOf] - bases >= targets['min_crossover_distance'])
+    allowed[1:] &= ~skipped[1:] & ~skipped[:-1]
+
+    # Nodes of the dynamic program, the boundaries before a base: the
+    # start of every path, the allowed breaks and the end of every path
+    breakBases = np.flatnonzero(allowed)
+    paths = np.arange(len(selected))
+    nodeBases = np.concatenate([pathStarts[:-1], breakBases, pathStarts[1:]])
+    nodePath = np.concatenate([paths, np.searchsorted(pathStarts, breakBases, side='right') - 1, paths])
+    kind = np.repeat([0, 1, 2], [len(paths), len(breakBases), len(paths)])
+    order = np.lexsort((kind, nodeBases, nodePath))
+    nodeBases = nodeBases[order]
+    nodePath = nodePath[order]
+    isStart = kind[order] == 0
+    isEnd = kind[order] == 2
+
+    # Letters up to every node, and up to the end of the first domain
+    # after and the start of the last domain before it
+    nodeLength = cumLength[nodeBases]
+    firstDomain = cumLength[domainEnds[domainOf[np.minimum(nodeBases, numBases - 1)]]]
+    lastDomain = cumLength[domainStarts[domainOf[np.maximum(nodeBases - 1, 0)]]]
+
+    # Earlier nodes of the same path at most max_length letters back
+    pathFirstNode = np.searchsorted(nodePath, nodePath, side='left')
+    lowest = np.maximum(np.searchsorted(nodeLength, nodeLength - targets['max_length'], side='left'),
+                        pathFirstNode)
+    window = int(max((np.arange(len(nodeBases)) - lowest).max(), 1))
+
+    # Best cost up to every node, after window unreachable ones, and the
+    # node before it
+    numNodes = len(nodeBases)
+    best = np.full(window + numNodes, np.inf)
+    best[window:][isStart] = 0
+    previous = np.full(numNodes, -1, dtype=np.int64)
+
+    # Nodes are solved in blocks, the costs of a block are computed at once
+    block = max(1, block_entries // window)
+    for first in range(0, numNodes, block):
+        last = min(first + block, numNodes)
+
+        # Cost of the staple from node q = p - window + t to every node p
+        p = np.repeat(np.arange(first, last), window)
+        q = p - window + np.tile(np.arange(window), last - first)
+        valid = (q >= lowest[p]) & ~isStart[p]
+        q = np.where(valid, q, p)
+        valid &= ~isEnd[q]
+        length = nodeLength[p] - nodeLength[q]
+        valid &= (length >= targets['min_length']) & (length <= targets['max_length'])
+
+        # Only the letters of the block are passed on
+        low = letterStarts[nodeBases[max(first - window, 0)]]
+        high = letterStarts[nodeBases[last - 1]]
+        tm = segment_thermodynamics(codes[low:high], letterStarts[nodeBases[q]] - low,
+                                    letterStarts[nodeBases[p]] - low, **conditions)['tm']
+        cost = ((length - targets['target_length']) / targets['length_scale']) ** 2 + \
+            ((np.nan_to_num(tm, nan=0.0) - targets['target_tm']) / targets['tm_scale']) ** 2
+        weakStart = np.minimum(firstDomain[q], nodeLength[p]) - nodeLength[q] < targets['min_end_domain']
+        weakEnd = nodeLength[p] - np.maximum(lastDomain[p], nodeLength[q]) < targets['min_end_domain']
+        cost += targets['end_penalty'] * (weakStart.astype(np.int64) + weakEnd)
+        cost = np.where(valid, cost, np.inf).reshape(last - first, window)
+
+        for node in range(first, last):
+            if isStart[node]:
+                continue
+            candidates = best[node:node + window] + cost[node - first]
+            t = int(np.argmin(candidates))
+            if candidates[t] < np.inf:
+                best[node + window] = candidates[t]
+                previous[node] = node - window + t
+
+    # Follow the best staples back from every path end
+    failed = []
+    for end in np.flatnonzero(isEnd).tolist():
+        staple = int(selected[nodePath[end]])
+        if previous[end] < 0:
+            failed.append(staple)
+            continue
+        node = int(previous[end])
+        while not isStart[node]:
+            breaks[staple].append(int(nodeBases[node] - pathStarts[nodePath[end]]))
+            node = int(previous[node])
+        breaks[staple].reverse()
+
+    return breaks, failed
+
+
+def break_design(cadnano, staples, breaks, helixNums):
+    """
+    Returns a copy of the loaded cadnano json data with the staples broken
+    before the bases in breaks, see find_breaks. Staple bases are helix
+    rows, helixNums translates them to helix numbers.
+    """
+
+    cadnano = copy.deepcopy(cadnano)
+    helixStrands = {strand['num']: strand for strand in cadnano['vstrands']}
+
+    for staple, bases in zip(staples, breaks):
+        for k in bases:
+            # The base before the break loses its next base, the base
+            # after it its previous base
+            before = helixStrands[int(helixNums[staple.helices[k - 1]])]['stap'][int(staple.indices[k - 1])]
+            after = helixStrands[int(helixNums[staple.helices[k]])]['stap'][int(staple.indices[k])]
+            before[2:4] = [-1, -1]
+            after[0:2] = [-1, -1]
+
+    return cadnano
+
+
+def auto_break(json_file, scaffold_seq, output_directory=None, targets=None, conditions=None, offset=0,
+               rng=0, cache=None):
+    """
+    Breaks the long staples of a cadnano design, see find_breaks, writes
+    the broken design as <name>_autobreak.json together with its sequence
+    files to output_directory, <name>_autobreak by default, and returns
+    the DesignResult of the broken design, the breaks and the staples that
+    couldn't be broken.
+    """
+
+    with open(json_file, 'r') as json_data:
+        cadnano = json.load(json_data)
+
+    name = seq_designer.DesignName(json_file) + "_autobreak"
+    if output_directory is None:
+        output_directory = name
+
+    result = seq_designer.design(cadnano, scaffold_seq, rng=rng, offset=offset, cache=cache,
+                                 conditions=conditions)
+    try:
+        breaks, failed = find_breaks(result.staples, targets, conditions)
+    except ValueError as error:
+        raise seq_designer.InputError(str(error)) from error
+
+    broken = break_design(cadnano, result.staples, breaks, result.helixNums)
+    broken['name'] = name + ".json"
+
+    brokenResult = seq_designer.design(broken, scaffold_seq, rng=rng, offset=offset, cache=cache,
+                                       conditions=conditions)
+
+    os.makedirs(output_directory, exist_ok=True)
+    with open(os.path.join(output_directory, name + ".json"), 'w') as json_data:
+        json.dump(broken, json_data)
+    brokenResult.WriteFiles(name, directoryName=output_directory)
+
+    return brokenResult, breaks, failed
+
+
+def main(argv=None):
+    """
+    Command line interface of the staple breaker
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Break the long staples of a cadnano design and sequence the result.")
+    parser.add_argument("json", help="cadnano .json file")
+    parser.add_argument("scaffold", help="scaffold sequence file")
+    parser.add_argument("--output", metavar="DIRECTORY",
+                        help="output directory (default: <name>_autobreak)")
+    parser.add_argument("--offset", type=int, default=0,
+                        help="start index of the scaffold sequence (default: 0)")
+    parser.add_argument("--length", type=int, nargs=2, metavar=("MIN", "MAX"),
+                        default=[DEFAULT_TARGETS['min_length'], DEFAULT_TARGETS['max_length']],
+                        help="shortest and longest staple to make (default: %(default)s)")
+    parser.add_argument("--target-length", type=int, default=DEFAULT_TARGETS['target_length'],
+                        help="staple length to aim for (default: %(default)s)")
+    parser.add_argument("--target-tm", type=float, default=DEFAULT_TARGETS['target_tm'],
+                        help="staple melting temperature to aim for (default: %(default)s)")
+    parser.add_argument("--cache", metavar="DIRECTORY",
+                        help="cache parsed designs in this directory")
+    args = parser.parse_args(argv)
+
+    targets = {
+        'min_length': args.length[0],
+        'max_length': args.length[1],
+        'target_length': args.target_length,
+        'target_tm': args.target_tm,
+    }
+
+    try:
+        rawScaffoldSequence = seq_designer.RawScaffoldSequence(args.scaffold)
+        cache = None if args.cache is None else TopologyCache(args.cache)
+        result, breaks, failed = auto_break(args.json, rawScaffoldSequence, args.output, targets,
+                                            offset=args.offset, cache=cache)
+    except seq_designer.SequenceDesignerError as error:
+        sys.exit(str(error))
+
+    print("Breaks: " + str(sum(len(bases) for bases in breaks)) + ", staples: " + str(len(result.staples)))
+    for staple in failed:
+        print("Could not break staple " + str(staple))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+import numpy as np
+from sequence_metrics import BASES, IS_GC, pack_sequences, find_runs, window_gc, kmer_hashes
+
+
+# Longest allowed run of every base in ACGT order in a staple, A and T as
+# in the staple verification, G and C as in the scaffold generator
+MAX_RUNS = (6, 4, 4, 6)
+
+# Every rule with its default settings, in the order issues are reported
+DEFAULT_RULES = {
+    'length': {'min_length': 15, 'max_length': 60},
+    'edge_run': {'base': 'A', 'run': 7},
+    'gc': {'min_gc': 0.3, 'max_gc': 0.7},
+    'window_gc': {'window': 8, 'min_gc': 0.2, 'max_gc': 0.8},
+    'homopolymer': {'max_runs': MAX_RUNS},
+    'quadruplex': {'min_run': 3, 'max_loop': 7},
+    'three_prime_end': {'length': 5, 'min_gc': 1, 'max_gc': 3},
+    'hairpin': {'stem': 6, 'min_loop': 3},
+    'self_complementary': {'length': 8},
+}
+
+# Rules of the original staple verification
+VERIFY_RULES = {
+    'length': {},
+    'edge_run': {},
+}
+
+
+def rule_settings(rules=None):
+    """
+    Returns the settings of every rule to run. rules maps rule names to
+    settings that override the defaults, only the rules named in it are
+    run. All rules with default settings are run if rules is None.
+    """
+
+    if rules is None:
+        rules = {name: {} for name in DEFAULT_RULES}
+
+    settings = {}
+    for name in DEFAULT_RULES:
+        if name in rules and rules[name] is not None:
+            settings[name] = dict(DEFAULT_RULES[name], **rules[name])
+
+    unknown = set(rules) - set(DEFAULT_RULES)
+    if len(unknown) != 0:
+        raise ValueError("Unknown staple rules: " + ", ".join(sorted(unknown)))
+
+    return settings
+
+
+def complementary_kmers(codes, starts, lengths, k):
+    """
+    Finds all pairs of k-mers within the same sequence that are reverse
+    complements of each other, including palindromic k-mers paired with
+    themselves. Returns the positions i and j of the first k-mer and its
+    complement, and the sequence of every pair, ordered by i.
+    """
+
+    positions, sequences, hashes, complement_hashes = kmer_hashes(
+        codes, starts, lengths, k)
+
+    # Join the complement of every k-mer with the k-mers of its sequence
+    keys = sequences * (1 << (2 * k)) + hashes
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    queries = sequences * (1 << (2 * k)) + complement_hashes
+    low = np.searchsorted(sorted_keys, queries, side='left')
+    counts = np.searchsorted(sorted_keys, queries, side='right') - low
+
+    first = np.repeat(np.arange(len(queries)), counts)
+    matches = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    second = order[np.repeat(low, counts) + matches]
+
+    return positions[first], positions[second], sequences[first]
+
+
+def first_per_sequence(sequences, *values):
+    """
+    Returns the sequences with an issue and the first of every value for
+    each of them. Issues have to be ordered by sequence.
+    """
+
+    flagged, first = np.unique(sequences, return_index=True)
+
+    return (flagged,) + tuple(value[first] for value in values)
+
+
+class QualityReport:
+    """
+    Issues found by check_staples, one entry per issue in the arrays
+    staple, rule, position and value. rule indexes rules, the names of the
+    rules that were run, settings holds their settings. position is the
+    letter of the staple the issue starts at, the last letter for runs at
+    the end of a staple and -1 for issues of the whole staple. value is
+    the measured quantity, i.e. the length, GC fraction, run or loop
+    length.
+    """
+
+    def __init__(self, num_staples, settings, staple, rule, position, value):
+        self.num_staples = num_staples
+        self.settings = settings
+        self.rules = list(settings)
+        self.staple = staple
+        self.rule = rule
+        self.position = position
+        self.value = value
+
+    def __len__(self):
+        """
+        Returns the number of issues.
+        """
+        return len(self.staple)
+
+    def flagged(self, rule=None):
+        """
+        Returns whether every staple has an issue, of rule only if given.
+        """
+
+        flagged = np.zeros(self.num_staples, dtype=bool)
+        if rule is None:
+            flagged[self.staple] = True
+        elif rule in self.rules:
+            flagged[self.staple[self.rule == self.rules.index(rule)]] = True
+
+        return flagged
+
+    def counts(self):
+        """
+        Returns the number of issues of every rule that was run.
+        """
+
+        counts = np.bincount(self.rule, minlength=len(self.rules))
+
+        return {name: int(count) for name, count in zip(self.rules, counts)}
+
+    def message(self, i):
+        """
+        Returns a description of issue i.
+        """
+
+        name = self.rules[self.rule[i]]
+        settings = self.settings[name]
+        position = int(self.position[i])
+        value = self.value[i]
+
+        if name == 'length':
+            if value > settings['max_length']:
+                return "has length " + str(int(value)) + " (>" + str(settings['max_length']) + ")"
+            return "has length " + str(int(value)) + " (<" + str(settings['min_length']) + ")"
+
+        if name == 'edge_run':
+            side = "start" if position == 0 else "end"
+            return ("has " + str(settings['run']) + " or more consecutive " + settings['base'] +
+                    "'s at the " + side)
+
+        if name == 'gc':
+            bound = "(>" + str(settings['max_gc']) + ")" if value > settings['max_gc'] else \
+                "(<" + str(settings['min_gc']) + ")"
+            return "has GC content " + "{:.2f}".format(value) + " " + bound
+
+        if name == 'window_gc':
+            bound = "(>" + str(settings['max_gc']) + ")" if value > settings['max_gc'] else \
+                "(<" + str(settings['min_gc']) + ")"
+            return ("has a window of " + str(settings['window']) + " bases with GC content " +
+                    "{:.2f}".format(value) + " " + bound)
+
+        if name == 'homopolymer':
+            return "has a run of " + str(int(value)) + " equal bases at position " + str(position)
+
+        if name == 'quadruplex':
+            return "has a G-quadruplex motif at position " + str(position)
+
+        if name == 'three_prime_end':
+            return ("has " + str(int(value)) + " G's or C's in its last " + str(settings['length']) +
+                    " bases")
+
+        if name == 'hairpin':
+            return ("can form a hairpin with a " + str(settings['stem']) + " base stem at position " +
+                    str(position) + " and a loop of " + str(int(value)) + " bases")
+
+        return ("has " + str(settings['length']) + " bases at position " + str(position) +
+                " complementary to itself")
+
+    def issues(self):
+        """
+        Returns every issue as dictionary with its staple, rule, position,
+        value and message.
+        """
+
+        return [{
+            'staple': int(self.staple[i]),
+            'rule': self.rules[self.rule[i]],
+            'position': int(self.position[i]),
+            'value': float(self.value[i]),
+            'message': self.message(i),
+        } for i in range(len(self))]
+
+
+def merge_reports(num_staples, reports, staples):
+    """
+    Returns the issues of several reports of the same rules as one
+    QualityReport of num_staples staples. staples holds for every report
+    the staple of the merged report of each of its staples, issues of
+    staples mapped to -1 are left out. Issues are ordered as check_staples
+    orders them.
+    """
+
+    settings = reports[0].settings
+    empty = [np.zeros(0, dtype=np.int64)]
+
+    staple = np.concatenate([np.asarray(mapping, dtype=np.int64)[report.staple]
+                             for report, mapping in zip(reports, staples)] + empty)
+    rule = np.concatenate([report.rule for report in reports] + empty)
+    position = np.concatenate([report.position for report in reports] + empty)
+    value = np.concatenate([report.value for report in reports] + [np.zeros(0)])
+
+    keep = staple != -1
+    order = np.lexsort((position[keep], staple[keep], rule[keep]))
+
+    return QualityReport(num_staples, settings, staple[keep][order], rule[keep][order],
+                         position[keep][order], value[keep][order])
+
+
+def check_staples(sequences, rules=None, lengths=None):
+    """
+    Checks all staple sequences at once against the rules, see
+    rule_settings and DEFAULT_RULES:\n
+    length - fewer than min_length or more than max_length bases\n
+    edge_run - run or more of base at the start or end\n
+    gc - GC fraction outside min_gc and max_gc\n
+    window_gc - GC fraction of a window outside min_gc and max_gc\n
+    homopolymer - run of a base longer than its max_runs in ACGT order\n
+    quadruplex - four runs of at least min_run G's, at most max_loop bases apart\n
+    three_prime_end - G's and C's in the last length bases outside min_gc and max_gc\n
+    hairpin - stem bases complementary to stem bases at least min_loop further\n
+    self_complementary - length bases complementary to any bases of the staple\n
+    lengths, the number of bases of every staple for the length rule,
+    default to the sequence lengths. Letters other than ACGT (i.e. X for
+    skips) break runs and k-mers. Returns a QualityReport.
+    """
+
+    if isinstance(sequences, str):
+        sequences = [sequences]
+
+    settings = rule_settings(rules)
+    codes, starts, sequence_lengths = pack_sequences(sequences)
+    if lengths is None:
+        lengths = sequence_lengths
+    lengths = np.asarray(lengths, dtype=np.int64)
+    ends = starts + sequence_lengths
+    non_empty = sequence_lengths > 0
+
+    # Issues of every rule, as (rule, staples, positions, values)
+    found = []
+
+    if 'edge_run' in settings or 'homopolymer' in settings or 'quadruplex' in settings:
+        run_starts, run_lengths, run_bases, run_sequences = find_runs(codes, starts)
+
+    if 'gc' in settings or 'three_prime_end' in settings:
+        cum_gc = np.zeros(len(codes) + 1, dtype=np.int64)
+        np.cumsum(IS_GC[codes], out=cum_gc[1:])
+
+    for rule_id, (name, rule) in enumerate(settings.items()):
+        if name == 'length':
+            staples = np.flatnonzero((lengths < rule['min_length']) | (lengths > rule['max_length']))
+            found.append((rule_id, staples, np.full(len(staples), -1), lengths[staples]))
+
+        elif name == 'edge_run':
+            base = BASES.index(rule['base'])
+            first = np.searchsorted(run_starts, starts[non_empty])
+            last = np.searchsorted(run_starts, ends[non_empty] - 1, side='right') - 1
+            staples = np.flatnonzero(non_empty)
+
+            leading = (run_bases[first] == base) & (run_lengths[first] >= rule['run'])
+            trailing = (run_bases[last] == base) & (ends[non_empty] - run_starts[last] >= rule['run'])
+            found.append((rule_id, staples[leading], np.zeros(leading.sum(), dtype=np.int64),
+                          run_lengths[first][leading]))
+            found.append((rule_id, staples[trailing], sequence_lengths[staples][trailing] - 1,
+                          (ends[non_empty] - run_starts[last])[trailing]))
+
+        elif name == 'gc':
+            staples = np.flatnonzero(non_empty)
+            gc = (cum_gc[ends[staples]] - cum_gc[starts[staples]]) / sequence_lengths[staples]
+            outside = (gc < rule['min_gc']) | (gc > rule['max_gc'])
+            found.append((rule_id, staples[outside], np.full(outside.sum(), -1), gc[outside]))
+
+        elif name == 'window_gc':
+            min_gc, max_gc = window_gc(codes, starts, sequence_lengths, rule['window'])
+            low = np.flatnonzero(min_gc < rule['min_gc'])
+            high = np.flatnonzero(max_gc > rule['max_gc'])
+            found.append((rule_id, low, np.full(len(low), -1), min_gc[low]))
+            found.append((rule_id, high, np.full(len(high), -1), max_gc[high]))
+
+        elif name == 'homopolymer':
+            max_runs = np.append(np.array(rule['max_runs'], dtype=np.int64), np.iinfo(np.int64).max)
+            long_runs = run_lengths > max_runs[run_bases]
+            found.append((rule_id,) + first_per_sequence(run_sequences[long_runs],
+                                            run_starts[long_runs] - starts[run_sequences[long_runs]],
+                                            run_lengths[long_runs]))
+
+        elif name == 'quadruplex':
+            # Chains of four G runs with short loops between them
+            g_runs = np.flatnonzero((run_bases == 2) & (run_lengths >= rule['min_run']))
+            loops = run_starts[g_runs[1:]] - (run_starts[g_runs[:-1]] + run_lengths[g_runs[:-1]])
+            linked = (run_sequences[g_runs[1:]] == run_sequences[g_runs[:-1]]) & \
+                (loops >= 1) & (loops <= rule['max_loop'])
+            motifs = g_runs[:-3][linked[:-2] & linked[1:-1] & linked[2:]] if len(linked) >= 3 else \
+                np.zeros(0, dtype=np.int64)
+            found.append((rule_id,) + first_per_sequence(run_sequences[motifs],
+                                            run_starts[motifs] - starts[run_sequences[motifs]],
+                                            run_lengths[motifs]))
+
+        elif name == 'three_prime_end':
+            staples = np.flatnonzero(non_empty)
+            end_starts = np.maximum(ends[staples] - rule['length'], starts[staples])
+            end_gc = cum_gc[ends[staples]] - cum_gc[end_starts]
+            outside = (end_gc < rule['min_gc']) | (end_gc > rule['max_gc'])
+            found.append((rule_id, staples[outside], (end_starts - starts[staples])[outside],
+                          end_gc[outside]))
+
+        elif name == 'hairpin':
+            i, j, staples = complementary_kmers(codes, starts, sequence_lengths, rule['stem'])
+            hairpins = j - (i + rule['stem']) >= rule['min_loop']
+            found.append((rule_id,) + first_per_sequence(staples[hairpins], i[hairpins] - starts[staples[hairpins]],
+                                            (j - (i + rule['stem']))[hairpins]))
+
+        elif name == 'self_complementary':
+            i, j, staples = complementary_kmers(codes, starts, sequence_lengths, rule['length'])
+            found.append((rule_id,) + first_per_sequence(staples, i - starts[staples], j - starts[staples]))
+
+    empty = [np.zeros(0, dtype=np.int64)]
+    rule = np.concatenate([np.full(len(issues[1]), issues[0], dtype=np.int64) for issues in found] + empty)
+    staple = np.concatenate([np.asarray(issues[1], dtype=np.int64) for issues in found] + empty)
+    position = np.concatenate([np.asarray(issues[2], dtype=np.int64) for issues in found] + empty)
+    value = np.concatenate([np.asarray(issues[3], dtype=np.float64) for issues in found] + empty)
+
+    # Ordered by rule, then staple, then position
+    order = np.lexsort((position, staple, rule))
+
+    return QualityReport(len(sequences), settings, staple[order], rule[order], position[order],
+                         value[order])
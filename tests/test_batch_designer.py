@@ -0,0 +1,39 @@
+import os
+import sys
+import shutil
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import seq_designer  # noqa: E402
+import batch_designer  # noqa: E402
+
+PACKAGE = os.path.join(os.path.dirname(__file__), os.pardir)
+
+
+def test_same_names_in_different_folders(tmp_path):
+    for folder, design in [("a", "small_onebreak.json"), ("b", "tube_onebreak.json")]:
+        os.makedirs(str(tmp_path / folder))
+        shutil.copy(os.path.join(PACKAGE, "json_files", design), str(tmp_path / folder / "design.json"))
+    scaffolds = [os.path.join(PACKAGE, "scaffold_files", name) for name in ["M13mp18", "P8634"]]
+
+    manifest = batch_designer.run_batch([str(tmp_path / "a" / "design.json"), str(tmp_path / "b" / "design.json")],
+                                        scaffolds, str(tmp_path / "output"), workers=2)
+
+    assert manifest['succeeded'] == 4
+    assert [os.path.relpath(job['output'], str(tmp_path / "output")) for job in manifest['jobs']] == [
+        os.path.join("a", "design_M13mp18"), os.path.join("a", "design_P8634"),
+        os.path.join("b", "design_M13mp18"), os.path.join("b", "design_P8634")]
+
+    # Later scaffolds of a design reuse its parsed topology
+    hits = [job['profile']['counters'].get('topology_cache_hits', 0) for job in manifest['jobs']]
+    assert hits == [0, 1, 0, 1]
+
+
+def test_duplicate_designs(tmp_path):
+    design = os.path.join(PACKAGE, "json_files", "small_onebreak.json")
+
+    with pytest.raises(seq_designer.InputError):
+        batch_designer.run_batch([design, design], [os.path.join(PACKAGE, "scaffold_files", "M13mp18")],
+                                 str(tmp_path))
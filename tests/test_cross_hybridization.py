@@ -0,0 +1,128 @@
+import os
+import sys
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import cross_hybridization  # noqa: E402
+
+COMPLEMENT = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+
+
+def reverse_complement(sequence):
+    return ''.join(COMPLEMENT.get(letter, 'X') for letter in reversed(sequence))
+
+
+def smith_waterman(first, second, diagonal, settings):
+    """
+    Best local alignment score of first with the reverse of second, over
+    the cells within band of diagonal, one cell at a time.
+    """
+
+    scores = {}
+    best = 0
+    for i in range(len(first)):
+        for j in range(len(second) - 1, -1, -1):
+            if abs(i + j - diagonal) > settings['band']:
+                continue
+            paired = first[i] in COMPLEMENT and COMPLEMENT[first[i]] == second[j]
+            score = max(0, scores.get((i - 1, j + 1), 0) + (settings['match'] if paired else settings['mismatch']),
+                        scores.get((i - 1, j), 0) + settings['gap'], scores.get((i, j + 1), 0) + settings['gap'])
+            scores[i, j] = score
+            best = max(best, score)
+
+    return best
+
+
+def brute_force_pairs(sequences, settings):
+    """
+    Best score of every pair of sequences over all diagonals of a shared
+    complementary k-mer without X, found by comparing every k-mer with
+    every other.
+    """
+
+    k = settings['k']
+    pairs = {}
+    for first in range(len(sequences)):
+        for second in range(first + 1, len(sequences)):
+            a, b = sequences[first], sequences[second]
+            diagonals = set(i + j + k - 1 for i in range(len(a) - k + 1) for j in range(len(b) - k + 1)
+                            if a[i:i + k] == reverse_complement(b[j:j + k]) and 'X' not in a[i:i + k])
+            if len(diagonals) != 0:
+                pairs[first, second] = max(smith_waterman(a, b, diagonal, settings) for diagonal in diagonals)
+
+    return pairs
+
+
+def random_staples(seed, count=30, letters="ACGT"):
+    """
+    Returns random staples, some holding the reverse complement of a part
+    of another one, with a mismatch or an extra letter.
+    """
+
+    rng = random.Random(seed)
+    staples = [''.join(rng.choice(letters) for _ in range(rng.randint(12, 40))) for _ in range(count)]
+    for _ in range(count // 2):
+        source, target = rng.randrange(count), rng.randrange(count)
+        part = reverse_complement(staples[source][:rng.randint(8, 16)])
+        if rng.random() < 0.5:
+            position = rng.randrange(1, len(part))
+            part = part[:position] + rng.choice("ACGT") + part[position + 1 - rng.randint(0, 1):]
+        start = rng.randrange(len(staples[target]))
+        staples[target] = staples[target][:start] + part + staples[target][start + len(part):]
+
+    return staples
+
+
+@pytest.mark.parametrize("seed, letters", [(0, "ACGT"), (1, "ACGT"), (2, "ACGTX")])
+def test_screen_equals_brute_force(seed, letters):
+    staples = random_staples(seed, letters=letters)
+    settings = cross_hybridization.screen_settings({'k': 6, 'min_score': 6})
+
+    expected = brute_force_pairs(staples, settings)
+    report = cross_hybridization.screen_staples(staples, settings)
+
+    found = {(pair['first'], pair['second']): pair['score'] for pair in report.pairs()}
+    assert found == {pair: score for pair, score in expected.items() if score >= settings['min_score']}
+    assert report.candidates >= len(expected)
+
+    # Ranked by score
+    assert list(report.score) == sorted(report.score, reverse=True)
+
+
+def test_scores_of_every_seed():
+    staples = random_staples(3)
+    settings = cross_hybridization.screen_settings({'k': 5})
+
+    first, second, diagonals = cross_hybridization.candidate_pairs(staples, settings['k'])
+    codes, starts, lengths = cross_hybridization.pack_sequences(staples)
+    scores = cross_hybridization.score_pairs(codes, starts, lengths, first, second, diagonals, settings)
+
+    assert len(first) != 0
+    for pair in range(len(first)):
+        assert scores[pair] == smith_waterman(staples[first[pair]], staples[second[pair]], diagonals[pair],
+                                              settings)
+
+
+def test_duplex_location():
+    staple = "TTTTACGGATCCAGTGCATTTT"
+    duplex = staple[4:18]
+    staples = [staple, "GGGG" + reverse_complement(duplex) + "GGG"]
+
+    pairs = cross_hybridization.screen_staples(staples).pairs()
+
+    assert pairs == [{'first': 0, 'second': 1, 'score': len(duplex),
+                      'first_letters': [4, 17], 'second_letters': [4 + len(duplex) - 1, 4]}]
+
+
+def test_workers_give_the_same_report(monkeypatch):
+    staples = random_staples(4, count=40)
+    settings = {'k': 6, 'min_score': 6}
+
+    serial = cross_hybridization.screen_staples(staples, settings)
+    monkeypatch.setattr(cross_hybridization, "CHUNK_PAIRS", 5)
+    parallel = cross_hybridization.screen_staples(staples, settings, workers=3)
+
+    assert parallel.pairs() == serial.pairs()
@@ -0,0 +1,138 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import seq_designer  # noqa: E402
+
+
+def strand_array(strands, numStrands=2, lengthStrands=8):
+    """
+    Returns scaffold/staple data holding the given strands, each a list of
+    (helix, index) bases from 5' to 3'.
+    """
+
+    strand = np.full((numStrands, lengthStrands, 4), -1, dtype=np.int32)
+    for bases in strands:
+        for previous, current in zip(bases, bases[1:]):
+            strand[previous][2:4] = current
+            strand[current][0:2] = previous
+
+    return strand
+
+
+def flat(bases, lengthStrands=8):
+    return [helix * lengthStrands + index for helix, index in bases]
+
+
+def test_find_strands():
+    first = [(0, 5), (0, 4), (0, 3), (1, 3), (1, 4)]
+    second = [(0, 0), (0, 1)]
+    strand = strand_array([first, second])
+
+    strandIds, strandBases, strandLengths, strandOffsets = seq_designer.FindStrands(strand, 2, 8)
+
+    # Strands are ordered by their 5' end
+    assert [bases.tolist() for bases in strandBases] == [flat(second), flat(first)]
+    assert strandLengths.tolist() == [2, 5]
+    assert strandIds[0, 1] == 0 and strandIds[1, 4] == 1 and strandIds[1, 7] == -1
+    assert strandOffsets[1].tolist() == [0, 1, 2, 3, 4, 5]
+
+
+def test_find_strands_offsets():
+    strand = strand_array([[(0, 2), (0, 3), (0, 4), (0, 5)]])
+    skip = np.zeros((2, 8), dtype=np.int32)
+    loop = np.zeros((2, 8), dtype=np.int32)
+    skip[0, 3] = -1
+    loop[0, 4] = 2
+
+    _, _, _, strandOffsets = seq_designer.FindStrands(strand, 2, 8, skip=skip, loop=loop)
+
+    assert strandOffsets[0].tolist() == [0, 1, 1, 4, 5]
+
+
+def test_find_start_wrappers():
+    staples = strand_array([[(1, 6), (1, 5)], [(0, 2), (0, 3)]])
+
+    startStaples = seq_designer.FindStartStaples(staples, 2, 8)
+    startScaffolds = seq_designer.FindStartScaffolds(staples, 2, 8)
+
+    for result in [startStaples, startScaffolds]:
+        assert [bases.tolist() for bases in result[1]] == [flat([(0, 2), (0, 3)]), flat([(1, 6), (1, 5)])]
+
+
+def test_inconsistent_pointers():
+    # Two 5' ends lead into the same base
+    strand = strand_array([[(0, 0), (0, 1), (0, 2)]])
+    strand[1, 0][2:4] = (0, 1)
+
+    with pytest.raises(seq_designer.TopologyError, match="a second time"):
+        seq_designer.FindStrands(strand, 2, 8)
+
+
+def ring(bases):
+    """
+    Returns scaffold/staple data holding one circular strand.
+    """
+
+    return strand_array([bases + bases[:1]])
+
+
+def test_circular_strand():
+    strand = strand_array([[(0, 0), (0, 1)]])
+    circular = ring([(1, 4), (1, 3), (1, 2)])
+    strand[1] = circular[1]
+
+    with pytest.raises(seq_designer.CircularStrandError) as error:
+        seq_designer.FindStrands(strand, 2, 8)
+
+    assert error.value.bases == [[1, 2]]
+
+
+def test_circular_strand_reported_with_type():
+    data = {'vstrands': []}
+    for num in range(2):
+        data['vstrands'].append({'num': num, 'scaf': [[-1, -1, -1, -1]] * 8, 'stap': [[-1, -1, -1, -1]] * 8,
+                                 'skip': [0] * 8, 'loop': [0] * 8})
+    for index in range(3):
+        data['vstrands'][0]['stap'][index] = [0, (index - 1) % 3, 0, (index + 1) % 3]
+
+    with pytest.raises(seq_designer.CircularStrandError) as error:
+        seq_designer.FindTopology(data)
+
+    assert error.value.strandTypes == ["staple"]
+
+
+def test_break_circular():
+    bases = [(1, 4), (1, 3), (1, 2), (0, 2), (0, 3)]
+    strand = ring(bases)
+
+    for position in [0, 2, 7]:
+        _, strandBases, _, _ = seq_designer.FindStrands(strand.copy(), 2, 8, breakCircular=position)
+
+        # The ring starts at its lowest base, (0, 2)
+        lowest = bases.index((0, 2))
+        expected = bases[lowest:] + bases[:lowest]
+        shift = position % len(bases)
+        assert [bases.tolist() for bases in strandBases] == [flat(expected[shift:] + expected[:shift])]
+
+
+def test_break_circular_in_design():
+    scaffold = seq_designer.RawScaffoldSequence(
+        os.path.join(os.path.dirname(__file__), os.pardir, "scaffold_files", "M13mp18"))
+    data = {'vstrands': [{'num': 0, 'scaf': [[-1, -1, -1, -1]] * 4, 'skip': [0] * 4, 'loop': [0] * 4,
+                          'stap': [[0, (index - 1) % 4, 0, (index + 1) % 4] for index in range(4)]}]}
+    data['vstrands'][0]['scaf'] = [[0, index + 1, 0, index - 1] if 0 < index < 3 else [-1, -1, -1, -1]
+                                   for index in range(4)]
+    data['vstrands'][0]['scaf'][0] = [0, 1, -1, -1]
+    data['vstrands'][0]['scaf'][3] = [-1, -1, 0, 2]
+
+    with pytest.raises(seq_designer.CircularStrandError):
+        seq_designer.design(data, scaffold)
+
+    result = seq_designer.design(data, scaffold, breakCircular=1)
+
+    assert [(staple.start, staple.end, staple.length) for staple in result.staples] == [([0, 1], [0, 0], 4)]
@@ -0,0 +1,96 @@
+import os
+import sys
+import copy
+import json
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import seq_designer  # noqa: E402
+import incremental_designer  # noqa: E402
+
+JSON_FILES = os.path.join(os.path.dirname(__file__), os.pardir, "json_files")
+SCAFFOLD = os.path.join(os.path.dirname(__file__), os.pardir, "scaffold_files", "M13mp18")
+
+
+def load_design(name):
+    with open(os.path.join(JSON_FILES, name), 'r') as file:
+        data = json.load(file)
+    data['name'] = name
+    return data
+
+
+def break_staple(data, count):
+    """
+    Breaks the staple link after the count-th linked staple base.
+    """
+
+    data = copy.deepcopy(data)
+    helices = {vstrand['num']: vstrand for vstrand in data['vstrands']}
+    for vstrand in data['vstrands']:
+        for index, base in enumerate(vstrand['stap']):
+            if base[2] != -1 and base[2] == vstrand['num']:
+                if count == 0:
+                    following = helices[base[2]]['stap'][base[3]]
+                    helices[base[2]]['stap'][base[3]] = [-1, -1] + following[2:]
+                    vstrand['stap'][index] = base[:2] + [-1, -1]
+                    return data
+                count -= 1
+
+    raise ValueError("design has too few staple links")
+
+
+def assert_same_result(result, expected):
+    assert [strand.letters for strand in result.staples] == [strand.letters for strand in expected.staples]
+    assert [strand.letters for strand in result.scaffolds] == [strand.letters for strand in expected.scaffolds]
+    np.testing.assert_array_equal(result.lookUpScaffold, expected.lookUpScaffold)
+    np.testing.assert_array_equal(result.lookUpStaple, expected.lookUpStaple)
+    assert result.warnings == expected.warnings
+
+    quality, expected_quality = result.quality, expected.quality
+    for name in ['staple', 'rule', 'position', 'value']:
+        np.testing.assert_array_equal(getattr(quality, name), getattr(expected_quality, name))
+
+    np.testing.assert_allclose(result.stapleTm, expected.stapleTm)
+    for tms, expected_tms in zip(result.domainTm, expected.domainTm):
+        np.testing.assert_allclose(tms, expected_tms)
+
+    if expected.offTargets is None:
+        assert result.offTargets is None
+    else:
+        for counts, expected_counts in zip(result.offTargets, expected.offTargets):
+            np.testing.assert_array_equal(counts, expected_counts)
+
+
+def test_redesign_after_edit(tmp_path):
+    scaffold = seq_designer.RawScaffoldSequence(SCAFFOLD)
+    data = load_design("octahedron_short_5_2.json")
+    path = str(tmp_path / "state.npz")
+
+    incremental_designer.save_state(path, incremental_designer.redesign(data, scaffold, None))
+
+    for count in [0, 5]:
+        data = break_staple(data, count)
+        result = incremental_designer.redesign(data, scaffold, incremental_designer.load_state(path))
+
+        assert_same_result(result, seq_designer.design(data, scaffold))
+        assert 0 < sum(result.changedStaples) < len(result.staples)
+        incremental_designer.save_state(path, result)
+
+
+def test_redesign_after_option_change(tmp_path):
+    scaffold = seq_designer.RawScaffoldSequence(SCAFFOLD)
+    data = load_design("test_virtual.json")
+    path = str(tmp_path / "state.npz")
+
+    incremental_designer.save_state(path, incremental_designer.redesign(data, scaffold, None))
+
+    # The other scaffolds avoid the k-mers of the scaffold with offTarget
+    for options in [dict(offTarget=8), dict(offTarget=8, rules=None, conditions={'magnesium': 0.02}),
+                    dict(offset=7)]:
+        result = incremental_designer.redesign(data, scaffold, incremental_designer.load_state(path),
+                                               **options)
+
+        assert_same_result(result, seq_designer.design(data, scaffold, **options))
+        incremental_designer.save_state(path, result)
@@ -0,0 +1,85 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import seq_designer  # noqa: E402
+import offset_scan  # noqa: E402
+
+PACKAGE = os.path.join(os.path.dirname(__file__), os.pardir)
+
+
+def staple_metrics(result, window=8, window_gc=(0.2, 0.8), staple_gc=(0.3, 0.7)):
+    """
+    Returns the extreme GC staples, GC windows, excess run letters and Tm
+    spread of the staples of a design, one staple at a time.
+    """
+
+    extreme_gc = gc_windows = runs = 0
+    tms = []
+    lengths = []
+    for staple in result.staples:
+        sequence = staple.sequence
+        if len(sequence) == 0:
+            continue
+
+        gc = sum(letter in "GC" for letter in sequence)
+        extreme_gc += not staple_gc[0] <= gc / len(sequence) <= staple_gc[1]
+
+        for start in range(len(sequence) - window + 1):
+            window_count = sum(letter in "GC" for letter in sequence[start:start + window])
+            gc_windows += not window_gc[0] * window <= window_count <= window_gc[1] * window
+
+        start = 0
+        while start < len(sequence):
+            end = start
+            while end < len(sequence) and sequence[end] == sequence[start]:
+                end += 1
+            if sequence[start] in "ACGT":
+                runs += max(0, end - start - offset_scan.MAX_RUNS["ACGT".index(sequence[start])])
+            start = end
+
+        tms.append(offset_scan.tm_proxy(gc, len(sequence)))
+        lengths.append(len(sequence))
+
+    weights = np.array(lengths) / sum(lengths)
+    tms = np.array(tms)
+
+    return extreme_gc, gc_windows, runs, np.sqrt(weights @ (tms - weights @ tms) ** 2)
+
+
+@pytest.mark.parametrize("name", ["small_onebreak_loop.json", "small_onebreak_deletion.json",
+                                  "test_virtual.json", "tube_twobreak.json", "octahedron_short_5_2.json"])
+def test_metrics_equal_design(name):
+    cadnano = os.path.join(PACKAGE, "json_files", name)
+    scaffold = seq_designer.RawScaffoldSequence(os.path.join(PACKAGE, "scaffold_files", "M13mp18"))
+    offsets = [0, 1, 17, 4000, len(scaffold) - 3]
+
+    # Small blocks, so the offsets are scored in several blocks
+    scores = offset_scan.score_offsets(offset_scan.staple_letter_map(cadnano, scaffold), scaffold, offsets,
+                                       block_letters=100)
+
+    for i, offset in enumerate(offsets):
+        extreme_gc, gc_windows, runs, tm_spread = staple_metrics(seq_designer.design(cadnano, scaffold,
+                                                                                     offset=offset))
+
+        assert scores['extreme_gc'][i] == extreme_gc
+        assert scores['gc_windows'][i] == gc_windows
+        assert scores['runs'][i] == runs
+        assert scores['tm_spread'][i] == pytest.approx(tm_spread)
+
+
+def test_scan_ranks_by_score():
+    cadnano = os.path.join(PACKAGE, "json_files", "tube_onebreak.json")
+    scaffold = seq_designer.RawScaffoldSequence(os.path.join(PACKAGE, "scaffold_files", "M13mp18"))
+
+    ranking = offset_scan.scan_offsets(cadnano, scaffold, top=5, offsets=np.arange(0, len(scaffold), 7))
+
+    assert len(ranking) == 5
+    assert [entry['score'] for entry in ranking] == sorted(entry['score'] for entry in ranking)
+    for entry in ranking:
+        assert entry['score'] == pytest.approx(sum(weight * entry[name]
+                                                   for name, weight in offset_scan.SCORE_WEIGHTS.items()))
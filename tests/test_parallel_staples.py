@@ -0,0 +1,57 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import seq_designer  # noqa: E402
+import parallel_staples  # noqa: E402
+from benchmark import synthetic_design  # noqa: E402
+
+PACKAGE = os.path.join(os.path.dirname(__file__), os.pardir)
+
+
+def scaffold():
+    return seq_designer.RawScaffoldSequence(os.path.join(PACKAGE, "scaffold_files", "P8634"))
+
+
+def assert_same_staples(result, expected):
+    assert [staple.letters for staple in result.staples] == [staple.letters for staple in expected.staples]
+    for staple, expected_staple in zip(result.staples, expected.staples):
+        np.testing.assert_array_equal(staple.helices, expected_staple.helices)
+        np.testing.assert_array_equal(staple.indices, expected_staple.indices)
+        np.testing.assert_array_equal(staple.offsets, expected_staple.offsets)
+    np.testing.assert_array_equal(result.lookUpStaple, expected.lookUpStaple)
+    assert result.stapleLoops == expected.stapleLoops
+
+
+@pytest.mark.parametrize("cadnano", [
+    synthetic_design(8, 256, skip_density=0.02, loop_density=0.02, tile=8),
+    os.path.join(PACKAGE, "json_files", "small_onebreak_loop.json"),
+    os.path.join(PACKAGE, "json_files", "octa_long_5_4_28_5.json"),
+])
+def test_parallel_equals_serial(cadnano, monkeypatch):
+    serial = seq_designer.design(cadnano, scaffold())
+
+    # Small chunks, so the staples are split over several processes
+    monkeypatch.setattr(parallel_staples, "CHUNK_BASES", 7)
+    parallel = seq_designer.design(cadnano, scaffold(), workers=3)
+
+    assert_same_staples(parallel, serial)
+
+
+def test_chunks_hold_whole_staples():
+    staple_bases = [np.arange(start, start + length) for start, length in [(0, 5), (10, 3), (20, 9), (40, 1)]]
+    look_up_scaffold = np.frombuffer(b"ACGT" * 16, dtype=np.uint8).reshape(4, 16).copy()
+    loops = {(1, 4): "TT", (2, 8): "GCA"}
+
+    serial = parallel_staples.sequence_staples(staple_bases, look_up_scaffold, loops,
+                                               seq_designer.COMPLEMENT)
+    for chunk_bases in [1, 4, 6]:
+        parallel = parallel_staples.sequence_staples(staple_bases, look_up_scaffold, loops,
+                                                     seq_designer.COMPLEMENT, workers=3, chunk_bases=chunk_bases)
+        for name in ['base_letters', 'helices', 'indices', 'letters', 'offsets']:
+            np.testing.assert_array_equal(parallel[name], serial[name])
+        assert parallel['invalid'] == -1
@@ -0,0 +1,27 @@
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import scaffold_generator  # noqa: E402
+
+
+def test_sequence_creator_empty():
+    assert scaffold_generator.sequence_creator(0) == ("", 0.0)
+    assert scaffold_generator.sequence_creator(0, rng=scaffold_generator.strand_rng(0, 0)) == ("", 0.0)
+
+
+def test_strand_sequences_empty_strand():
+    sequences = scaffold_generator.strand_sequences([0, 20], [3, 9], seed=1)
+
+    assert sequences[0] == ""
+    assert sequences[1] == scaffold_generator.strand_sequences([20], [9], seed=1)[0]
+
+
+def test_sequence_creator_rules():
+    sequence, gc_percentage = scaffold_generator.sequence_creator(500, rng=random.Random(0))
+
+    assert len(sequence) == 500
+    assert gc_percentage <= 44
+    assert "GGGGG" not in sequence and "CCCCC" not in sequence
@@ -0,0 +1,159 @@
+import os
+import sys
+import json
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import seq_designer  # noqa: E402
+import staple_breaker  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(__file__), os.pardir)
+DESIGN = os.path.join(ROOT, "json_files", "Triangular_BH_4_shorter_ply_6_1.json")
+SCAFFOLD = os.path.join(ROOT, "scaffold_files", "P8634")
+
+
+@pytest.fixture(scope="module")
+def design():
+    return seq_designer.design(DESIGN, seq_designer.RawScaffoldSequence(SCAFFOLD))
+
+
+def straight_staple(letters):
+    """
+    Returns a staple running along helix 0 with one base per letter, 'X'
+    for a skip.
+    """
+
+    letters = bytes(letters, 'ascii')
+    return seq_designer.Strand(np.zeros(len(letters), dtype=np.int32), np.arange(len(letters), dtype=np.int32),
+                               letters, np.arange(len(letters) + 1, dtype=np.int32))
+
+
+def piece_lengths(staple, breaks):
+    """
+    Returns the length of every staple the breaks make, skips not counted.
+    """
+
+    bounds = [0] + breaks + [len(staple)]
+    return [len(staple.letters[staple.offsets[start]:staple.offsets[end]].replace(b'X', b''))
+            for start, end in zip(bounds, bounds[1:])]
+
+
+def assert_allowed(staple, breaks, distance):
+    """
+    Asserts that every break is within a domain, at least distance bases
+    from its ends, and not next to a skip.
+    """
+
+    helices, indices = staple.helices.tolist(), staple.indices.tolist()
+    for base in breaks:
+        for k in range(base - distance, base + distance):
+            assert 0 <= k < len(staple)
+        for k in range(base - distance + 1, base + distance):
+            assert helices[k] == helices[k - 1] and abs(indices[k] - indices[k - 1]) == 1
+        assert staple.BaseLetters(base - 1) != 'X' and staple.BaseLetters(base) != 'X'
+
+
+@pytest.mark.parametrize("targets", [None, {'min_length': 25, 'max_length': 45}])
+def test_broken_staples_within_limits(design, targets):
+    settings = staple_breaker.break_settings(targets)
+
+    breaks, failed = staple_breaker.find_breaks(design.staples, targets)
+
+    assert len(failed) < sum(staple.length > settings['max_length'] for staple in design.staples)
+    for index, (staple, staple_breaks) in enumerate(zip(design.staples, breaks)):
+        if staple.length <= settings['max_length']:
+            assert staple_breaks == []
+            continue
+
+        if index in failed:
+            assert staple_breaks == []
+            continue
+
+        assert staple_breaks == sorted(staple_breaks) and len(staple_breaks) > 0
+        for length in piece_lengths(staple, staple_breaks):
+            assert settings['min_length'] <= length <= settings['max_length']
+        assert_allowed(staple, staple_breaks, settings['min_crossover_distance'])
+
+
+def test_default_targets_break_every_long_staple(design):
+    _, failed = staple_breaker.find_breaks(design.staples)
+
+    assert failed == []
+
+
+def test_straight_staple():
+    staple = straight_staple("ACGT" * 25)
+
+    (breaks,), failed = staple_breaker.find_breaks([staple], {'min_length': 30, 'max_length': 40})
+
+    assert failed == []
+    assert all(30 <= length <= 40 for length in piece_lengths(staple, breaks))
+    assert sum(piece_lengths(staple, breaks)) == 100
+
+
+def test_skips_not_counted():
+    # Seven skips leave 63 bases, too long for a single staple
+    letters = list("ACGT" * 15 + "ACGTACGTAC")
+    for base in range(3, 70, 10):
+        letters[base] = 'X'
+    staple = straight_staple("".join(letters))
+
+    (breaks,), failed = staple_breaker.find_breaks([staple], {'min_length': 20, 'max_length': 62})
+
+    assert failed == []
+    assert staple.length == 63 and len(breaks) > 0
+    assert all(20 <= length <= 62 for length in piece_lengths(staple, breaks))
+    assert_allowed(staple, breaks, 3)
+
+
+def test_unbreakable_staple():
+    # 100 bases can't be split into staples of exactly 30 bases
+    staple = straight_staple("ACGT" * 25)
+    short = straight_staple("ACGT" * 5)
+
+    breaks, failed = staple_breaker.find_breaks([short, staple], {'min_length': 30, 'max_length': 30})
+
+    assert failed == [1]
+    assert breaks == [[], []]
+
+
+def test_selected_staples():
+    staple = straight_staple("ACGT" * 12)
+
+    breaks, failed = staple_breaker.find_breaks([staple, staple], {'min_length': 10, 'max_length': 30},
+                                                selected=[1])
+
+    assert failed == [] and breaks[0] == []
+    assert all(10 <= length <= 30 for length in piece_lengths(staple, breaks[1]))
+
+
+@pytest.mark.parametrize("targets, message", [
+    ({'length': 40}, "Unknown break targets: length"),
+    ({'min_length': 0}, "0 < min_length <= max_length"),
+    ({'min_length': 50, 'max_length': 40}, "0 < min_length <= max_length"),
+])
+def test_bad_targets(targets, message):
+    with pytest.raises(ValueError, match=message):
+        staple_breaker.break_settings(targets)
+
+
+def test_auto_break(tmp_path):
+    scaffold = seq_designer.RawScaffoldSequence(SCAFFOLD)
+
+    result, breaks, failed = staple_breaker.auto_break(DESIGN, scaffold, str(tmp_path),
+                                                       targets={'min_length': 25, 'max_length': 50})
+
+    # Only the staples that couldn't be broken stay too long
+    assert sum(staple.length > 50 for staple in result.staples) == len(failed)
+    assert sum(len(staple_breaks) for staple_breaks in breaks) > 0
+
+    name = "Triangular_BH_4_shorter_ply_6_1_autobreak"
+    with open(os.path.join(str(tmp_path), name + ".json"), 'r') as json_data:
+        broken = json.load(json_data)
+    assert len(seq_designer.design(broken, scaffold).staples) == len(result.staples)
+
+    with pytest.raises(seq_designer.InputError):
+        staple_breaker.auto_break(DESIGN, scaffold, str(tmp_path), targets={'length': 40})
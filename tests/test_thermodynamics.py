@@ -0,0 +1,88 @@
+import os
+import sys
+import math
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import thermodynamics  # noqa: E402
+
+# Published SantaLucia (1998) unified parameters of every nearest-neighbor
+# pair, enthalpy in kcal/mol and entropy in cal/(K mol)
+SANTALUCIA = {
+    "AA": (-7.9, -22.2), "TT": (-7.9, -22.2), "AT": (-7.2, -20.4), "TA": (-7.2, -21.3),
+    "CA": (-8.5, -22.7), "TG": (-8.5, -22.7), "GT": (-8.4, -22.4), "AC": (-8.4, -22.4),
+    "CT": (-7.8, -21.0), "AG": (-7.8, -21.0), "GA": (-8.2, -22.2), "TC": (-8.2, -22.2),
+    "CG": (-10.6, -27.2), "GC": (-9.8, -24.4), "GG": (-8.0, -19.9), "CC": (-8.0, -19.9),
+}
+
+# Initiation with a terminal G/C or A/T base
+INITIATION = {"G": (0.1, -2.8), "C": (0.1, -2.8), "A": (2.3, 4.1), "T": (2.3, 4.1)}
+
+ONE_MOLAR = {'sodium': 1.0, 'magnesium': 0.0}
+
+
+def reverse_complement(sequence):
+    return sequence[::-1].translate(str.maketrans("ACGT", "TGCA"))
+
+
+def test_nearest_neighbor_table():
+    for pair, (enthalpy, entropy) in SANTALUCIA.items():
+        codes = ["ACGT".index(letter) for letter in pair]
+        assert thermodynamics.NN_ENTHALPY[codes[0], codes[1]] == enthalpy
+        assert thermodynamics.NN_ENTROPY[codes[0], codes[1]] == entropy
+
+
+@pytest.mark.parametrize("sequence", ["CGTTGA", "GCGCATATGCGC", "AAAAAAAAAAAAAAAAAAAA", "ACGTTGCAAGCTTAGCCTAG"])
+def test_sequence_at_one_molar(sequence):
+    pairs = [SANTALUCIA[sequence[i:i + 2]] for i in range(len(sequence) - 1)]
+    enthalpy = sum(pair[0] for pair in pairs) + INITIATION[sequence[0]][0] + INITIATION[sequence[-1]][0]
+    entropy = sum(pair[1] for pair in pairs) + INITIATION[sequence[0]][1] + INITIATION[sequence[-1]][1]
+    concentration = 100e-9 - 10e-9 / 2
+    tm = enthalpy * 1000 / (entropy + thermodynamics.GAS_CONSTANT * math.log(concentration)) - 273.15
+
+    result = thermodynamics.sequence_thermodynamics(sequence, **ONE_MOLAR)
+
+    assert result['enthalpy'][0] == pytest.approx(enthalpy)
+    assert result['entropy'][0] == pytest.approx(entropy)
+    assert result['tm'][0] == pytest.approx(tm)
+
+
+def test_cgttga():
+    # Five pairs and two ends summed by hand from the table above
+    result = thermodynamics.sequence_thermodynamics("CGTTGA", **ONE_MOLAR)
+
+    assert result['enthalpy'][0] == pytest.approx(-41.2)
+    assert result['entropy'][0] == pytest.approx(-115.4)
+    assert result['enthalpy'][0] - 310.15 * result['entropy'][0] / 1000 == pytest.approx(-5.41, abs=0.01)
+
+
+def test_reverse_complement_has_same_tm():
+    sequences = ["ACGTTGCAAGCTTAGCCTAGGATC", "GGGATTTACCAGT"]
+
+    tm = thermodynamics.sequence_thermodynamics(sequences)['tm']
+
+    np.testing.assert_allclose(tm, thermodynamics.sequence_thermodynamics(
+        [reverse_complement(sequence) for sequence in sequences])['tm'])
+
+
+def test_salt_and_skips():
+    sequence = "ACGTTGCAAGCTTAGCCTAG"
+
+    low = thermodynamics.sequence_thermodynamics(sequence, magnesium=0.005)['tm'][0]
+    high = thermodynamics.sequence_thermodynamics(sequence, magnesium=0.02)['tm'][0]
+    assert low < high < thermodynamics.sequence_thermodynamics(sequence, **ONE_MOLAR)['tm'][0]
+
+    # Skipped letters are left out, segments of one base have no Tm
+    result = thermodynamics.sequence_thermodynamics([sequence[:7] + "X" + sequence[7:], "A"])
+    assert result['tm'][0] == pytest.approx(thermodynamics.sequence_thermodynamics(sequence)['tm'][0])
+    assert np.isnan(result['tm'][1])
+
+
+def test_invalid_conditions():
+    with pytest.raises(ValueError):
+        thermodynamics.sequence_thermodynamics("ACGT", sodium=0.0, magnesium=0.0)
+    with pytest.raises(ValueError):
+        thermodynamics.sequence_thermodynamics("ACGT", strand_concentration=1e-9)
@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import seq_designer  # noqa: E402
+from topology_cache import TopologyCache  # noqa: E402
+
+JSON_FILES = os.path.join(os.path.dirname(__file__), os.pardir, "json_files")
+DESIGN = os.path.join(JSON_FILES, "small_onebreak_loop.json")
+
+
+def assert_same_topology(first, second):
+    for name, array in first.ToArrays().items():
+        np.testing.assert_array_equal(array, second.ToArrays()[name])
+
+
+def test_miss_then_hit(tmp_path):
+    cache = TopologyCache(str(tmp_path))
+    key = cache.key(DESIGN)
+
+    assert cache.load(key) is None
+
+    stored = seq_designer.FindTopology(DESIGN, cache=cache)
+
+    assert cache.load(key) is not None
+    assert_same_topology(stored, seq_designer.FindTopology(DESIGN))
+
+
+def test_hit_never_parses(tmp_path, monkeypatch):
+    seq_designer.FindTopology(DESIGN, cache=TopologyCache(str(tmp_path)))
+
+    def fail(*args, **kwargs):
+        raise AssertionError("parsed on a cache hit")
+
+    monkeypatch.setattr(json, "load", fail)
+    monkeypatch.setattr(seq_designer, "ParseJson", fail)
+
+    # A fresh cache object has no digests in memory
+    cached = seq_designer.FindTopology(DESIGN, cache=TopologyCache(str(tmp_path)))
+
+    monkeypatch.undo()
+    assert_same_topology(cached, seq_designer.FindTopology(DESIGN))
+
+
+def test_key_changes_with_file(tmp_path):
+    cache = TopologyCache(str(tmp_path / "cache"))
+    design = tmp_path / "design.json"
+
+    with open(DESIGN, 'r') as file:
+        data = json.load(file)
+    design.write_text(json.dumps(data))
+    first = cache.key(str(design))
+
+    data['vstrands'][0]['scaf'][0] = [-1, -1, -1, -1]
+    design.write_text(json.dumps(data) + " ")
+    os.utime(str(design), ns=(0, 0))
+
+    assert cache.key(str(design)) != first
+    assert cache.key(str(design), options=0) != cache.key(str(design))
+
+
+def test_data_key_ignores_metadata(tmp_path):
+    cache = TopologyCache(str(tmp_path))
+
+    with open(DESIGN, 'r') as file:
+        data = json.load(file)
+    renamed = dict(data, name="renamed")
+
+    assert cache.key(data) == cache.key(renamed)
+
+
+def test_eviction(tmp_path):
+    cache = TopologyCache(str(tmp_path), max_entries=2)
+
+    for number in range(3):
+        cache.store(str(number), {'a': np.arange(number + 1)})
+        os.utime(cache.path(str(number)), (number, number))
+    cache.evict()
+
+    assert cache.load("0") is None
+    np.testing.assert_array_equal(cache.load("2")['a'], np.arange(3))
+    assert sorted(os.listdir(str(tmp_path))) == ["1.npz", "2.npz"]
+
+
+def test_unreadable_entry_is_removed(tmp_path):
+    cache = TopologyCache(str(tmp_path))
+    with open(cache.path("broken"), 'wb') as file:
+        file.write(b"not a zip file")
+
+    assert cache.load("broken") is None
+    assert not os.path.exists(cache.path("broken"))
@@ -0,0 +1,92 @@
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import seq_designer  # noqa: E402
+
+DESIGN = os.path.join(os.path.dirname(__file__), os.pardir, "json_files", "small_onebreak.json")
+
+
+def problems(change):
+    """
+    Returns the problems of the example design after change.
+    """
+
+    with open(DESIGN, 'r') as file:
+        data = json.load(file)
+    change(data['vstrands'])
+
+    with pytest.raises(seq_designer.ValidationError) as error:
+        seq_designer.ParseJson(data)
+
+    return error.value.problems
+
+
+def test_every_problem_is_reported():
+    def change(vstrands):
+        vstrands[0]['stap'][3] = [0, 2, 7, 4]
+        vstrands[1]['scaf'][5] = [1, 4, 1, -1]
+        vstrands[0]['skip'][2] = 2
+
+    # Ordered by location
+    assert problems(change) == [
+        "0[2]: staple previous base does not point back to this base",
+        "0[2]: skip is not 0 or -1",
+        "0[3]: staple previous base does not point back to this base",
+        "0[3]: staple next base is on helix 7, which is not in json file",
+        "0[4]: staple next base does not point back to this base",
+        "1[4]: scaffold previous base does not point back to this base",
+        "1[5]: scaffold previous base does not point back to this base",
+        "1[5]: scaffold next base is only partly specified",
+        "1[6]: scaffold next base does not point back to this base",
+    ]
+
+
+@pytest.mark.parametrize("num, problem", [
+    ("a", "Helix 0 in json file has number 'a', which is not an integer"),
+    (1.5, "Helix 0 in json file has number 1.5, which is not an integer"),
+    (2 ** 40, "Helix 0 in json file has number 1099511627776, which is out of range"),
+])
+def test_bad_helix_number(num, problem):
+    def change(vstrands):
+        vstrands[0]['num'] = num
+
+    assert problems(change) == [problem]
+
+
+@pytest.mark.parametrize("value, problem", [
+    (1.5, "Helix 0: stap has a value which is not an integer"),
+    (2 ** 40, "Helix 0: stap has a value which is out of range"),
+    (2 ** 80, "Helix 0: stap has a value which is out of range"),
+    ("a", "Helix 0: stap has a value which is not an integer"),
+])
+def test_bad_index(value, problem):
+    def change(vstrands):
+        vstrands[0]['stap'][3] = [0, value, 0, 4]
+        vstrands[1]['loop'][0] = 0.5
+
+    assert problems(change) == [problem, "Helix 1: loop has a value which is not an integer"]
+
+
+def test_bad_shapes():
+    def change(vstrands):
+        vstrands[0]['stap'][3] = [0, 2, 0]
+        vstrands[1]['skip'][1] = [0]
+
+    assert problems(change) == ["Helix 0: stap is not a list of [helix, index, helix, index] blocks",
+                                "Helix 1: skip is not a list of numbers"]
+
+
+def test_different_lengths():
+    def change(vstrands):
+        vstrands[1]['loop'].append(0)
+        del vstrands[0]['skip']
+
+    length = len(seq_designer.LoadJson(DESIGN)['vstrands'][0]['scaf'])
+
+    assert problems(change) == ["Helix 0: no skip data",
+                                "Helix 1: loop has " + str(length + 1) + " bases, expected " + str(length)]
@@ -0,0 +1,122 @@
+import numpy as np
+from sequence_metrics import pack_sequences
+
+
+# Gas constant in cal/(K mol)
+GAS_CONSTANT = 1.9872
+
+# SantaLucia (1998) unified nearest-neighbor parameters, indexed by the
+# base codes (A=0, C=1, G=2, T=3) of the 5' and 3' base of every pair.
+# Enthalpy in kcal/mol, entropy in cal/(K mol).
+NN_ENTHALPY = np.array([
+    # A     C     G     T
+    [-7.9, -8.4, -7.8, -7.2],   # A
+    [-8.5, -8.0, -10.6, -7.8],  # C
+    [-8.2, -9.8, -8.0, -8.4],   # G
+    [-7.2, -8.2, -8.5, -7.9],   # T
+])
+NN_ENTROPY = np.array([
+    # A      C      G      T
+    [-22.2, -22.4, -21.0, -20.4],  # A
+    [-22.7, -19.9, -27.2, -21.0],  # C
+    [-22.2, -24.4, -19.9, -22.4],  # G
+    [-21.3, -22.2, -22.7, -22.2],  # T
+])
+
+# Initiation with a terminal A/T or G/C base, per end, by base code
+INIT_ENTHALPY = np.array([2.3, 0.1, 0.1, 2.3])
+INIT_ENTROPY = np.array([4.1, -2.8, -2.8, 4.1])
+
+# Default conditions of a DNA origami folding buffer, in mol/L
+DEFAULT_CONDITIONS = {
+    'sodium': 0.005,
+    'magnesium': 0.0125,
+    'strand_concentration': 100e-9,
+    'complement_concentration': 10e-9,
+}
+
+
+def sodium_equivalent(sodium, magnesium):
+    """
+    Returns the sodium concentration equivalent to the given sodium and
+    magnesium concentrations in mol/L, after von Ahsen et al. (2001).
+    """
+
+    return sodium + 120 * np.sqrt(magnesium * 1000) / 1000
+
+
+def segment_thermodynamics(codes, starts, ends, sodium=0.005, magnesium=0.0125,
+                           strand_concentration=100e-9, complement_concentration=10e-9):
+    """
+    Computes the duplex enthalpy (kcal/mol), entropy (cal/(K mol)) and
+    melting temperature (degrees Celsius) of every segment codes[start:end]
+    of packed base codes with its complement, all segments at once.
+    Letters other than ACGT (i.e. X for skips) are left out. The entropy
+    is corrected for the sodium equivalent of the salt concentrations. The
+    strand is taken to be in excess over its complement, concentrations in
+    mol/L. Segments of fewer than two bases get nan.
+    Returns a dictionary with arrays enthalpy, entropy and tm.
+    """
+
+    if sodium_equivalent(sodium, magnesium) <= 0:
+        raise ValueError("Salt concentration has to be positive")
+    concentration = strand_concentration - complement_concentration / 2
+    if concentration <= 0:
+        raise ValueError("Strand concentration has to exceed half the complement concentration")
+
+    codes = np.asarray(codes)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+
+    # Leave out other letters, segment bounds move along
+    keep = codes < 4
+    cum_keep = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(keep, out=cum_keep[1:])
+    codes = codes[keep].astype(np.int64)
+    starts = cum_keep[starts]
+    ends = cum_keep[ends]
+
+    # Segments of fewer than two bases point at a dummy base
+    valid = ends - starts >= 2
+    if len(codes) == 0:
+        codes = np.zeros(1, dtype=np.int64)
+    first = np.where(valid, starts, 0)
+    last = np.where(valid, ends - 1, 0)
+
+    # Prefix sums of the parameters of every pair of neighbors
+    cum_enthalpy = np.zeros(len(codes), dtype=np.float64)
+    cum_entropy = np.zeros(len(codes), dtype=np.float64)
+    np.cumsum(NN_ENTHALPY[codes[:-1], codes[1:]], out=cum_enthalpy[1:])
+    np.cumsum(NN_ENTROPY[codes[:-1], codes[1:]], out=cum_entropy[1:])
+
+    # Pairs within the segment, plus initiation at both ends
+    enthalpy = cum_enthalpy[last] - cum_enthalpy[first] + \
+        INIT_ENTHALPY[codes[first]] + INIT_ENTHALPY[codes[last]]
+    entropy = cum_entropy[last] - cum_entropy[first] + \
+        INIT_ENTROPY[codes[first]] + INIT_ENTROPY[codes[last]]
+
+    # Salt correction per phosphate
+    entropy = entropy + 0.368 * (ends - starts - 1) * \
+        np.log(sodium_equivalent(sodium, magnesium))
+
+    tm = enthalpy * 1000 / (entropy + GAS_CONSTANT * np.log(concentration)) - 273.15
+
+    enthalpy = np.where(valid, enthalpy, np.nan)
+    entropy = np.where(valid, entropy, np.nan)
+    tm = np.where(valid, tm, np.nan)
+
+    return {'enthalpy': enthalpy, 'entropy': entropy, 'tm': tm}
+
+
+def sequence_thermodynamics(sequences, **conditions):
+    """
+    Computes enthalpy, entropy and melting temperature of a sequence or a
+    list of sequences, see segment_thermodynamics for the conditions.
+    """
+
+    if isinstance(sequences, str):
+        sequences = [sequences]
+
+    codes, starts, lengths = pack_sequences(sequences)
+
+    return segment_thermodynamics(codes, starts, starts + lengths, **conditions)
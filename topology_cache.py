@@ -0,0 +1,154 @@
+import os
+import json
+import hashlib
+import zipfile
+import numpy as np
+
+
+# Bumped whenever the stored arrays or the key change, old entries are
+# never matched
+CACHE_VERSION = 2
+
+
+class TopologyCache:
+    """
+    Content addressed on-disk cache of arrays, one uncompressed .npz file
+    per entry in directory. Entries are keyed by the hash of the design
+    file or data. The least recently used entries are removed once there are more
+    than max_entries or they take more than max_bytes.
+    """
+
+    def __init__(self, directory, max_entries=64, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._file_digests = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, cadnano, options=None):
+        """
+        Returns the key of a design and of the options the topology was
+        built with. A design given as path is keyed by the sha256 of the
+        file, so a hit never reads the json. Already loaded json data is
+        keyed by its vstrands in canonical json.
+        """
+
+        digest = hashlib.sha256(
+            (str(CACHE_VERSION) + '\n' + repr(options) + '\n').encode())
+
+        if isinstance(cadnano, dict):
+            digest.update(b'vstrands\n')
+            digest.update(json.dumps(cadnano.get('vstrands'), sort_keys=True,
+                                     separators=(',', ':')).encode())
+        else:
+            digest.update(b'file\n')
+            digest.update(self.file_digest(cadnano))
+
+        return digest.hexdigest()
+
+    def file_digest(self, fileName):
+        """
+        Returns the sha256 of a file. Digests are remembered by path,
+        modification time and size, so unchanged files are hashed once.
+        """
+
+        status = os.stat(fileName)
+        stamp = (os.path.abspath(fileName), status.st_mtime_ns, status.st_size)
+
+        digest = self._file_digests.get(stamp)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(fileName, 'rb') as file:
+                for block in iter(lambda: file.read(1 << 20), b''):
+                    sha.update(block)
+            digest = sha.digest()
+            self._file_digests[stamp] = digest
+
+        return digest
+
+    def path(self, key):
+        """
+        Returns the file of an entry.
+        """
+
+        return os.path.join(self.directory, key + ".npz")
+
+    def load(self, key):
+        """
+        Returns the arrays stored under key as dictionary, or None if there
+        is no such entry. Entries that can't be read are removed.
+        """
+
+        path = self.path(key)
+
+        try:
+            with np.load(path) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            self.remove(path)
+            return None
+
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return arrays
+
+    def store(self, key, arrays):
+        """
+        Stores a dictionary of arrays under key. The entry is written to a
+        temporary file first, so other processes never see a partial entry,
+        and removed if writing fails.
+        """
+
+        path = self.path(key)
+        temporary_path = path + "." + str(os.getpid()) + ".tmp"
+
+        # A failed write leaves no temporary file behind
+        try:
+            with open(temporary_path, 'wb') as file:
+                np.savez(file, **arrays)
+            os.replace(temporary_path, path)
+        finally:
+            self.remove(temporary_path)
+
+        self.evict()
+
+    def remove(self, path):
+        """
+        Removes an entry, ignoring entries that are already gone.
+        """
+
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache holds at
+        most max_entries and max_bytes.
+        """
+
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npz"):
+                continue
+            try:
+                status = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((status.st_mtime, status.st_size, name))
+
+        # Most recently used first
+        entries.sort(reverse=True)
+
+        total = 0
+        for count, (_, size, name) in enumerate(entries):
+            total += size
+            if count >= self.max_entries or total > self.max_bytes:
+                self.remove(os.path.join(self.directory, name))